@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compare the JSON libraries ``djangocanvas.api.codec`` may use on payloads shaped like
+those of the Graph API and the VK API.
+
+Usage: python benchmarks/json_codecs.py [--number N]
+"""
+import optparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from djangocanvas.api import codec
+
+
+def graph_friends(count):
+    """A page of friends, as returned for /me/friends?fields=id,name,picture."""
+    return {
+        'data': [{
+            'id': str(100000000000000 + i),
+            'name': u'Friend Number %d' % i,
+            'picture': {'data': {
+                'url': 'https://fbcdn-profile-a.akamaihd.net/hprofile-ak-ash4/%d_q.jpg' % i,
+                'is_silhouette': i % 7 == 0
+            }}
+        } for i in range(count)],
+        'paging': {'next': 'https://graph.facebook.com/100000000000000/friends?limit=%d&offset=%d' % (count, count)}
+    }
+
+
+def graph_batch(count):
+    """A batch response, whose bodies are JSON documents themselves."""
+    return [{
+        'code': 200,
+        'headers': [{'name': 'Content-Type', 'value': 'text/javascript; charset=UTF-8'}],
+        'body': codec.dumps({'id': str(100000000000000 + i), 'name': u'User %d' % i, 'locale': 'ru_RU'})
+    } for i in range(count)]
+
+
+def vk_profiles(count):
+    """A getProfiles response with the fields requested on application launch."""
+    return {'response': [{
+        'uid': 1000 + i,
+        'first_name': u'Павел',
+        'last_name': u'Дуров',
+        'nickname': u'',
+        'domain': 'id%d' % (1000 + i),
+        'sex': 2,
+        'bdate': '10.10.1984',
+        'city': 2,
+        'country': 1,
+        'timezone': 3,
+        'photo': 'http://cs10000.vk.me/u%d/e_%08x.jpg' % (1000 + i, i),
+        'photo_medium': 'http://cs10000.vk.me/u%d/b_%08x.jpg' % (1000 + i, i),
+        'photo_big': 'http://cs10000.vk.me/u%d/a_%08x.jpg' % (1000 + i, i),
+        'has_mobile': 1,
+        'university': 1,
+        'university_name': u'СПбГУ',
+        'graduation': 2006
+    } for i in range(count)]}
+
+
+PAYLOADS = [
+    ('graph friends (25)', graph_friends(25)),
+    ('graph friends (5000)', graph_friends(5000)),
+    ('graph batch (50)', graph_batch(50)),
+    ('vk profiles (1)', vk_profiles(1)),
+    ('vk profiles (1000)', vk_profiles(1000)),
+]
+
+
+def available_backends():
+    backends = []
+
+    for name in codec.BACKENDS:
+        try:
+            __import__(name)
+        except ImportError:
+            continue
+        backends.append(name)
+
+    return backends
+
+
+def measure(function, number):
+    """Return the best time of three runs of ``number`` calls, per call, in microseconds."""
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--number', type='int', default=100,
+                      help='How many times to encode and decode a 1 KB payload per run; '
+                           'larger payloads are processed proportionally fewer times.')
+    options, args = parser.parse_args()
+
+    backends = available_backends()
+
+    print '%-24s %-12s %12s %12s' % ('payload', 'backend', 'loads (us)', 'dumps (us)')
+
+    try:
+        for label, payload in PAYLOADS:
+            document = codec.dumps(payload)
+
+            number = max(1, options.number * 1000 / len(document))
+
+            for name in backends:
+                codec.use(name)
+                print '%-24s %-12s %12.1f %12.1f' % (
+                    label, name,
+                    measure(lambda: codec.loads(document), number),
+                    measure(lambda: codec.dumps(payload), number))
+    finally:
+        codec.use()
+
+
+if __name__ == '__main__':
+    main()
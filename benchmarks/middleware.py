@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Drive requests through djangocanvas' middleware in scenarios met by Facebook and VK
+canvas applications, against in-memory stubs of the Graph API and the VK API, and
+report requests per second, latency percentiles, database queries and outbound
+API calls per scenario.
+
+Requests go through Django's request handler with the middleware of a typical
+canvas application installed (sessions, ``IFrameFixMiddleware``, ``VkontakteMiddleware``,
+``FacebookMiddleware`` and ``SocialAuthenticationMiddleware``) to a view that looks up
+the social user. Deferred work runs immediately, so outbound calls it makes are
+counted against the request that deferred it.
+
+Results may be written as JSON with ``--output`` and compared to an earlier run
+with ``--baseline``.
+
+Usage: python benchmarks/middleware.py [--number N] [--scenario NAME ...] [--output FILE] [--baseline FILE]
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import optparse
+import os
+import platform
+import sys
+import time
+import timeit
+from hashlib import md5
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from django.conf import settings
+
+settings.configure(
+    DEBUG=True,
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.sessions', 'djangocanvas'],
+    MIDDLEWARE_CLASSES=[
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'djangocanvas.middleware.IFrameFixMiddleware',
+        'djangocanvas.middleware.VkontakteMiddleware',
+        'djangocanvas.middleware.FacebookMiddleware',
+        'djangocanvas.middleware.SocialAuthenticationMiddleware',
+    ],
+    ROOT_URLCONF=__name__,
+    SECRET_KEY='benchmark',
+    FACEBOOK_APPLICATION_ID='508667665812571',
+    FACEBOOK_APPLICATION_SECRET_KEY='ca52168c97e17814113fbd686e576621',
+    FACEBOOK_APPLICATION_NAMESPACE='benchmark',
+    VK_APP_ID='2912345',
+    VK_APP_SECRET='AbCdEfGhIjKlMnOpQrSt',
+    DJANGOCANVAS_DEFERRED_BACKEND='djangocanvas.deferred.ImmediateBackend',
+)
+
+import django
+
+from django.conf.urls.defaults import patterns, url
+from django.core.handlers.base import BaseHandler
+from django.core.management import call_command
+from django.db import connection, reset_queries
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+
+from djangocanvas.api import codec
+from djangocanvas.api.facepy import graph_api
+from djangocanvas.api.vkontakte import http
+
+
+CHROME = ('Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.11 '
+          '(KHTML, like Gecko) Chrome/23.0.1271.97 Safari/537.11')
+SAFARI = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_2) AppleWebKit/536.26.17 '
+          '(KHTML, like Gecko) Version/6.0.2 Safari/536.26.17')
+
+
+def canvas(request):
+    social_user = request.social_user
+    return HttpResponse(social_user.first_name if social_user else u'')
+
+
+urlpatterns = patterns('', url(r'^canvas/$', canvas))
+
+
+class Handler(BaseHandler):
+    """Django's request handler, short of the signals that would close the in-memory database."""
+
+    def __init__(self):
+        super(Handler, self).__init__()
+        self.load_middleware()
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+
+class NullHandler(logging.Handler):
+    """A logging handler discarding records; ``logging.NullHandler`` is missing from Python 2.6."""
+
+    def emit(self, record):
+        pass
+
+
+class Stubs(object):
+    """In-memory stand-ins for the Graph API and the VK API, counting the calls made to them."""
+
+    def __init__(self):
+        self.calls = {'graph': 0, 'vkontakte': 0}
+
+    def install(self):
+        graph_api.sessions.request = self.graph
+        http.pool.request = self.vkontakte
+
+    def graph(self, url, session, method, request_url, **kwargs):
+        self.calls['graph'] += 1
+
+        if request_url.endswith('/oauth/access_token'):
+            return StubResponse('access_token=AAAExtended%d&expires=5184000' % self.calls['graph'])
+
+        return StubResponse(codec.dumps({'id': '100001842170709', 'first_name': 'Ivan', 'last_name': 'Ivanov',
+                                         'locale': 'ru_RU'}))
+
+    def vkontakte(self, url, data, headers, timeout, secure=False, on_retry=None):
+        self.calls['vkontakte'] += 1
+        return 200, codec.dumps({'response': []})
+
+
+class StubResponse(object):
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+
+def signed_request(user_id, expires, secret=settings.FACEBOOK_APPLICATION_SECRET_KEY):
+    """A signed request like those Facebook posts to canvas pages of applications users have authorized."""
+    payload = base64.urlsafe_b64encode(codec.dumps({
+        'algorithm': 'HMAC-SHA256',
+        'user_id': str(user_id),
+        'oauth_token': 'AAAHOoWuHjFsBA%d' % user_id,
+        'issued_at': int(expires - 7200),
+        'expires': int(expires),
+        'user': {'country': 'ru', 'locale': 'ru_RU', 'age': {'min': 21}}
+    })).rstrip('=')
+    signature = base64.urlsafe_b64encode(hmac.new(secret, payload, hashlib.sha256).digest())
+    return '%s.%s' % (signature.rstrip('='), payload)
+
+
+def vk_launch_parameters(viewer_id, secret=settings.VK_APP_SECRET):
+    """Parameters as VK passes them to an application launched from a user's page."""
+    return {
+        'api_url': 'http://api.vk.com/api.php',
+        'api_id': settings.VK_APP_ID,
+        'api_settings': '8199',
+        'viewer_id': str(viewer_id),
+        'viewer_type': '2',
+        'sid': '5a1fa3d9e0c2f0c4d4e1f5a0b4c2d6e8f1a3b5c7d9e0f2a4b6c8d0e2f4a6b8c0d2e4f6',
+        'secret': 'a1b2c3d4e5',
+        'access_token': '533bacf01e11f55b536a565b57531ac114461ae8736d6506a3%d' % viewer_id,
+        'user_id': '0',
+        'group_id': '0',
+        'is_app_user': '1',
+        'auth_key': md5('%s_%d_%s' % (settings.VK_APP_ID, viewer_id, secret)).hexdigest(),
+        'language': '0',
+        'referrer': 'profile',
+        'api_result': codec.dumps({'response': [{'uid': viewer_id, 'first_name': u'Павел', 'last_name': u'Дуров'}]}),
+    }
+
+
+class Scenario(object):
+    """
+    A kind of request, built anew for every iteration by ``request(i)``.
+
+    ``prepare`` is run once before the scenario is measured, for instance to launch
+    the application so that later requests carry a session cookie.
+    """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+    def prepare(self, handler):
+        pass
+
+    def request(self, i):
+        raise NotImplementedError
+
+
+class FacebookFirstLaunch(Scenario):
+    # A Facebook user who has just authorized the application; the user is created and
+    # his/her profile is fetched and OAuth token extended.
+    def request(self, i):
+        return factory.post('/canvas/', {'signed_request': signed_request(200000000000 + i, time.time() + 7200)},
+                            HTTP_USER_AGENT=CHROME)
+
+
+class FacebookRepeatLaunch(Scenario):
+    # A Facebook user who launches the application again with the same signed request.
+    def prepare(self, handler):
+        self.signed_request = signed_request(100000000001, time.time() + 7200)
+        handler(self.request(0))
+
+    def request(self, i):
+        return factory.post('/canvas/', {'signed_request': self.signed_request}, HTTP_USER_AGENT=CHROME)
+
+
+class FacebookCookieRequest(Scenario):
+    # An XHR from a canvas page, authenticated by the signed request and session cookies only.
+    def prepare(self, handler):
+        self.signed_request = signed_request(100000000002, time.time() + 7200)
+        response = handler(factory.post('/canvas/', {'signed_request': self.signed_request}, HTTP_USER_AGENT=CHROME))
+        self.cookie = 'signed_request=%s; sessionid=%s' % (self.signed_request, response.cookies['sessionid'].value)
+
+    def request(self, i):
+        return factory.get('/canvas/', HTTP_COOKIE=self.cookie, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                           HTTP_USER_AGENT=CHROME)
+
+
+class FacebookExpiredToken(Scenario):
+    # A signed request whose OAuth token has expired; the user is sent to authorize the application again.
+    def request(self, i):
+        return factory.post('/canvas/', {'signed_request': signed_request(100000000003, time.time() - 60)},
+                            HTTP_USER_AGENT=CHROME)
+
+
+class FacebookInvalidSignature(Scenario):
+    # A signed request signed with another application's secret key.
+    def request(self, i):
+        return factory.post('/canvas/', {'signed_request': signed_request(100000000004, time.time() + 7200,
+                                                                          secret='0' * 32)},
+                            HTTP_USER_AGENT=CHROME)
+
+
+class VkontakteFirstLaunch(Scenario):
+    # A VK user launching the application for the first time.
+    def request(self, i):
+        return factory.get('/canvas/', vk_launch_parameters(20000000 + i), HTTP_USER_AGENT=CHROME)
+
+
+class VkontakteSafariFirstLaunch(Scenario):
+    # A VK user launching the application in Safari, which has to repost the launch
+    # parameters before the session cookie may be set.
+    def request(self, i):
+        return factory.get('/canvas/', vk_launch_parameters(30000000 + i), HTTP_USER_AGENT=SAFARI)
+
+
+class VkontakteRepeatLaunch(Scenario):
+    # A VK user reloading the application with the launch parameters and the session cookie it got.
+    def prepare(self, handler):
+        self.parameters = vk_launch_parameters(10000001)
+        response = handler(factory.get('/canvas/', self.parameters, HTTP_USER_AGENT=CHROME))
+        self.cookie = 'sessionid=%s' % response.cookies['sessionid'].value
+
+    def request(self, i):
+        return factory.get('/canvas/', self.parameters, HTTP_COOKIE=self.cookie, HTTP_USER_AGENT=CHROME)
+
+
+class VkontakteCookieRequest(Scenario):
+    # An XHR from a VK canvas page, authenticated by the session cookie only.
+    def prepare(self, handler):
+        response = handler(factory.get('/canvas/', vk_launch_parameters(10000002), HTTP_USER_AGENT=CHROME))
+        self.cookie = 'sessionid=%s' % response.cookies['sessionid'].value
+
+    def request(self, i):
+        return factory.get('/canvas/', HTTP_COOKIE=self.cookie, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                           HTTP_USER_AGENT=CHROME)
+
+
+class VkontakteInvalidSignature(Scenario):
+    # Launch parameters whose auth_key was computed with another application's secret.
+    def request(self, i):
+        return factory.get('/canvas/', vk_launch_parameters(10000003, secret='0' * 20), HTTP_USER_AGENT=CHROME)
+
+
+factory = RequestFactory()
+
+SCENARIOS = [
+    FacebookFirstLaunch('fb_first_launch', 'Facebook: first launch after authorization'),
+    FacebookRepeatLaunch('fb_repeat_launch', 'Facebook: repeat launch'),
+    FacebookCookieRequest('fb_cookie_xhr', 'Facebook: XHR with cookies only'),
+    FacebookExpiredToken('fb_expired_token', 'Facebook: expired OAuth token'),
+    FacebookInvalidSignature('fb_invalid_signature', 'Facebook: invalid signature'),
+    VkontakteFirstLaunch('vk_first_launch', 'VK: first launch'),
+    VkontakteSafariFirstLaunch('vk_safari_first_launch', 'VK: first launch in Safari'),
+    VkontakteRepeatLaunch('vk_repeat_launch', 'VK: repeat launch'),
+    VkontakteCookieRequest('vk_cookie_xhr', 'VK: XHR with cookies only'),
+    VkontakteInvalidSignature('vk_invalid_signature', 'VK: invalid auth_key'),
+]
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of a sorted list."""
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def measure(handler, stubs, scenario, number, warmup):
+    scenario.prepare(handler)
+
+    for i in range(warmup):
+        handler(scenario.request(number + i))
+
+    latencies = []
+    queries = 0
+    status_codes = {}
+    calls = dict(stubs.calls)
+    timer = timeit.default_timer
+
+    for i in range(number):
+        request = scenario.request(i)
+        reset_queries()
+
+        start = timer()
+        response = handler(request)
+        latencies.append(timer() - start)
+
+        queries += len(connection.queries)
+        status_codes[str(response.status_code)] = status_codes.get(str(response.status_code), 0) + 1
+
+    latencies.sort()
+
+    return {
+        'description': scenario.description,
+        'requests': number,
+        'requests_per_second': number / sum(latencies),
+        'latency_ms': {
+            'mean': sum(latencies) / number * 1000,
+            'p50': percentile(latencies, 50) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+        },
+        'queries_per_request': float(queries) / number,
+        'outbound_calls_per_request': dict(
+            (api, float(stubs.calls[api] - calls[api]) / number) for api in stubs.calls),
+        'status_codes': status_codes,
+    }
+
+
+def compare(results, baseline):
+    """Print how the results differ from those of an earlier run."""
+    print
+    print '%-24s %14s %14s %14s' % ('compared to baseline', 'req/s', 'p99', 'queries')
+
+    for name, result in sorted(results['scenarios'].items()):
+        if name not in baseline['scenarios']:
+            continue
+
+        previous = baseline['scenarios'][name]
+        print '%-24s %+13.1f%% %+13.1f%% %+14.2f' % (
+            name,
+            (result['requests_per_second'] / previous['requests_per_second'] - 1) * 100,
+            (result['latency_ms']['p99'] / previous['latency_ms']['p99'] - 1) * 100,
+            result['queries_per_request'] - previous['queries_per_request'])
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--number', type='int', default=500, help='How many requests to measure per scenario.')
+    parser.add_option('--warmup', type='int', default=50, help='How many requests to send before measuring.')
+    parser.add_option('--scenario', action='append', dest='scenarios', metavar='NAME',
+                      choices=[scenario.name for scenario in SCENARIOS],
+                      help='A scenario to run; all of them are run by default.')
+    parser.add_option('--output', metavar='FILE', help='Write the results to the file as JSON.')
+    parser.add_option('--baseline', metavar='FILE', help='Compare the results to those of an earlier run.')
+    options, args = parser.parse_args()
+
+    # Invalid requests are logged as warnings, which would otherwise end up on stderr.
+    logging.getLogger('djangocanvas').addHandler(NullHandler())
+
+    call_command('syncdb', interactive=False, verbosity=0)
+
+    stubs = Stubs()
+    stubs.install()
+    handler = Handler()
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'json': codec.backend.__name__,
+            'platform': platform.platform(),
+            'time': int(time.time()),
+        },
+        'scenarios': {},
+    }
+
+    print '%-24s %10s %10s %10s %10s %10s %10s' % ('scenario', 'req/s', 'p50 (ms)', 'p99 (ms)', 'queries',
+                                                   'graph', 'vkontakte')
+
+    for scenario in SCENARIOS:
+        if options.scenarios and scenario.name not in options.scenarios:
+            continue
+
+        result = results['scenarios'][scenario.name] = measure(handler, stubs, scenario, options.number,
+                                                               options.warmup)
+
+        print '%-24s %10.0f %10.2f %10.2f %10.2f %10.2f %10.2f' % (
+            scenario.name, result['requests_per_second'], result['latency_ms']['p50'],
+            result['latency_ms']['p99'], result['queries_per_request'],
+            result['outbound_calls_per_request']['graph'], result['outbound_calls_per_request']['vkontakte'])
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
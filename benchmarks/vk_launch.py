@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compare the CPU time spent validating the parameters of a VK iframe application launch
+with ``VkontakteIframeForm`` and with ``VkontakteLaunchParameters``.
+
+Usage: python benchmarks/vk_launch.py [--number N]
+"""
+import optparse
+import os
+import sys
+import time
+import timeit
+from hashlib import md5
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from django.conf import settings
+
+settings.configure(VK_APP_ID='2912345', VK_APP_SECRET='AbCdEfGhIjKlMnOpQrSt')
+
+from django.http import QueryDict
+
+from djangocanvas.forms import VkontakteIframeForm, VkontakteLaunchParameters
+
+
+def launch_query_string():
+    """Parameters as VK passes them to an application launched from a user's page."""
+    parameters = {
+        'api_url': 'http://api.vk.com/api.php',
+        'api_id': settings.VK_APP_ID,
+        'api_settings': '8199',
+        'viewer_id': '1234567',
+        'viewer_type': '2',
+        'sid': '5a1fa3d9e0c2f0c4d4e1f5a0b4c2d6e8f1a3b5c7d9e0f2a4b6c8d0e2f4a6b8c0d2e4f6',
+        'secret': 'a1b2c3d4e5',
+        'access_token': '533bacf01e11f55b536a565b57531ac114461ae8736d6506a3',
+        'user_id': '0',
+        'group_id': '0',
+        'is_app_user': '1',
+        'auth_key': md5('%s_1234567_%s' % (settings.VK_APP_ID, settings.VK_APP_SECRET)).hexdigest(),
+        'language': '0',
+        'parent_language': '0',
+        'ad_info': 'ElsdCQBeRFJsBAxcAwJSXHt5C0Q8HTJeUVlBKFtGSWcsB0QvDzg2',
+        'is_secure': '0',
+        'referrer': 'profile',
+        'lc_name': '2a7bc9b7',
+        'hash': '',
+        'api_result': ('{"response":[{"uid":1234567,"first_name":"\\u041f\\u0430\\u0432\\u0435\\u043b",'
+                       '"last_name":"\\u0414\\u0443\\u0440\\u043e\\u0432","nickname":"","domain":"id1234567",'
+                       '"sex":2,"bdate":"10.10.1984","city":2,"country":1,"timezone":3,'
+                       '"photo":"http://cs1.vk.me/u1234567/e_1a2b3c4d.jpg",'
+                       '"photo_medium":"http://cs1.vk.me/u1234567/b_1a2b3c4d.jpg",'
+                       '"photo_big":"http://cs1.vk.me/u1234567/a_1a2b3c4d.jpg","has_mobile":1,"rate":"95"}]}'),
+    }
+
+    data = QueryDict('', mutable=True)
+    data.update(parameters)
+    return data.urlencode()
+
+
+def launch(validator, query_string):
+    # Launch parameters arrive as a query string, which each request parses anew.
+    parameters = validator(QueryDict(query_string))
+    assert parameters.is_valid()
+    return parameters.vk_user_id(), parameters.profile_api_result()
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--number', type='int', default=5000, help='How many launches to validate per run.')
+    options, args = parser.parse_args()
+
+    query_string = launch_query_string()
+    results = {}
+
+    for name, validator in [('VkontakteIframeForm', VkontakteIframeForm),
+                            ('VkontakteLaunchParameters', VkontakteLaunchParameters)]:
+        timer = timeit.Timer(lambda: launch(validator, query_string), timer=time.clock)
+        results[name] = min(timer.repeat(repeat=3, number=options.number)) / options.number * 1e6
+        print '%-28s %8.1f us CPU per launch' % (name, results[name])
+
+    print '%-28s %8.1fx' % ('speedup', results['VkontakteIframeForm'] / results['VkontakteLaunchParameters'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Encode and decode JSON with the fastest JSON library available.
+
+The libraries in ``BACKENDS`` are tried in order, the standard library's ``json``
+being the last resort. Output is compact (without whitespace after separators)
+whichever library is used, so that it doesn't vary between installations.
+"""
+
+# The names of supported JSON libraries, fastest first.
+BACKENDS = ('ujson', 'simplejson', 'json')
+
+# The names of supported JSON libraries that can decode a JSON document at an offset of
+# a string with ``JSONDecoder.raw_decode``, fastest first.
+RAW_DECODING_BACKENDS = ('simplejson', 'json')
+
+
+def _import(names):
+    for name in names:
+        try:
+            return __import__(name)
+        except ImportError:
+            pass
+
+    raise ImportError('None of %s could be imported' % ', '.join(names))
+
+
+def use(name=None):
+    """
+    Select the JSON library to use.
+
+    :param name: A string describing the name of a library in ``BACKENDS``, or ``None``
+                 to select the fastest library available.
+    """
+    global backend, decoder
+
+    backend = _import([name] if name else BACKENDS)
+
+    raw_decoding = name if name in RAW_DECODING_BACKENDS else None
+    decoder = _import([raw_decoding] if raw_decoding else RAW_DECODING_BACKENDS).JSONDecoder(strict=False)
+
+
+def loads(s):
+    """
+    Decode the given JSON document, raising ``ValueError`` if it's malformed.
+
+    :param s: A string describing a JSON document.
+    """
+    return backend.loads(s)
+
+
+def dumps(obj, ensure_ascii=True):
+    """
+    Encode the given object as compact JSON.
+
+    :param obj: An object consisting of dictionaries, lists, strings, numbers, booleans and ``None``.
+    :param ensure_ascii: A boolean describing whether to escape non-ASCII characters. If it's ``False``,
+                         the result may be a unicode string.
+    """
+    if backend.__name__ == 'ujson':
+        return backend.dumps(obj, ensure_ascii=ensure_ascii)
+
+    return backend.dumps(obj, ensure_ascii=ensure_ascii, separators=(',', ':'))
+
+
+def raw_decode(s, idx=0):
+    """
+    Decode the JSON document starting at the given offset of a string that may continue
+    after it, returning a tuple of the decoded object and the offset at which it ended.
+    """
+    return decoder.raw_decode(s, idx)
+
+
+use()
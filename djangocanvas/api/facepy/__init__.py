@@ -1,15 +1,22 @@
+from async_graph_api import AsyncGraphAPI
 from exceptions import FacepyError
 from graph_api import GraphAPI
+from response_cache import ResponseCache
+from retry import RetryPolicy
 from signed_request import SignedRequest
-from utils import get_application_access_token, get_extended_access_token
+from utils import get_application_access_token, get_extended_access_token, with_application_access_token
 from version import __version__
 
 
 __all__ = [
+    'AsyncGraphAPI',
     'FacepyError',
     'GraphAPI',
+    'ResponseCache',
+    'RetryPolicy',
     'SignedRequest',
     'get_application_access_token',
     'get_extended_access_token',
+    'with_application_access_token',
     '__version__',
 ]
@@ -0,0 +1,100 @@
+from ..pool import RequestPool, default_request_pool
+from graph_api import GraphAPI, BATCH_SIZE_LIMIT
+
+
+class AsyncGraphAPI(object):
+    """
+    A Graph API client that sends requests in the background.
+
+    Its methods mirror those of ``GraphAPI``, but return an ``AsyncResult`` right away rather
+    than waiting for the response. Responses are parsed by ``GraphAPI``, so that calling
+    ``get`` on the result raises the same exceptions ``GraphAPI`` would::
+
+        graph = AsyncGraphAPI(oauth_token)
+        results = [graph.get(friend['id']) for friend in friends]
+        profiles = [result.get() for result in results]
+    """
+
+    def __init__(self, oauth_token=False, url='https://graph.facebook.com', pool=None, **options):
+        """
+        Initialize AsyncGraphAPI with an OAuth access token.
+
+        :param oauth_token: A string describing an OAuth access token.
+        :param url: A string describing the URL of the Graph API.
+        :param pool: A ``RequestPool`` instance to send requests on. Defaults to ``default_request_pool``,
+                     which is shared with the VK API client so that their combined concurrency is limited.
+        :param options: Further arguments to ``GraphAPI``, such as 'session', 'timeout' or 'cache'.
+        """
+        self.graph = GraphAPI(oauth_token, url, **options)
+        self.pool = pool or default_request_pool
+
+    def get(self, path='', retry=3, **options):
+        """
+        Get an item from the Graph API in the background. See ``GraphAPI.get``.
+        """
+        return self.pool.submit(self.graph.get, path, retry=retry, **options)
+
+    def post(self, path='', retry=0, **data):
+        """
+        Post an item to the Graph API in the background. See ``GraphAPI.post``.
+        """
+        return self.pool.submit(self.graph.post, path, retry=retry, **data)
+
+    def delete(self, path, retry=3):
+        """
+        Delete an item in the Graph API in the background. See ``GraphAPI.delete``.
+        """
+        return self.pool.submit(self.graph.delete, path, retry=retry)
+
+    def search(self, term, type, retry=3, **options):
+        """
+        Search for an item in the Graph API in the background. See ``GraphAPI.search``.
+        """
+        return self.pool.submit(self.graph.search, term, type, retry=retry, **options)
+
+    def fql(self, query, retry=3):
+        """
+        Make a FQL query in the background. See ``GraphAPI.fql``.
+        """
+        return self.pool.submit(self.graph.fql, query, retry=retry)
+
+    def batch(self, requests, retry=1):
+        """
+        Make a batch request in the background, sending each chunk of ``BATCH_SIZE_LIMIT``
+        requests on the pool. See ``GraphAPI.batch``.
+
+        Returns a list of ``AsyncResult`` instances, one per chunk, whose ``get`` methods return
+        lists of responses and/or exceptions in the order of the requests.
+        """
+        requests = list(requests)
+        size = BATCH_SIZE_LIMIT
+
+        return [
+            self.pool.submit(self.graph._batch, requests[i:i + size], retry)
+            for i in range(0, len(requests), size)
+        ]
+
+    def pages(self, path='', retry=3, **options):
+        """
+        Iterate over each page of results for the given path, requesting the next page in the
+        background as soon as the previous one has arrived.
+
+        :param path: A string describing the path to the item.
+        :param retry: An integer describing how many times each request may be retried.
+        :param options: Graph API parameters such as 'limit', 'offset' or 'since'.
+        """
+        pages = self.graph.get(path, page=True, retry=retry, **options)
+        result = self.pool.submit(pages.next)
+
+        while True:
+            try:
+                page = result.get()
+            except StopIteration:
+                return
+
+            result = self.pool.submit(pages.next)
+
+            yield page
+
+    # Proxy exceptions for ease of use.
+    FacebookError, OAuthError, HTTPError = GraphAPI.FacebookError, GraphAPI.OAuthError, GraphAPI.HTTPError
@@ -1,26 +1,155 @@
-try:
-    import simplejson as json
-except ImportError:
-    import json  # flake8: noqa
+import copy
+import re
 import requests
+import time
 
+from cookielib import DefaultCookiePolicy
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty
+from threading import Event, Lock, Thread
 from urllib import urlencode
 
+from .. import codec, metrics
 from exceptions import *
+from retry import PERMANENT, default_retry_policy
+
+
+# The number of requests Facebook accepts in a single batch request.
+BATCH_SIZE_LIMIT = 50
+
+# Matches IDs of objects, such as users and posts, in Graph API paths.
+_match_id = re.compile(r'(?<=/)\d+(?:_\d+)?(?=/|$)')
+
+
+class SessionPool(object):
+    """
+    A process-wide registry of HTTP sessions, one per Graph API URL, so that
+    ``GraphAPI`` instances reuse each other's keep-alive connections.
+    """
+
+    def __init__(self, pool_size=10, timeout=None):
+        """
+        Initialize the registry.
+
+        :param pool_size: An integer describing how many connections each session keeps alive.
+        :param timeout: A number describing how many seconds requests may take, or ``None``
+                        to wait indefinitely.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._sessions = {}
+        self._stats = {}
+        self._lock = Lock()
+
+    def get(self, url):
+        """Return the session for the given URL, creating it if need be."""
+        with self._lock:
+            if url not in self._sessions:
+                self._sessions[url] = self._create_session()
+                self._stats[url] = {'requests': 0, 'in_flight': 0, 'peak': 0, 'saturated': 0}
+            return self._sessions[url]
+
+    def request(self, url, session, method, request_url, **kwargs):
+        """
+        Send a request with the given session, keeping track of how many requests
+        are in flight for the session's URL.
+
+        A request is counted as saturated if it was sent while as many requests as the
+        session keeps connections alive for were in flight already.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(url, {'requests': 0, 'in_flight': 0, 'peak': 0, 'saturated': 0})
+            stats['requests'] += 1
+
+            if stats['in_flight'] >= self.pool_size:
+                stats['saturated'] += 1
+
+            stats['in_flight'] += 1
+            stats['peak'] = max(stats['peak'], stats['in_flight'])
+
+        try:
+            return session.request(method, request_url, **kwargs)
+        finally:
+            with self._lock:
+                stats['in_flight'] -= 1
+
+    def stats(self):
+        """Return a dictionary describing, per URL, how many requests were sent, are in flight and so on."""
+        with self._lock:
+            return dict((url, dict(stats)) for url, stats in self._stats.items())
+
+    def clear(self):
+        """Close and forget all sessions."""
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+            self._stats = {}
+
+        for session in sessions.values():
+            session.close()
+
+    def _create_session(self):
+        session = requests.Session()
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        # Sessions are shared between users, so cookies mustn't stick to them.
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        return session
+
+
+sessions = SessionPool()
+
+
+def _endpoint(path):
+    """Return the path with IDs and query strings left out, to label measurements of requests for it with."""
+    path = '/' + path.split('?', 1)[0].lstrip('/')
+    return _match_id.sub(':id', path)
+
+
+def _request_bytes(response):
+    """Return the length of the body of the request the given response answers, or 0 if it's unknown."""
+    body = getattr(getattr(response, 'request', None), 'body', None)
+    return len(body) if isinstance(body, basestring) else 0
+
+
+def _error_code(exception):
+    """Return a string describing the code of a ``FacepyError``, or its class if it hasn't got one."""
+    code = getattr(exception, 'code', None)
+    return str(code) if code is not None else exception.__class__.__name__
 
 
 class GraphAPI(object):
-    def __init__(self, oauth_token=False, url='https://graph.facebook.com'):
+    default_cache = None
+    """A ``ResponseCache`` instance used by instances that aren't given one."""
+
+    def __init__(self, oauth_token=False, url='https://graph.facebook.com', session=None, timeout=None,
+                 retry_policy=None, cache=None):
         """
         Initialize GraphAPI with an OAuth access token.
 
         :param oauth_token: A string describing an OAuth access token.
+        :param url: A string describing the Graph API's URL.
+        :param session: A ``requests`` session to send requests with. Defaults to the session
+                        ``sessions`` holds for the URL.
+        :param timeout: A number describing how many seconds requests may take. Defaults to
+                        the timeout of ``sessions``.
+        :param retry_policy: A ``RetryPolicy`` instance deciding whether and when failed requests
+                             are retried. Defaults to ``default_retry_policy``.
+        :param cache: A ``ResponseCache`` instance to cache responses to GET requests in. Defaults
+                      to ``GraphAPI.default_cache``, which is ``None`` unless configured.
         """
         self.oauth_token = oauth_token
-        self.session = requests.session()
         self.url = url.strip('/')
+        self.session = session or sessions.get(self.url)
+        self.timeout = timeout
+        self.retry_policy = retry_policy or default_retry_policy
+        self.cache = cache if cache is not None else self.default_cache
 
-    def get(self, path='', page=False, retry=3, **options):
+    def get(self, path='', page=False, retry=3, prefetch=0, **options):
         """
         Get an item from the Graph API.
 
@@ -28,6 +157,8 @@ class GraphAPI(object):
         :param page: A boolean describing whether to return a generator that
                      iterates over each page of results.
         :param retry: An integer describing how many times the request may be retried.
+        :param prefetch: An integer describing how many pages of results may be fetched in the
+                         background ahead of the one being iterated over.
         :param options: Graph API parameters such as 'limit', 'offset' or 'since'.
 
         See `Facebook's Graph API documentation <http://developers.facebook.com/docs/reference/api/>`_
@@ -38,7 +169,8 @@ class GraphAPI(object):
             path=path,
             data=options,
             page=page,
-            retry=retry
+            retry=retry,
+            prefetch=prefetch
         )
 
         if response is False:
@@ -87,7 +219,7 @@ class GraphAPI(object):
 
         return response
 
-    def search(self, term, type, page=False, retry=3, **options):
+    def search(self, term, type, page=False, retry=3, prefetch=0, **options):
         """
         Search for an item in the Graph API.
 
@@ -96,6 +228,8 @@ class GraphAPI(object):
         :param page: A boolean describing whether to return a generator that
                      iterates over each page of results.
         :param retry: An integer describing how many times the request may be retried.
+        :param prefetch: An integer describing how many pages of results may be fetched in the
+                         background ahead of the one being iterated over.
         :param options: Graph API parameters, such as 'center' and 'distance'.
 
         Supported types are ``post``, ``user``, ``page``, ``event``, ``group``, ``place`` and ``checkin``.
@@ -113,41 +247,118 @@ class GraphAPI(object):
             'type': type,
         }, **options)
 
-        response = self._query('GET', 'search', options, page, retry)
+        response = self._query('GET', 'search', options, page, retry, prefetch)
 
         return response
 
-    def batch(self, requests):
+    def batch(self, requests, chunk_size=BATCH_SIZE_LIMIT, workers=4, retry=1):
         """
         Make a batch request.
 
         :param requests: A list of dictionaries with keys 'method', 'relative_url' and optionally 'body'.
+        :param chunk_size: An integer describing how many requests to send per batch request. Facebook
+                           accepts at most ``BATCH_SIZE_LIMIT``.
+        :param workers: An integer describing how many batch requests may be sent concurrently.
+        :param retry: An integer describing how many times requests that failed with a transient
+                      error may be retried.
 
-        Yields a list of responses and/or exceptions.
+        Yields a list of responses and/or exceptions, in the order of the requests.
         """
+        requests = list(requests)
+        chunk_size = min(chunk_size, BATCH_SIZE_LIMIT)
+        chunks = [requests[i:i + chunk_size] for i in range(0, len(requests), chunk_size)]
 
-        for request in requests:
-            if 'body' in request:
-                request['body'] = urlencode(request['body'])
+        if len(chunks) <= 1 or workers <= 1:
+            for chunk in chunks:
+                for response in self._batch(chunk, retry):
+                    yield response
+            return
 
-        responses = self.post(
-            batch=json.dumps(requests)
-        )
+        pool = ThreadPool(min(workers, len(chunks)))
+        finished = False
+
+        try:
+            for responses in pool.imap(lambda chunk: self._batch(chunk, retry), chunks):
+                for response in responses:
+                    yield response
+            finished = True
+        finally:
+            if finished:
+                pool.close()
+            else:
+                # The caller has stopped iterating over responses; don't send the chunks still queued.
+                pool.terminate()
 
-        for response, request in zip(responses, requests):
+    def _batch(self, requests, retry):
+        """
+        Send a single batch request, retrying the requests that failed with a transient error.
 
-            # Facilitate for empty Graph API responses.
-            #
-            # https://github.com/jgorset/facepy/pull/30
-            if not response:
-                yield None
-                continue
+        :param requests: A list of dictionaries with keys 'method', 'relative_url' and optionally 'body'.
+        :param retry: An integer describing how many times failed requests may be retried.
 
-            try:
-                yield self._parse(response['body'])
-            except FacepyError as exception:
-                exception.request = request
-                yield exception
+        Returns a list of responses and/or exceptions, in the order of the requests.
+        """
+        results = [None] * len(requests)
+        pending = range(len(requests))
+        attempt = 0
+
+        while pending:
+            batch = []
+
+            for index in pending:
+                request = requests[index]
+
+                # Encode bodies in copies of the requests, leaving the caller's alone.
+                if 'body' in request and not isinstance(request['body'], basestring):
+                    request = dict(request, body=urlencode(request['body']))
+
+                batch.append(request)
+
+            responses = self.post(
+                batch=codec.dumps(batch)
+            )
+
+            failed = []
+            failure = None
+
+            for index, response in zip(pending, responses):
+
+                # Facilitate for empty Graph API responses.
+                #
+                # https://github.com/jgorset/facepy/pull/30
+                if not response:
+                    results[index] = None
+                    continue
+
+                try:
+                    results[index] = self._parse(response['body'])
+                except FacepyError as exception:
+                    exception.request = requests[index]
+                    results[index] = exception
+
+                    if metrics.sinks:
+                        metrics.error('graph', _endpoint(requests[index]['relative_url']), _error_code(exception))
+
+                    if self.retry_policy.classify(exception) != PERMANENT:
+                        failed.append(index)
+                        failure = failure or exception
+
+            if not failed:
+                break
+
+            delay = self.retry_policy.retry(failure, attempt, retry)
+
+            if delay is None:
+                break
+
+            if metrics.sinks:
+                for index in failed:
+                    metrics.retry('graph', _endpoint(requests[index]['relative_url']))
+
+            self.retry_policy.sleep(delay)
+            pending, attempt = failed, attempt + 1
+
+        return results
 
     def fql(self, query, retry=3):
         """
@@ -165,7 +376,7 @@ class GraphAPI(object):
             retry=retry
         )
 
-    def _query(self, method, path, data=None, page=False, retry=0):
+    def _query(self, method, path, data=None, page=False, retry=0, prefetch=0):
         """
         Fetch an object from the Graph API and parse the output, returning a tuple where the first item
         is the object yielded by the Graph API and the second is the URL for the next page of results, or
@@ -175,16 +386,24 @@ class GraphAPI(object):
         :param path: A string describing the object in the Graph API.
         :param data: A dictionary of HTTP GET parameters (for GET requests) or POST data (for POST requests).
         :param page: A boolean describing whether to return an iterator that iterates over each page of results.
-        :param retry: An integer describing how many times the request may be retried.
+        :param retry: An integer describing how many times the request may be retried, subject
+                      to the instance's retry policy.
+        :param prefetch: An integer describing how many pages may be fetched ahead of the one being
+                         iterated over when ``page`` is true.
         """
         data = data or {}
 
-        def load(method, url, data):
+        def send(method, url, data, headers=None):
+            start = time.time()
+
             try:
+                timeout = self.timeout if self.timeout is not None else sessions.timeout
+
                 if method in ['GET', 'DELETE']:
-                    response = self.session.request(method, url, params=data, allow_redirects=True)
+                    response = sessions.request(self.url, self.session, method, url, params=data,
+                                                headers=headers, allow_redirects=True, timeout=timeout)
 
-                if method in ['POST', 'PUT']:
+                elif method in ['POST', 'PUT']:
                     files = {}
 
                     for key in data:
@@ -194,11 +413,29 @@ class GraphAPI(object):
                     for key in files:
                         data.pop(key)
 
-                    response = self.session.request(method, url, data=data, files=files)
+                    response = sessions.request(self.url, self.session, method, url,
+                                                data=data, files=files, timeout=timeout)
             except requests.RequestException as exception:
+                if metrics.sinks:
+                    metrics.error('graph', endpoint, 'connection')
                 raise HTTPError(exception.message)
 
-            result = self._parse(response.content)
+            if metrics.sinks:
+                metrics.request('graph', endpoint, time.time() - start, response.status_code, len(response.content),
+                                _request_bytes(response))
+
+            return response
+
+        def parse(response):
+            try:
+                return self._parse(response.content)
+            except FacepyError as exception:
+                if metrics.sinks:
+                    metrics.error('graph', endpoint, _error_code(exception))
+                raise
+
+        def load(method, url, data):
+            result = parse(send(method, url, data))
 
             try:
                 next_url = result['paging']['next']
@@ -207,6 +444,33 @@ class GraphAPI(object):
 
             return result, next_url
 
+        def load_cached(url, data):
+            params = dict(data)
+            key = self.cache.key(url, params, params.pop('access_token', None))
+            entry = self.cache.get(key)
+
+            # Callers get copies of cached objects, which they may modify at will.
+            if entry is not None and entry['expires'] > time.time():
+                return copy.deepcopy(entry['data'])
+
+            headers = {}
+
+            if entry is not None and entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+
+            response = send('GET', url, data, headers)
+
+            if response.status_code == 304 and entry is not None:
+                self.cache.revalidated(key, path, entry)
+                return copy.deepcopy(entry['data'])
+
+            result = parse(response)
+
+            if result is not False:
+                self.cache.set(key, path, result, response.headers.get('etag'))
+
+            return result
+
         def paginate(method, url, data):
             while url:
                 result, url = load(method, url, data)
@@ -218,6 +482,47 @@ class GraphAPI(object):
 
                 yield result
 
+        def prefetching_paginate(method, url, data, depth):
+            # Pages are fetched on a background thread into a buffer of at most ``depth`` pages,
+            # so that the next page is on its way while the caller processes the current one.
+            pages = Queue(maxsize=depth)
+            stop = Event()
+
+            def fetch():
+                try:
+                    for result in paginate(method, url, data):
+                        pages.put((result, None))
+                        if stop.is_set():
+                            return
+                    pages.put((StopIteration, None))
+                except Exception as exception:
+                    pages.put((None, exception))
+
+            thread = Thread(target=fetch)
+            thread.daemon = True
+            thread.start()
+
+            try:
+                while True:
+                    result, exception = pages.get()
+
+                    if exception is not None:
+                        raise exception
+
+                    if result is StopIteration:
+                        return
+
+                    yield result
+            finally:
+                stop.set()
+
+                # Make room for a fetch the caller has stopped waiting for.
+                try:
+                    while True:
+                        pages.get_nowait()
+                except Empty:
+                    pass
+
         # Convert option lists to comma-separated values.
         for key in data:
             if isinstance(data[key], (list, set, tuple)) and all([isinstance(item, basestring) for item in data[key]]):
@@ -228,20 +533,34 @@ class GraphAPI(object):
             path = '/' + str(path)
 
         url = '%s%s' % (self.url, path)
+        endpoint = _endpoint(path)
 
         if self.oauth_token:
             data['access_token'] = self.oauth_token
 
-        try:
-            if page:
-                return paginate(method, url, data)
-            else:
-                return load(method, url, data)[0]
-        except FacepyError:
-            if retry:
-                return self._query(method, path, data, page, retry - 1)
-            else:
-                raise
+        attempt = 0
+
+        while True:
+            try:
+                if page and prefetch:
+                    return prefetching_paginate(method, url, data, prefetch)
+                elif page:
+                    return paginate(method, url, data)
+                elif method == 'GET' and self.cache is not None:
+                    return load_cached(url, data)
+                else:
+                    return load(method, url, data)[0]
+            except FacepyError as exception:
+                delay = self.retry_policy.retry(exception, attempt, retry)
+
+                if delay is None:
+                    raise
+
+                if metrics.sinks:
+                    metrics.retry('graph', endpoint)
+
+                self.retry_policy.sleep(delay)
+                attempt += 1
 
     def _parse(self, data):
         """
@@ -250,7 +569,7 @@ class GraphAPI(object):
         :param data: A string describing the Graph API's response.
         """
         try:
-            data = json.loads(data)
+            data = codec.loads(data)
         except ValueError:
             return data
 
@@ -0,0 +1,116 @@
+import copy
+import hashlib
+import re
+import time
+from threading import Lock
+
+
+class ResponseCache(object):
+    """
+    A cache of responses to Graph API GET requests, keyed by path, parameters and the
+    OAuth token the request was made with.
+
+    Responses are fresh for a time depending on their path. Once stale, responses that
+    came with an ETag are revalidated with ``If-None-Match``, so that an unchanged object
+    needn't be downloaded and parsed again.
+
+    Objects are copied when they're cached, so that the caller may go on to modify its own;
+    ``GraphAPI`` hands out copies of cached objects likewise.
+    """
+
+    def __init__(self, storage, timeouts=None, default_timeout=0, stale_timeout=3600):
+        """
+        Initialize the cache.
+
+        :param storage: An object with ``get(key)`` and ``set(key, value, timeout)`` methods
+                        such as Django's cache, holding the responses.
+        :param timeouts: A list of tuples of a regular expression matching paths and an integer
+                         describing how many seconds responses for those paths are fresh.
+        :param default_timeout: An integer describing how many seconds responses for paths not
+                                matching any expression are fresh. Responses that are fresh for
+                                0 seconds aren't cached.
+        :param stale_timeout: An integer describing how many seconds stale responses are held
+                              for revalidation.
+        """
+        self.storage = storage
+        self.timeouts = [(re.compile(pattern), timeout) for pattern, timeout in timeouts or []]
+        self.default_timeout = default_timeout
+        self.stale_timeout = stale_timeout
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+        self._lock = Lock()
+
+    def key(self, path, params, oauth_token):
+        """
+        Derive the key a response is cached under.
+
+        :param path: A string describing the path of the request.
+        :param params: A dictionary describing the request's parameters.
+        :param oauth_token: A string describing the OAuth token the request is made with.
+        """
+        def encode(value):
+            return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
+        params = '&'.join(['%s=%s' % (encode(key), encode(params[key])) for key in sorted(params)])
+        return 'facepy.response.%s' % hashlib.sha1(
+            '%s?%s#%s' % (encode(path).strip('/'), params, encode(oauth_token or ''))
+        ).hexdigest()
+
+    def timeout(self, path):
+        """Determine how many seconds responses for the given path are fresh."""
+        path = path.strip('/')
+
+        for pattern, timeout in self.timeouts:
+            if pattern.search(path):
+                return timeout
+
+        return self.default_timeout
+
+    def get(self, key):
+        """
+        Return the entry cached under the given key, or ``None``. Entries are dictionaries with
+        keys 'data', 'etag' and 'expires'.
+        """
+        entry = self.storage.get(key)
+
+        with self._lock:
+            if entry is not None and entry['expires'] > time.time():
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return entry
+
+    def set(self, key, path, data, etag=None):
+        """Cache the response for the given path under the given key."""
+        timeout = self.timeout(path)
+
+        if timeout <= 0:
+            return
+
+        self.storage.set(key, {
+            'data': copy.deepcopy(data),
+            'etag': etag,
+            'expires': time.time() + timeout
+        }, timeout + (self.stale_timeout if etag else 0))
+
+    def revalidated(self, key, path, entry):
+        """Mark a stale entry as fresh again once the Graph API has reported it unchanged."""
+        with self._lock:
+            self.revalidations += 1
+
+        self.set(key, path, entry['data'], entry['etag'])
+
+    def stats(self):
+        """Return a dictionary describing how many lookups hit, missed and were revalidated."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'hit_ratio': float(self.hits + self.revalidations) / lookups if lookups else 0.0
+            }
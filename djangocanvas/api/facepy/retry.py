@@ -0,0 +1,139 @@
+import random
+import time
+from collections import deque
+from threading import Lock
+
+from exceptions import FacebookError, OAuthError, HTTPError
+
+
+TRANSIENT = 'transient'
+THROTTLED = 'throttled'
+PERMANENT = 'permanent'
+
+# Codes of Facebook errors that may well not occur if the request is made again.
+TRANSIENT_ERROR_CODES = (1, 2)
+
+# Codes of Facebook errors that signal requests are being rate limited.
+THROTTLING_ERROR_CODES = (4, 17, 32, 341, 613)
+
+
+class RetryPolicy(object):
+    """
+    A retry policy decides whether and when a failed request to the Graph API is retried.
+
+    Errors are classified as transient, throttled or permanent. Permanent errors (such as
+    invalid OAuth tokens) are never retried; the others are retried after an exponentially
+    growing, randomized delay, as long as the policy's retry budget isn't exhausted.
+    """
+
+    def __init__(self, backoff=0.5, throttled_backoff=5, max_backoff=60, jitter=0.5, budget=100, window=60):
+        """
+        Initialize the policy.
+
+        :param backoff: A number describing how many seconds to wait before retrying a transient error
+                        for the first time; the delay doubles with each attempt.
+        :param throttled_backoff: A number describing how many seconds to wait before retrying a
+                                  throttled request for the first time.
+        :param max_backoff: A number describing how many seconds to wait at most.
+        :param jitter: A number between 0 and 1 describing by what fraction delays are randomly shortened.
+        :param budget: An integer describing how many retries may be made per window, or ``None``
+                       for an unlimited number of retries.
+        :param window: A number describing the length of the window in seconds.
+        """
+        self.backoff = backoff
+        self.throttled_backoff = throttled_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budget = budget
+        self.window = window
+
+        self.counters = {
+            TRANSIENT: 0,
+            THROTTLED: 0,
+            'permanent_failures': 0,
+            'exhausted_failures': 0,
+            'budget_failures': 0,
+        }
+
+        self._retries = deque()
+        self._lock = Lock()
+
+    def classify(self, exception):
+        """
+        Classify a ``FacepyError`` as ``TRANSIENT``, ``THROTTLED`` or ``PERMANENT``.
+
+        :param exception: A ``FacepyError`` instance.
+        """
+        if isinstance(exception, HTTPError):
+            return TRANSIENT
+
+        if isinstance(exception, OAuthError):
+            return PERMANENT
+
+        if isinstance(exception, FacebookError):
+            if exception.code in THROTTLING_ERROR_CODES:
+                return THROTTLED
+            if exception.code in TRANSIENT_ERROR_CODES:
+                return TRANSIENT
+
+        return PERMANENT
+
+    def retry(self, exception, attempt, retries):
+        """
+        Decide whether to retry a request that failed.
+
+        :param exception: A ``FacepyError`` instance describing why the request failed.
+        :param attempt: An integer describing how many times the request has been retried already.
+        :param retries: An integer describing how many times the request may be retried.
+
+        Returns a number describing how many seconds to wait before retrying, or ``None`` if
+        the request shouldn't be retried.
+        """
+        classification = self.classify(exception)
+
+        with self._lock:
+            if classification == PERMANENT:
+                self.counters['permanent_failures'] += 1
+                return None
+
+            if attempt >= retries:
+                self.counters['exhausted_failures'] += 1
+                return None
+
+            if not self._spend_budget():
+                self.counters['budget_failures'] += 1
+                return None
+
+            self.counters[classification] += 1
+
+        backoff = self.throttled_backoff if classification == THROTTLED else self.backoff
+        delay = min(self.max_backoff, backoff * 2 ** attempt)
+
+        return delay * (1 - random.random() * self.jitter)
+
+    def sleep(self, delay):
+        """Wait the given number of seconds before retrying."""
+        time.sleep(delay)
+
+    def stats(self):
+        """Return a dictionary describing how many retries were made and how many failures weren't retried."""
+        with self._lock:
+            return dict(self.counters)
+
+    def _spend_budget(self):
+        if self.budget is None:
+            return True
+
+        now = time.time()
+
+        while self._retries and self._retries[0] <= now - self.window:
+            self._retries.popleft()
+
+        if len(self._retries) >= self.budget:
+            return False
+
+        self._retries.append(now)
+        return True
+
+
+default_retry_policy = RetryPolicy()
@@ -1,14 +1,11 @@
 import base64
 import hashlib
 import hmac
-try:
-    import simplejson as json
-except ImportError:
-    import json  # flake8: noqa
 import time
 
 from datetime import datetime
 
+from .. import codec
 from exceptions import *
 
 
@@ -72,12 +69,13 @@ class SignedRequest(object):
 
     def fetch_user_data_and_token(self):
         from urlparse import parse_qs
-        from . import GraphAPI, get_application_access_token
+        from . import GraphAPI, with_application_access_token
 
-        app_token = get_application_access_token(self.application_id, self.application_secret_key)
-        graph = GraphAPI(app_token)
+        def exchange_code(app_token):
+            graph = GraphAPI(app_token)
+            return graph, graph.get('oauth/access_token', code=self.raw['code'], redirect_uri='', client_id=self.application_id, client_secret=self.application_secret_key)
 
-        qs = graph.get('oauth/access_token', code=self.raw['code'], redirect_uri='', client_id=self.application_id, client_secret=self.application_secret_key)
+        graph, qs = with_application_access_token(self.application_id, self.application_secret_key, exchange_code)
         self.raw['oauth_token'] = parse_qs(qs)['access_token'][0]
         #import ipdb; ipdb.set_trace()
         self.raw['expires'] = time.time() + int(parse_qs(qs)['expires'][0])
@@ -92,7 +90,7 @@ class SignedRequest(object):
         try:
             encoded_signature, encoded_payload = (str(string) for string in signed_request.split('.', 2))
             signature = decode(encoded_signature)
-            signed_request_data = json.loads(decode(encoded_payload))
+            signed_request_data = codec.loads(decode(encoded_payload))
         except (TypeError, ValueError):
             raise SignedRequestError("Signed request had a corrupt payload")
 
@@ -160,7 +158,7 @@ class SignedRequest(object):
             payload['user_id'] = self.user.id
 
         encoded_payload = base64.urlsafe_b64encode(
-            json.dumps(payload, separators=(',', ':'))
+            codec.dumps(payload)
         )
 
         encoded_signature = base64.urlsafe_b64encode(hmac.new(
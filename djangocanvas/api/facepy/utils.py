@@ -1,4 +1,7 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
+from threading import Event, Lock
 from urlparse import parse_qs
 
 from graph_api import GraphAPI
@@ -33,13 +36,151 @@ def get_extended_access_token(access_token, application_id, application_secret_k
     return token, expires_at
 
 
-def get_application_access_token(application_id, application_secret_key):
+class ApplicationAccessTokenCache(object):
+    """
+    A process-wide cache of application access tokens. Callers asking for a token that
+    isn't cached at the same time share a single request for it.
+    """
+
+    def __init__(self, timeout=3600, shared=None):
+        """
+        Initialize the cache.
+
+        :param timeout: An integer describing how many seconds tokens are cached for.
+        :param shared: An object with ``get`` and ``set`` methods like Django's cache, consulted
+                       before requesting a token so that several processes may share it.
+        """
+        self.timeout = timeout
+        self.shared = shared
+
+        self._tokens = {}
+        self._flights = {}
+        self._lock = Lock()
+
+    def get(self, application_id, application_secret_key):
+        """
+        Get an OAuth access token for the given application.
+
+        :param application_id: An integer describing a Facebook application's ID.
+        :param application_secret_key: A string describing a Facebook application's secret key.
+        """
+        key = self._key(application_id, application_secret_key)
+
+        with self._lock:
+            cached = self._tokens.get(key)
+
+            if cached and cached[1] > time.time():
+                return cached[0]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = self._flights[key] = self.Flight()
+
+        if not leader:
+            flight.done.wait()
+
+            if flight.exception:
+                raise flight.exception
+
+            return flight.token
+
+        try:
+            token = self.shared.get(key) if self.shared is not None else None
+
+            if token is None:
+                token = _fetch_application_access_token(application_id, application_secret_key)
+
+                if self.shared is not None:
+                    self.shared.set(key, token, self.timeout)
+
+            with self._lock:
+                self._tokens[key] = (token, time.time() + self.timeout)
+
+            flight.token = token
+            return token
+        except Exception as exception:
+            flight.exception = exception
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def invalidate(self, application_id, application_secret_key):
+        """Forget the token cached for the given application, e.g. once Facebook rejects it."""
+        key = self._key(application_id, application_secret_key)
+
+        with self._lock:
+            self._tokens.pop(key, None)
+
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        """Forget all tokens cached by this process."""
+        with self._lock:
+            self._tokens.clear()
+
+    def _key(self, application_id, application_secret_key):
+        return 'facepy.application_access_token.%s.%s' % (
+            application_id, hashlib.sha1(str(application_secret_key)).hexdigest())
+
+    class Flight(object):
+        """A request for a token that concurrent callers wait for."""
+
+        def __init__(self):
+            self.done = Event()
+            self.token = None
+            self.exception = None
+
+
+application_access_token_cache = ApplicationAccessTokenCache()
+
+
+def get_application_access_token(application_id, application_secret_key, cache=True):
     """
     Get an OAuth access token for the given application.
 
     :param application_id: An integer describing a Facebook application's ID.
     :param application_secret_key: A string describing a Facebook application's secret key.
+    :param cache: A boolean describing whether to use ``application_access_token_cache``.
+    """
+    if cache:
+        return application_access_token_cache.get(application_id, application_secret_key)
+    else:
+        return _fetch_application_access_token(application_id, application_secret_key)
+
+
+# The code of the error Facebook rejects invalid or revoked OAuth access tokens with.
+INVALID_ACCESS_TOKEN = 190
+
+
+def with_application_access_token(application_id, application_secret_key, function):
+    """
+    Call a function making Graph API requests with an OAuth access token for the given application.
+
+    If Facebook rejects the token cached in ``application_access_token_cache`` (e.g. because the
+    application's secret key has been reset), it is forgotten and the function is called once more
+    with a token requested anew.
+
+    :param application_id: An integer describing a Facebook application's ID.
+    :param application_secret_key: A string describing a Facebook application's secret key.
+    :param function: A function taking a string describing the token.
     """
+    try:
+        return function(get_application_access_token(application_id, application_secret_key))
+    except GraphAPI.OAuthError as exception:
+        if exception.code != INVALID_ACCESS_TOKEN:
+            raise
+
+    application_access_token_cache.invalidate(application_id, application_secret_key)
+
+    return function(get_application_access_token(application_id, application_secret_key))
+
+
+def _fetch_application_access_token(application_id, application_secret_key):
     graph = GraphAPI()
 
     response = graph.get(
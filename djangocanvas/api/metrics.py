@@ -0,0 +1,175 @@
+"""
+Measurements of the requests the Graph API and VK API clients send.
+
+Clients report each response, error and retry to the sinks in ``sinks``, labelled with
+the client's name (``graph`` or ``vkontakte``) and the endpoint requested; nothing is
+measured unless a sink has been added. ``Registry`` keeps measurements in memory and
+renders them in Prometheus' text exposition format.
+"""
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds, in seconds, of the buckets ``Registry`` counts request durations in.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The sinks measurements are reported to.
+sinks = []
+
+
+class Sink(object):
+    """
+    Base class for sinks, which receive measurements of API requests as they're made.
+    Sinks may be called from several threads at once.
+    """
+
+    def request(self, client, endpoint, duration, status, response_bytes, request_bytes):
+        """
+        Receive a measurement of a request that was responded to.
+
+        :param client: A string describing the client that sent the request.
+        :param endpoint: A string describing the endpoint requested.
+        :param duration: A number describing how many seconds the request took.
+        :param status: An integer describing the HTTP status code of the response.
+        :param response_bytes: An integer describing the length of the response body.
+        :param request_bytes: An integer describing the length of the request body.
+        """
+
+    def error(self, client, endpoint, code):
+        """
+        Receive an error a request failed with.
+
+        :param code: A string describing the error's code, or ``connection`` for transport errors.
+        """
+
+    def retry(self, client, endpoint):
+        """Receive a retry of a failed request."""
+
+
+def request(client, endpoint, duration, status, response_bytes, request_bytes):
+    """Report a request that was responded to to the sinks; see ``Sink.request``."""
+    for sink in sinks:
+        sink.request(client, endpoint, duration, status, response_bytes, request_bytes)
+
+
+def error(client, endpoint, code):
+    """Report an error a request failed with to the sinks; see ``Sink.error``."""
+    for sink in sinks:
+        sink.error(client, endpoint, str(code))
+
+
+def retry(client, endpoint):
+    """Report a retry of a failed request to the sinks; see ``Sink.retry``."""
+    for sink in sinks:
+        sink.retry(client, endpoint)
+
+
+class Registry(Sink):
+    """
+    A sink keeping a histogram of request durations, and counts of responses per status code,
+    errors per code, request and response bytes and retries, per client and endpoint.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        """
+        Initialize the registry.
+
+        :param buckets: A list of numbers describing the upper bounds, in seconds, of the buckets
+                        request durations are counted in.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        self.clear()
+
+    def request(self, client, endpoint, duration, status, response_bytes, request_bytes):
+        key = (client, endpoint)
+
+        with self._lock:
+            histogram = self._durations.get(key)
+
+            if histogram is None:
+                histogram = self._durations[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            histogram[0][bisect_left(self.buckets, duration)] += 1
+            histogram[1] += duration
+
+            self._increment(self._responses, (client, endpoint, str(status)))
+            self._increment(self._response_bytes, key, response_bytes)
+            self._increment(self._request_bytes, key, request_bytes)
+
+    def error(self, client, endpoint, code):
+        with self._lock:
+            self._increment(self._errors, (client, endpoint, code))
+
+    def retry(self, client, endpoint):
+        with self._lock:
+            self._increment(self._retries, (client, endpoint))
+
+    def clear(self):
+        """Forget all measurements."""
+        with self._lock:
+            self._durations = {}
+            self._responses = {}
+            self._response_bytes = {}
+            self._request_bytes = {}
+            self._errors = {}
+            self._retries = {}
+
+    def render(self):
+        """Return a string describing the measurements in Prometheus' text exposition format."""
+        with self._lock:
+            durations = dict((key, (list(counts), total)) for key, (counts, total) in self._durations.items())
+            counters = [
+                ('djangocanvas_api_responses_total', 'Responses to API requests.',
+                 ('client', 'endpoint', 'status'), dict(self._responses)),
+                ('djangocanvas_api_response_bytes_total', 'Bytes of responses to API requests.',
+                 ('client', 'endpoint'), dict(self._response_bytes)),
+                ('djangocanvas_api_request_bytes_total', 'Bytes of API request bodies.',
+                 ('client', 'endpoint'), dict(self._request_bytes)),
+                ('djangocanvas_api_errors_total', 'Errors API requests failed with.',
+                 ('client', 'endpoint', 'code'), dict(self._errors)),
+                ('djangocanvas_api_retries_total', 'Retries of failed API requests.',
+                 ('client', 'endpoint'), dict(self._retries)),
+            ]
+
+        name = 'djangocanvas_api_request_duration_seconds'
+        lines = [
+            '# HELP %s Duration of API requests.' % name,
+            '# TYPE %s histogram' % name,
+        ]
+
+        for (client, endpoint), (counts, total) in sorted(durations.items()):
+            labels = _labels(('client', 'endpoint'), (client, endpoint))
+            cumulative = 0
+
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%r"} %d' % (name, labels, float(bound), cumulative))
+
+            cumulative += counts[-1]
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, cumulative))
+            lines.append('%s_sum{%s} %r' % (name, labels, total))
+            lines.append('%s_count{%s} %d' % (name, labels, cumulative))
+
+        for name, description, label_names, values in counters:
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s counter' % name)
+
+            for key, value in sorted(values.items()):
+                lines.append('%s{%s} %d' % (name, _labels(label_names, key), value))
+
+        return '\n'.join(lines) + '\n'
+
+    def _increment(self, counter, key, value=1):
+        counter[key] = counter.get(key, 0) + value
+
+
+def _labels(names, values):
+    return ','.join(['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)])
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The registry rendered at djangocanvas' ``api_metrics`` URL if DJANGOCANVAS_API_METRICS is set.
+registry = Registry()
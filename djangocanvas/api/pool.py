@@ -0,0 +1,79 @@
+"""
+A pool of threads the asynchronous Graph API and VK API clients send requests on.
+
+Both clients default to ``default_request_pool``, so that their combined concurrency
+per process is limited.
+"""
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+
+class RequestPool(object):
+    """
+    A pool of threads sending API requests, limiting how many are in flight at once.
+
+    Threads are started upon the first request, so that merely importing a client doesn't.
+    """
+
+    def __init__(self, concurrency=20):
+        """
+        Initialize the pool.
+
+        :param concurrency: An integer describing how many requests may be in flight at once.
+        """
+        self.concurrency = concurrency
+
+        self.submitted = 0
+        self.completed = 0
+        self.peak = 0
+
+        self._pool = None
+        self._lock = Lock()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Call the given function on one of the pool's threads.
+
+        Returns an ``AsyncResult`` whose ``get`` method returns the function's return value
+        or raises the exception it raised.
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.concurrency)
+
+            self.submitted += 1
+            self.peak = max(self.peak, min(self.submitted - self.completed, self.concurrency))
+
+            pool = self._pool
+
+        return pool.apply_async(self._call, (function, args, kwargs))
+
+    def stats(self):
+        """Return a dictionary describing how many requests were submitted, are pending and so on."""
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'pending': self.submitted - self.completed,
+                'peak': self.peak,
+            }
+
+    def close(self):
+        """Stop the pool's threads once pending requests have completed."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _call(self, function, args, kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.completed += 1
+
+
+# The pool ``AsyncGraphAPI`` and ``AsyncAPI`` send requests on unless given another.
+default_request_pool = RequestPool()
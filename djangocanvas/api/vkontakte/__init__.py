@@ -1 +1,2 @@
 from api import API, VKError, signature
+from async_api import AsyncAPI
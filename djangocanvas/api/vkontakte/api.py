@@ -1,16 +1,14 @@
 # coding: utf-8
 import random
+import re
 import time
 import urllib
 import urllib2
 import warnings
 from hashlib import md5
 from functools import partial
-try:
-    import simplejson as json
-except ImportError:
-    import json
 import http
+from .. import codec, metrics
 
 API_URL = 'http://api.vk.com/api.php'
 OPEN_API_URL = 'https://oauth.vk.com/'
@@ -54,7 +52,7 @@ class VKError(Exception):
 
 def _encode(s):
     if isinstance(s, (dict, list, tuple)):
-        s = json.dumps(s, ensure_ascii=False, encoding=REQUEST_ENCODING)
+        s = codec.dumps(s, ensure_ascii=False)
 
     if isinstance(s, unicode):
         s = s.encode(REQUEST_ENCODING)
@@ -62,13 +60,91 @@ def _encode(s):
     return s  # this can be number, etc.
 
 
+# Matchers finding the end of whitespace and the start of a response array at a
+# position of a string, so that neither requires slicing (copying) the string.
+_skip_whitespace = re.compile(r'[ \t\n\r]*').match
+_match_response_array = re.compile(r'\{[ \t\n\r]*"response"[ \t\n\r]*:[ \t\n\r]*\[').match
+
+
+# Matches where a body consisting of several objects (e.g. errors preceding the response)
+# continues with the next one, or control characters that strict decoders reject.
+_search_raw_decodable = re.compile(r'\}[ \t\n\r]*\{|[\x00-\x08\x0b\x0c\x0e-\x1f]').search
+
+
 def _json_iterparse(response):
-    response = response.strip()
-    decoder = json.JSONDecoder(encoding="utf8", strict=False)
-    idx = 0
-    while idx < len(response):
-        obj, idx = decoder.raw_decode(response, idx)
+    # Most bodies consist of a single object, which the fastest JSON library
+    # available decodes at once; others are decoded object by object, rather
+    # than being decoded in vain first.
+    if not _search_raw_decodable(response):
+        try:
+            obj = codec.loads(response)
+        except ValueError:
+            pass
+        else:
+            yield obj
+            return
+
+    end = len(response)
+    idx = _skip_whitespace(response, 0).end()
+    while idx < end:
+        obj, idx = codec.raw_decode(response, idx)
         yield obj
+        idx = _skip_whitespace(response, idx).end()
+
+
+def _json_iterresponse(response):
+    """
+    Iterate over the items of the response array in a VK API response body, which may be
+    preceded by errors. When the body starts with the array, its items are decoded one
+    at a time as they're iterated over; a response that isn't an array is yielded as is.
+    """
+    errors = []
+    end = len(response)
+    idx = _skip_whitespace(response, 0).end()
+
+    while idx < end:
+        match = _match_response_array(response, idx)
+
+        if match:
+            for error in errors:
+                warnings.warn("%s" % error)
+
+            idx = _skip_whitespace(response, match.end()).end()
+
+            if response[idx:idx + 1] == ']':
+                return
+
+            while True:
+                item, idx = codec.raw_decode(response, idx)
+                yield item
+
+                idx = _skip_whitespace(response, idx).end()
+                separator = response[idx:idx + 1]
+
+                if separator == ']':
+                    return
+                if separator != ',':
+                    raise ValueError("Expecting , or ] at position %d" % idx)
+
+                idx = _skip_whitespace(response, idx + 1).end()
+
+        data, idx = codec.raw_decode(response, idx)
+
+        if "error" in data:
+            errors.append(data["error"])
+        if "response" in data:
+            for error in errors:
+                warnings.warn("%s" % error)
+            if isinstance(data["response"], list):
+                for item in data["response"]:
+                    yield item
+            else:
+                yield data["response"]
+            return
+
+        idx = _skip_whitespace(response, idx).end()
+
+    raise VKError(errors[0])
 
 
 def signature(api_secret, params):
@@ -87,6 +163,9 @@ def signature(api_secret, params):
 
 
 class _API(object):
+    # A ratelimit.RateLimiter instance to wait for before each call, if any.
+    rate_limiter = None
+
     def __init__(self, api_id=None, api_secret=None, token=None, **defaults):
 
         if not (api_id and api_secret or token):
@@ -105,18 +184,15 @@ class _API(object):
                 '{oauth_url}access_token?client_id={api_id}&client_secret={api_secret}&grant_type=client_credentials'.format(oauth_url=OPEN_API_URL,
                                                                                                                              api_id=self.api_id,
                                                                                                                              api_secret=self.api_secret))
-            return json.loads(url.read())['access_token']
+            return codec.loads(url.read())['access_token']
         except urllib2.URLError:
             return None
 
     def _get(self, method, timeout=DEFAULT_TIMEOUT, **kwargs):
-        status, response = self._request(method, timeout=timeout, **kwargs)
-        if not (200 <= status <= 299):
-            raise VKError({
-                'error_code': status,
-                'error_msg': "HTTP error",
-                'request_params': kwargs,
-            })
+        return self._get_data(method, timeout, **kwargs)["response"]
+
+    def _get_data(self, method, timeout=DEFAULT_TIMEOUT, **kwargs):
+        response = self._get_body(method, timeout, **kwargs)
 
         # there may be a response after errors
         errors = []
@@ -126,23 +202,54 @@ class _API(object):
             if "response" in data:
                 for error in errors:
                     warnings.warn("%s" % error)
-                return data["response"]
+                return data
+
+        if metrics.sinks:
+            metrics.error('vkontakte', method, errors[0].get('error_code'))
 
         raise VKError(errors[0])
 
+    def _iterate(self, method, timeout=DEFAULT_TIMEOUT, **kwargs):
+        return _json_iterresponse(self._get_body(method, timeout, **kwargs))
+
+    def _get_body(self, method, timeout=DEFAULT_TIMEOUT, **kwargs):
+        status, response = self._request(method, timeout=timeout, **kwargs)
+        if not (200 <= status <= 299):
+            raise VKError({
+                'error_code': status,
+                'error_msg': "HTTP error",
+                'request_params': kwargs,
+            })
+        return response
+
     def __getattr__(self, name):
         '''
         Support for api.<method>.<methodName> syntax
         '''
         if name in COMPLEX_METHODS:
-            api = _API(api_id=self.api_id, api_secret=self.api_secret,
-                       token=self.token, **self.defaults)
-            api.method_prefix = name + '.'
-            return api
+            return self._namespace(name)
 
         # the magic to convert instance attributes into method names
         return partial(self, method=name)
 
+    def batch(self):
+        """
+        Return a ``Batch`` combining the calls made through it into ``execute`` requests::
+
+            >>> with vk.batch() as batch:
+            ...     profiles = batch.users.get(uids='1,2')
+            ...     friends = batch.friends.get(uid=1)
+            >>> profiles.get()
+        """
+        return Batch(self)
+
+    def _namespace(self, name):
+        api = _API(api_id=self.api_id, api_secret=self.api_secret,
+                   token=self.token, **self.defaults)
+        api.method_prefix = name + '.'
+        api.rate_limiter = self.rate_limiter
+        return api
+
     def __call__(self, **kwargs):
         method = kwargs.pop('method')
         params = self.defaults.copy()
@@ -187,12 +294,150 @@ class _API(object):
         headers = {"Accept": "application/json",
                    "Content-Type": "application/x-www-form-urlencoded"}
 
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.api_id, self.token)
+
+        start = time.time()
+
         # urllib2 doesn't support timeouts for python 2.5 so
         # custom function is used for making http requests
-        return http.post(url, data, headers, timeout, secure=secure)
+        try:
+            status, body = http.post(url, data, headers, timeout, secure=secure,
+                                     on_retry=partial(metrics.retry, 'vkontakte', method) if metrics.sinks else None)
+        except Exception:
+            if metrics.sinks:
+                metrics.error('vkontakte', method, 'connection')
+            raise
+
+        if metrics.sinks:
+            metrics.request('vkontakte', method, time.time() - start, status, len(body), len(data))
+
+        return status, body
+
+
+# The number of calls VK executes in a single ``execute`` request at most.
+EXECUTE_LIMIT = 25
+
+
+class BatchResult(object):
+    """The result of a call made through a ``Batch``, available once the batch has been sent."""
+
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self._value = None
+        self._error = None
+        self._ready = False
+
+    def ready(self):
+        return self._ready
+
+    def get(self):
+        """Return the call's response, or raise the ``VKError`` it failed with."""
+        if not self._ready:
+            raise ValueError("The batch %s belongs to hasn't been sent yet" % self.method)
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def _resolve(self, value=None, error=None):
+        self._value, self._error, self._ready = value, error, True
+
+
+class _BatchNamespace(object):
+    def __init__(self, batch, prefix):
+        self._batch = batch
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        return partial(self._batch.get, self._prefix + name)
+
+
+class Batch(object):
+    """
+    Queue VK API calls and send them in ``execute`` requests of up to ``EXECUTE_LIMIT`` calls
+    once the ``with`` block is left, resolving the ``BatchResult`` returned for each call.
+
+    Calls that fail are resolved with a ``VKError`` built from the ``execute_errors``
+    VK reports alongside the response; if an ``execute`` request fails altogether,
+    each of its calls is resolved with that error.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.calls = []
+
+    def get(self, method, **kwargs):
+        params = self.api.defaults.copy()
+        params.pop('timeout', None)
+        params.update(kwargs)
+
+        result = BatchResult(method, params)
+        self.calls.append(result)
+        return result
+
+    def send(self):
+        """Send the calls queued so far."""
+        calls, self.calls = self.calls, []
+
+        for i in range(0, len(calls), EXECUTE_LIMIT):
+            self._execute(calls[i:i + EXECUTE_LIMIT])
+
+    def _execute(self, calls):
+        code = 'return [%s];' % ','.join(
+            ['API.%s(%s)' % (call.method, _encode(call.params)) for call in calls])
+
+        timeout = self.api.defaults.get('timeout', DEFAULT_TIMEOUT)
+
+        try:
+            # Call _API._get_data directly so the execute request is sent synchronously,
+            # bypassing overrides in subclasses such as AsyncAPI's _get.
+            data = _API._get_data(self.api, 'execute', timeout, code=code)
+        except VKError as error:
+            for call in calls:
+                call._resolve(error=error)
+            return
+
+        # Calls that failed yield ``false``; their errors are listed in order.
+        errors = list(data.get('execute_errors', []))
+
+        for call, value in zip(calls, data['response'] or [False] * len(calls)):
+            if value is False and errors:
+                error = errors.pop(0)
+
+                if metrics.sinks:
+                    metrics.error('vkontakte', call.method, error.get('error_code'))
+
+                call._resolve(error=VKError({
+                    'error_code': error.get('error_code'),
+                    'error_msg': error.get('error_msg'),
+                    'request_params': call.params,
+                }))
+            else:
+                call._resolve(value)
+
+    def __getattr__(self, name):
+        if name in COMPLEX_METHODS:
+            return _BatchNamespace(self, name + '.')
+        return partial(self.get, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.send()
 
 
 class API(_API):
 
     def get(self, method, timeout=DEFAULT_TIMEOUT, **kwargs):
         return self._get(method, timeout, **kwargs)
+
+    def iterate(self, method, timeout=DEFAULT_TIMEOUT, **kwargs):
+        """
+        Call the given method and iterate over the items of the array it responds with,
+        decoding each item only once it's reached. Errors VK responds with are raised
+        upon iteration.
+        """
+        return self._iterate(method, timeout, **kwargs)
@@ -0,0 +1,35 @@
+# coding: utf-8
+from ..pool import RequestPool, default_request_pool
+from api import _API, DEFAULT_TIMEOUT
+
+
+# Calls are made this way:
+#
+#   >>> vk = AsyncAPI(key, secret)
+#   >>> result = vk.friends.get(uid=123)  # returns at once
+#   >>> result.get()                      # waits for the response
+#
+# Signing, parsing and errors are the same as for API, since the calls are
+# made by _API._get on the pool's threads.
+
+
+class _AsyncAPI(_API):
+    def __init__(self, api_id=None, api_secret=None, token=None, pool=None, **defaults):
+        _API.__init__(self, api_id, api_secret, token, **defaults)
+        self.pool = pool or default_request_pool
+
+    def _namespace(self, name):
+        api = _AsyncAPI(api_id=self.api_id, api_secret=self.api_secret,
+                        token=self.token, pool=self.pool, **self.defaults)
+        api.method_prefix = name + '.'
+        api.rate_limiter = self.rate_limiter
+        return api
+
+    def _get(self, method, timeout=DEFAULT_TIMEOUT, **kwargs):
+        return self.pool.submit(_API._get, self, method, timeout, **kwargs)
+
+
+class AsyncAPI(_AsyncAPI):
+
+    def get(self, method, timeout=DEFAULT_TIMEOUT, **kwargs):
+        return self._get(method, timeout, **kwargs)
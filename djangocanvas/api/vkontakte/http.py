@@ -1,27 +1,186 @@
 #coding: utf-8
 from __future__ import with_statement
-from contextlib import closing
+import errno
 import httplib
+import socket
+import time
+import zlib
+from threading import Lock
 
 # urllib2 doesn't support timeouts for python 2.5 so
 # custom function is used for making http requests
 
-def post(url, data, headers, timeout, secure=False):
-    host_port = url.split('/')[2]
-    timeout_set = False
-    connection = httplib.HTTPSConnection if secure else httplib.HTTPConnection
-    try:
-        connection = connection(host_port, timeout = timeout)
-        timeout_set = True
-    except TypeError:
-        connection = connection(host_port)
-
-    with closing(connection):
-        if not timeout_set:
-            connection.connect()
-            connection.sock.settimeout(timeout)
-            timeout_set = True
-
-        connection.request("POST", url, data, headers)
-        response = connection.getresponse()
-        return (response.status, response.read())
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of keep-alive connections, kept per host.
+
+    Connections that have been idle for longer than ``idle_timeout`` seconds are
+    closed instead of being reused; a request failing on a reused connection because
+    the server has closed it meanwhile is retried on a new one. Requests that may have
+    reached the server (e.g. ones that timed out) are never retried, since VK API
+    methods such as ``wall.post`` aren't idempotent.
+    """
+
+    # The number of bytes of a compressed response body read at a time.
+    CHUNK_SIZE = 64 * 1024
+
+    # Error numbers of socket errors signalling that the server has closed a keep-alive connection.
+    STALE_CONNECTION_ERRORS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+    def __init__(self, max_size=10, idle_timeout=30):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.retried = 0
+
+        self._idle = {}
+        self._lock = Lock()
+
+    def request(self, url, data, headers, timeout, secure=False, on_retry=None):
+        """
+        Post the data to the URL, returning a tuple of the response's status code and body.
+
+        :param on_retry: A function called without arguments whenever the request is retried
+                         on a new connection because a reused one had gone stale.
+        """
+        host_port = url.split('/')[2]
+
+        headers = dict(headers)
+        headers.setdefault('Accept-Encoding', 'gzip')
+
+        while True:
+            connection, reused = self._acquire(host_port, secure, timeout)
+
+            try:
+                connection.request("POST", url, data, headers)
+                response = connection.getresponse()
+            except (httplib.HTTPException, socket.error) as exception:
+                connection.close()
+
+                if reused and self._is_stale(exception):
+                    with self._lock:
+                        self.retried += 1
+                    if on_retry is not None:
+                        on_retry()
+                    continue
+                raise
+
+            try:
+                body = self._read(response)
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(host_port, secure, connection)
+
+            return (response.status, body)
+
+    def _is_stale(self, exception):
+        """
+        Determine whether an exception raised before a response arrived signals that the
+        connection had been closed by the server rather than that the request failed.
+        """
+        if isinstance(exception, httplib.BadStatusLine):
+            return True
+
+        if isinstance(exception, socket.timeout):
+            return False
+
+        return isinstance(exception, socket.error) and exception.errno in self.STALE_CONNECTION_ERRORS
+
+    def _read(self, response):
+        # Bodies are read in chunks, decompressing gzipped ones as they arrive,
+        # so that a compressed copy of a large body is never held in full.
+        if response.getheader('content-encoding', '').lower() != 'gzip':
+            return response.read()
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = []
+
+        while True:
+            chunk = response.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(decompressor.decompress(chunk))
+
+        chunks.append(decompressor.flush())
+
+        return ''.join(chunks)
+
+    def stats(self):
+        """Return a dictionary describing how many connections were created, reused and so on."""
+        with self._lock:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'retried': self.retried,
+                'idle': sum([len(idle) for idle in self._idle.values()]),
+            }
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection, released_at in connections:
+                connection.close()
+
+    def _acquire(self, host_port, secure, timeout):
+        now = time.time()
+        stale = []
+        connection = None
+
+        with self._lock:
+            idle = self._idle.get((secure, host_port), [])
+
+            while idle:
+                candidate, released_at = idle.pop()
+                if now - released_at < self.idle_timeout:
+                    connection = candidate
+                    self.reused += 1
+                    break
+                stale.append(candidate)
+                self.discarded += 1
+
+            if connection is None:
+                self.created += 1
+
+        for candidate in stale:
+            candidate.close()
+
+        if connection is not None:
+            connection.timeout = timeout
+            if connection.sock:
+                connection.sock.settimeout(timeout)
+            return connection, True
+
+        connection_class = httplib.HTTPSConnection if secure else httplib.HTTPConnection
+        return connection_class(host_port, timeout=timeout), False
+
+    def _release(self, host_port, secure, connection):
+        with self._lock:
+            idle = self._idle.setdefault((secure, host_port), [])
+
+            if len(idle) < self.max_size:
+                idle.append((connection, time.time()))
+                return
+
+            self.discarded += 1
+
+        connection.close()
+
+
+pool = ConnectionPool()
+
+
+def post(url, data, headers, timeout, secure=False, on_retry=None):
+    return pool.request(url, data, headers, timeout, secure=secure, on_retry=on_retry)
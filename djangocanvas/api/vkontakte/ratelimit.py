@@ -0,0 +1,247 @@
+# coding: utf-8
+from __future__ import with_statement
+import fcntl
+import os
+import time
+from hashlib import md5
+from logging import getLogger
+from threading import Lock
+from uuid import uuid4
+
+from .. import codec
+
+logger = getLogger('djangocanvas')
+
+# VK allows this many calls per second per access token.
+TOKEN_RATE = 3
+
+
+class LocalStorage(object):
+    """
+    Storage for rate limiter state, shared by the threads of a process.
+    """
+
+    # The number of keys beyond which expired keys are purged.
+    PURGE_SIZE = 10000
+
+    def __init__(self):
+        self._values = {}
+        self._lock = Lock()
+
+    def update(self, key, function):
+        """
+        Atomically replace the value stored for the given key.
+
+        :param function: A function taking the stored value (or ``None``) and returning a tuple
+                         of the new value, the number of seconds to keep it and a result to return.
+        """
+        now = time.time()
+
+        with self._lock:
+            value, expires = self._values.get(key, (None, None))
+            value, timeout, result = function(value if expires > now else None)
+            self._values[key] = (value, now + timeout)
+
+            if len(self._values) > self.PURGE_SIZE:
+                for key, (value, expires) in self._values.items():
+                    if expires <= now:
+                        del self._values[key]
+
+        return result
+
+
+class FileStorage(object):
+    """
+    Storage for rate limiter state in a file, shared by the processes of a host
+    (e.g. the workers of an application server) by means of ``flock``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+
+    def update(self, key, function):
+        """Atomically replace the value stored for the given key. See ``LocalStorage.update``."""
+        now = time.time()
+
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+
+                f = os.fdopen(os.dup(fd), 'r+')
+
+                try:
+                    try:
+                        values = codec.loads(f.read() or '{}')
+                    except ValueError:
+                        values = {}
+
+                    values = dict([(k, v) for k, v in values.items() if v[1] > now])
+
+                    value, timeout, result = function(values.get(key, (None, None))[0])
+                    values[key] = (value, now + timeout)
+
+                    f.seek(0)
+                    f.truncate()
+                    f.write(codec.dumps(values))
+                finally:
+                    f.close()
+            finally:
+                os.close(fd)
+
+        return result
+
+
+class CacheStorage(object):
+    """
+    Storage for rate limiter state in a cache implementing Django's cache interface,
+    shared by the processes of all hosts using that cache.
+
+    Updates are serialized with a lock kept in the cache itself, holding a token unique to
+    its holder so that no process releases a lock it doesn't hold. A lock left behind by
+    a process that died holding it expires after ``lock_timeout`` seconds. If the lock is
+    still held by another process after ``LOCK_ATTEMPTS`` attempts, or the cache fails,
+    the update is made in a ``LocalStorage`` instead, limiting the rate per process only.
+    """
+
+    # The number of attempts to acquire the lock before falling back to a ``LocalStorage``.
+    LOCK_ATTEMPTS = 4
+
+    # The number of seconds to wait after the first failed attempt; the wait doubles after each one.
+    LOCK_BACKOFF = 0.005
+
+    def __init__(self, cache, prefix='vkontakte.ratelimit.', lock_timeout=1):
+        self.cache = cache
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self.fallback = LocalStorage()
+
+    def update(self, key, function):
+        """Atomically replace the value stored for the given key. See ``LocalStorage.update``."""
+        key = self.prefix + key
+        lock = key + '.lock'
+        token = uuid4().hex
+
+        try:
+            locked = self._lock(lock, token)
+        except Exception as exception:
+            logger.warning(u'Could not lock VK API rate limit "{0}" in the cache; limiting it locally: {1}'.format(
+                key, exception))
+            return self.fallback.update(key, function)
+
+        if not locked:
+            logger.warning(u'Could not lock VK API rate limit "{0}" in the cache; limiting it locally'.format(key))
+            return self.fallback.update(key, function)
+
+        try:
+            value, timeout, result = function(self.cache.get(key))
+            self.cache.set(key, value, int(timeout) + 1)
+        finally:
+            # The lock may have expired and been acquired by another process meanwhile.
+            if self.cache.get(lock) == token:
+                self.cache.delete(lock)
+
+        return result
+
+    def _lock(self, lock, token):
+        delay = self.LOCK_BACKOFF
+
+        for attempt in range(self.LOCK_ATTEMPTS):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+
+            if self.cache.add(lock, token, self.lock_timeout):
+                return True
+
+        return False
+
+
+class RateLimiter(object):
+    """
+    Limit the rate of VK API calls per access token and per application.
+
+    Buckets are implemented with the generic cell rate algorithm: each bucket's state is
+    the time at which it will be empty again. A call that would overflow a bucket isn't
+    rejected, but waits until the bucket has room, so that bursts are smoothed out.
+    """
+
+    def __init__(self, storage=None, token_rate=TOKEN_RATE, app_rate=None, per=1.0):
+        """
+        Initialize the limiter.
+
+        :param storage: An object with an ``update(key, function)`` method such as
+                        ``LocalStorage``, ``FileStorage`` or ``CacheStorage`` to keep buckets in.
+                        Defaults to a ``LocalStorage`` instance.
+        :param token_rate: An integer describing how many calls may be made with an access
+                           token per ``per`` seconds, or ``None`` for no limit.
+        :param app_rate: An integer describing how many calls may be made by the application
+                         per ``per`` seconds, or ``None`` for no limit.
+        :param per: A number describing the length of the period in seconds.
+        """
+        self.storage = storage or LocalStorage()
+        self.token_rate = token_rate
+        self.app_rate = app_rate
+        self.per = per
+
+        self.calls = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+        self._lock = Lock()
+
+    def acquire(self, api_id=None, token=None):
+        """
+        Wait until a call may be made with the given application and/or access token.
+
+        Returns a number describing how many seconds were waited.
+        """
+        delay = 0
+
+        if token and self.token_rate:
+            # Access tokens are hashed so as not to be disclosed to shared storage.
+            delay = max(delay, self._reserve('token.%s' % md5(token).hexdigest(), self.token_rate))
+
+        if api_id and self.app_rate:
+            delay = max(delay, self._reserve('app.%s' % api_id, self.app_rate))
+
+        with self._lock:
+            self.calls += 1
+            if delay > 0:
+                self.waits += 1
+                self.wait_time += delay
+                self.max_wait_time = max(self.max_wait_time, delay)
+
+        if delay > 0:
+            self.sleep(delay)
+
+        return delay
+
+    def sleep(self, delay):
+        """Wait the given number of seconds."""
+        time.sleep(delay)
+
+    def stats(self):
+        """Return a dictionary describing how many calls were made, how many had to wait and for how long."""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+            }
+
+    def _reserve(self, key, rate):
+        interval = float(self.per) / rate
+
+        def reserve(empty_at):
+            now = time.time()
+
+            # Add the call to the bucket; it may be made once the bucket holds no more than ``rate`` calls.
+            empty_at = max(empty_at or now, now) + interval
+            return empty_at, empty_at - now, max(0, empty_at - now - self.per)
+
+        return self.storage.update(key, reserve)
@@ -0,0 +1,181 @@
+"""In-process caches used to avoid repeating work across requests."""
+import time
+from threading import RLock
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe in-process cache that evicts the least recently
+    used entries once full and optionally expires entries after a timeout.
+    """
+
+    # Indices of the fields in a linked list node.
+    PREV, NEXT, KEY, VALUE, EXPIRES = 0, 1, 2, 3, 4
+
+    def __init__(self, max_size=1000, timeout=None):
+        """
+        Initialize the cache.
+
+        :param max_size: An integer describing how many entries may be held at once.
+        :param timeout: An integer describing how many seconds entries are held by default,
+                        or ``None`` if they should not expire.
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = RLock()
+        self._entries = {}
+
+        # A circular doubly linked list of entries ordered by recency of use,
+        # the root's successor being the least recently used entry.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, None]
+
+    def get(self, key, default=None):
+        """Return the value cached for the given key, or ``default`` if there is none."""
+        with self._lock:
+            node = self._entries.get(key)
+
+            if node is not None and node[self.EXPIRES] is not None and node[self.EXPIRES] <= time.time():
+                self._unlink(node)
+                del self._entries[key]
+                node = None
+
+            if node is None:
+                self.misses += 1
+                return default
+
+            self._unlink(node)
+            self._append(node)
+            self.hits += 1
+
+            return node[self.VALUE]
+
+    def set(self, key, value, timeout=None):
+        """
+        Cache the given value.
+
+        :param key: A hashable object describing the key to cache the value under.
+        :param value: The object to cache.
+        :param timeout: An integer describing how many seconds the value is held for. Defaults
+                        to the cache's timeout.
+        """
+        if self.max_size <= 0:
+            return
+
+        if timeout is None:
+            timeout = self.timeout
+
+        expires = time.time() + timeout if timeout is not None else None
+
+        with self._lock:
+            node = self._entries.get(key)
+
+            if node is not None:
+                self._unlink(node)
+            elif len(self._entries) >= self.max_size:
+                oldest = self._root[self.NEXT]
+                self._unlink(oldest)
+                del self._entries[oldest[self.KEY]]
+
+            node = [None, None, key, value, expires]
+            self._append(node)
+            self._entries[key] = node
+
+    def delete(self, key):
+        """Remove the value cached for the given key, if any."""
+        with self._lock:
+            node = self._entries.pop(key, None)
+            if node is not None:
+                self._unlink(node)
+
+    def clear(self):
+        """Remove all cached values and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._root[:] = [self._root, self._root, None, None, None]
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return a dictionary describing the size of the cache and its hit/miss counters."""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _append(self, node):
+        last = self._root[self.PREV]
+        node[self.PREV], node[self.NEXT] = last, self._root
+        last[self.NEXT] = self._root[self.PREV] = node
+
+    def _unlink(self, node):
+        node[self.PREV][self.NEXT] = node[self.NEXT]
+        node[self.NEXT][self.PREV] = node[self.PREV]
+
+
+class TieredCache(object):
+    """
+    A cache consulting an in-process ``LRUCache`` before an optional shared cache
+    (e.g. Django's), populating the former with values found in the latter.
+    """
+
+    def __init__(self, local, shared=None, prefix=''):
+        """
+        Initialize the cache.
+
+        :param local: A ``LRUCache`` instance.
+        :param shared: An object implementing Django's cache interface, or ``None``.
+        :param prefix: A string describing a prefix for keys in the shared cache.
+        """
+        self.local = local
+        self.shared = shared
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        """Return the value cached for the given key, or ``default`` if there is none."""
+        value = self.local.get(key)
+
+        if value is None and self.shared is not None:
+            value = self.shared.get(self._shared_key(key))
+
+            if value is not None:
+                self.local.set(key, value)
+
+        return default if value is None else value
+
+    def set(self, key, value, timeout=None):
+        """Cache the given value in both tiers."""
+        self.local.set(key, value, timeout)
+
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key), value, timeout or self.local.timeout)
+
+    def delete(self, key):
+        """Remove the value cached for the given key from both tiers."""
+        self.local.delete(key)
+
+        if self.shared is not None:
+            self.shared.delete(self._shared_key(key))
+
+    def clear(self):
+        """Remove all values from the in-process tier."""
+        self.local.clear()
+
+    def stats(self):
+        """Return a dictionary describing the in-process tier's size and hit/miss counters."""
+        return self.local.stats()
+
+    def _shared_key(self, key):
+        return '%s%s' % (self.prefix, key)
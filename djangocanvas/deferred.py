@@ -0,0 +1,266 @@
+"""
+Execution of work that doesn't need to happen on the request path, such as
+calls to the Graph API made on behalf of users the middleware has just seen.
+
+Work is deferred by name and social ID with ``defer``; the backend described
+by ``DJANGOCANVAS_DEFERRED_BACKEND`` decides when and where it runs.
+"""
+from datetime import datetime, timedelta
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q
+from django.utils.importlib import import_module
+
+import djangocanvas.settings
+
+from djangocanvas.api.facepy import GraphAPI, FacepyError, get_extended_access_token
+from djangocanvas.models import OAuthToken, SocialUser, DeferredTask, save_changed_fields
+from logging import getLogger
+
+
+logger = getLogger('djangocanvas')
+
+
+def fetch_facebook_profile(social_id):
+    """Fill in a Facebook user's name from his/her Graph API profile."""
+    social_user = SocialUser.objects.get_with_oauth_token(social_id=social_id)
+    profile = GraphAPI(social_user.oauth_token.token).get('me')
+
+    save_changed_fields(
+        social_user,
+        first_name=profile.get('first_name'),
+        last_name=profile.get('last_name'))
+
+
+def extend_oauth_token(social_id):
+    """Extend a Facebook user's OAuth token unless it has been extended already."""
+    social_user = SocialUser.objects.get_with_oauth_token(social_id=social_id)
+
+    if social_user.oauth_token and not social_user.oauth_token.extended:
+        # Extending tokens fails every so often due to bug #102727766518358
+        # in the Facebook Platform; the token will be extended on a later launch.
+        #
+        # http://developers.facebook.com/bugs/102727766518358/
+        try:
+            social_user.oauth_token.extend()
+        except (FacepyError, KeyError) as exception:
+            logger.warning(u'Could not extend OAuth token (facebook id = {0}): {1}'.format(social_id, exception))
+
+
+TASKS = {
+    'fetch_facebook_profile': fetch_facebook_profile,
+    'extend_oauth_token': extend_oauth_token,
+}
+
+
+def run_task(name, social_id):
+    """
+    Run a task, logging rather than raising any exception it raises.
+
+    Returns a boolean describing whether the task succeeded.
+    """
+    try:
+        TASKS[name](social_id)
+    except Exception:
+        logger.exception(u'Deferred task "{0}" failed (social id = {1})'.format(name, social_id))
+        return False
+    return True
+
+
+class ImmediateBackend(object):
+    """Run tasks on the calling thread as soon as they are deferred."""
+
+    def defer(self, name, social_id):
+        run_task(name, social_id)
+        return True
+
+
+class ThreadPoolBackend(object):
+    """
+    Run tasks on a pool of background threads. A task that is already pending
+    for a user isn't deferred again until it has run.
+    """
+
+    def __init__(self, workers=None):
+        """
+        Initialize the backend.
+
+        :param workers: An integer describing how many threads to run tasks on. Defaults to
+                        ``DJANGOCANVAS_DEFERRED_WORKERS``.
+        """
+        self.workers = workers or djangocanvas.settings.DEFERRED_WORKERS
+        self.pending = set()
+        self.lock = Lock()
+        self.pool = None
+
+    def defer(self, name, social_id):
+        key = (name, social_id)
+
+        with self.lock:
+            if key in self.pending:
+                return False
+
+            self.pending.add(key)
+
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+
+        self.pool.apply_async(self._run, (name, social_id))
+        return True
+
+    def _run(self, name, social_id):
+        try:
+            run_task(name, social_id)
+        finally:
+            # Threads of the pool outlive requests, so their database
+            # connections aren't closed by Django.
+            connection.close()
+
+            with self.lock:
+                self.pending.discard((name, social_id))
+
+
+class DatabaseBackend(object):
+    """
+    Queue tasks as ``DeferredTask`` instances to be run by the ``run_deferred_tasks``
+    management command. A task that is already queued for a user isn't queued again.
+
+    Workers claim tasks before running them and delete them afterwards. A task claimed
+    by a worker that died before finishing it is run again once its claim is older
+    than ``DJANGOCANVAS_DEFERRED_CLAIM_TIMEOUT`` seconds.
+    """
+
+    def defer(self, name, social_id):
+        try:
+            with transaction.commit_on_success():
+                DeferredTask.objects.create(name=name, social_id=social_id)
+        except IntegrityError:
+            return False
+        return True
+
+    def run(self, limit=None, claim_timeout=None):
+        """
+        Run queued tasks in the order they were queued.
+
+        :param limit: An integer describing how many tasks to run at most, or ``None`` to run all of them.
+        :param claim_timeout: An integer describing after how many seconds claims of unfinished tasks
+                              expire. Defaults to ``DJANGOCANVAS_DEFERRED_CLAIM_TIMEOUT``.
+
+        Returns an integer describing how many tasks were run.
+        """
+        if claim_timeout is None:
+            claim_timeout = djangocanvas.settings.DEFERRED_CLAIM_TIMEOUT
+
+        now = datetime.now()
+        expired = now - timedelta(seconds=claim_timeout)
+
+        tasks = DeferredTask.objects.filter(Q(claimed=False) | Q(claimed_at__lt=expired)).order_by('id')
+
+        if limit is not None:
+            tasks = tasks[:limit]
+
+        count = 0
+
+        for task in list(tasks):
+            # Claim the task so that concurrent workers don't run it as well; a worker
+            # reclaiming an expired claim only succeeds if no other worker has meanwhile.
+            claimed = DeferredTask.objects.filter(pk=task.pk, claimed=task.claimed, claimed_at=task.claimed_at)
+            if not claimed.update(claimed=True, claimed_at=now):
+                continue
+
+            try:
+                run_task(task.name, task.social_id)
+            except BaseException:
+                # The worker is being interrupted; release the task for the next one.
+                DeferredTask.objects.filter(pk=task.pk).update(claimed=False, claimed_at=None)
+                raise
+
+            task.delete()
+            count += 1
+
+        return count
+
+
+_backends = {}
+
+
+def get_backend(path=None):
+    """
+    Return the backend with the given class path.
+
+    :param path: A string describing the backend's class. Defaults to ``DJANGOCANVAS_DEFERRED_BACKEND``.
+    """
+    path = path or djangocanvas.settings.DEFERRED_BACKEND
+
+    if path not in _backends:
+        module_name, class_name = path.rsplit('.', 1)
+        _backends[path] = getattr(import_module(module_name), class_name)()
+
+    return _backends[path]
+
+
+def defer(name, social_id):
+    """
+    Defer a task to the configured backend.
+
+    :param name: A string describing the task; one of ``TASKS``.
+    :param social_id: An integer describing the ID of the user to run the task for.
+
+    Returns a boolean describing whether the task was deferred, as opposed to
+    being pending for the user already.
+    """
+    return get_backend().defer(name, social_id)
+
+
+def refresh_expiring_oauth_tokens(within, batch_size=100, workers=8):
+    """
+    Exchange OAuth tokens that expire within the given period for extended ones, so that
+    users don't have to wait for their token to be extended upon launching the application.
+
+    :param within: A ``timedelta`` instance describing the period.
+    :param batch_size: An integer describing how many tokens to exchange before writing them back.
+    :param workers: An integer describing how many tokens to exchange concurrently.
+
+    Returns a tuple of integers describing how many tokens were refreshed and how many failed to.
+    """
+    def exchange(row):
+        pk, token = row
+        try:
+            token, expires_at = get_extended_access_token(
+                token,
+                djangocanvas.settings.FACEBOOK_APPLICATION_ID,
+                djangocanvas.settings.FACEBOOK_APPLICATION_SECRET_KEY)
+        except (FacepyError, KeyError) as exception:
+            logger.warning(u'Could not refresh OAuth token (id = {0}): {1}'.format(pk, exception))
+            return None
+        return pk, token, expires_at
+
+    refreshed = failed = 0
+    last_pk = 0
+    pool = ThreadPool(workers)
+
+    try:
+        while True:
+            batch = list(
+                OAuthToken.objects.expiring(within)
+                .filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', 'token')[:batch_size]
+            )
+
+            if not batch:
+                break
+
+            last_pk = batch[-1][0]
+
+            results = [result for result in pool.imap_unordered(exchange, batch) if result]
+            OAuthToken.objects.bulk_update_tokens(results)
+
+            refreshed += len(results)
+            failed += len(batch) - len(results)
+    finally:
+        pool.close()
+
+    return refreshed, failed
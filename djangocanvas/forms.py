@@ -3,10 +3,12 @@ from hashlib import md5
 
 from django import forms
 from django.conf import settings
-from django.utils import simplejson as json
+from django.utils.crypto import constant_time_compare
 from django.utils.translation import check_for_language
 from logging import getLogger
 
+from djangocanvas.api import codec
+
 
 VIEWER_TYPES_GROUP = (
     (3, u'пользователь является администратором группы'),
@@ -25,6 +27,13 @@ VIEWER_TYPES_USER = (
 logger = getLogger('djangocanvas')
 
 
+def to_boolean(value):
+    """Приводит параметр запуска к bool так же, как forms.BooleanField с виджетом CheckboxInput."""
+    if isinstance(value, basestring) and value.lower() in ('false', '0'):
+        return False
+    return bool(value)
+
+
 class VkontakteIframeForm(forms.Form):
     # адрес сервиса API, по которому необходимо осуществлять запросы
     api_url = forms.CharField()
@@ -106,7 +115,7 @@ class VkontakteIframeForm(forms.Form):
         # method=getProfiles&uids={viewer_id}&format=json&v=3.0&fields=uid,first_name,last_name,nickname,domain,sex,bdate,city,country,timezone,photo,photo_medium,photo_big,has_mobile,rate,contacts,education
         api_result = self.cleaned_data['api_result']
         if api_result:
-            return json.loads(api_result)['response'][0]
+            return codec.loads(api_result)['response'][0]
         return {}
 
     def language_code(self):
@@ -126,6 +135,95 @@ class VkontakteIframeForm(forms.Form):
             return None
 
 
+class VkontakteLaunchParameters(object):
+    """
+    Параметры запуска iframe-приложения ВКонтакте, проверяемые без VkontakteIframeForm:
+    проверяются только api_id, viewer_id и auth_key, остальные параметры лишь приводятся
+    к тем же типам, что и в форме.
+
+    Интерфейс тот же, что у VkontakteIframeForm (is_valid, cleaned_data, errors,
+    vk_user_id, profile_api_result), так что форма остаётся совместимым медленным путём.
+    """
+
+    INTEGER_PARAMETERS = ('api_id', 'user_id', 'group_id', 'viewer_id', 'viewer_type', 'poster_id', 'post_id')
+    STRING_PARAMETERS = ('api_url', 'sid', 'secret', 'auth_key', 'access_token', 'api_result',
+                         'api_settings', 'referrer')
+
+    # параметры, обязательные и в VkontakteIframeForm: middleware сохраняет их в сессии,
+    # а access_token использует для вызова методов API
+    REQUIRED_PARAMETERS = ('api_url', 'api_id', 'user_id', 'sid', 'secret', 'group_id', 'viewer_id',
+                           'viewer_type', 'auth_key', 'access_token', 'api_settings')
+
+    def __init__(self, data):
+        self.data = data
+        self.errors = {}
+        self._valid = None
+
+    def is_valid(self):
+        if self._valid is None:
+            self._valid = self._verify()
+        return self._valid
+
+    def _verify(self):
+        data = self.data
+
+        try:
+            api_id = int(data['api_id'])
+            viewer_id = int(data['viewer_id'])
+        except (KeyError, TypeError, ValueError):
+            self.errors['viewer_id'] = u'Не указаны api_id или viewer_id'
+            return False
+
+        app_id = getattr(settings, 'VK_APP_ID', None)
+        if app_id and str(api_id) != str(app_id):
+            logger.warning(u'Invalid application id ({0})'.format(api_id))
+            self.errors['api_id'] = u'api_id - от другого приложения'
+            return False
+
+        key = data.get('auth_key', '').lower()
+        correct_key = md5('%d_%d_%s' % (api_id, viewer_id, settings.VK_APP_SECRET)).hexdigest()
+        if not constant_time_compare(key, correct_key):
+            logger.warning(u'Invalid authorization key ({0})'.format(key))
+            self.errors['auth_key'] = u'Неверный ключ авторизации'
+            return False
+
+        for name in self.REQUIRED_PARAMETERS:
+            if not data.get(name):
+                self.errors[name] = u'Обязательное поле.'
+                return False
+
+        cleaned_data = {}
+
+        for name in self.INTEGER_PARAMETERS:
+            # как и IntegerField: пустое значение - None, нечисловое - ошибка
+            value = data.get(name)
+            if not value:
+                cleaned_data[name] = None
+                continue
+            try:
+                cleaned_data[name] = int(value)
+            except (TypeError, ValueError):
+                self.errors[name] = u'Введите целое число.'
+                return False
+
+        for name in self.STRING_PARAMETERS:
+            cleaned_data[name] = data.get(name, u'')
+
+        cleaned_data['is_app_user'] = to_boolean(data.get('is_app_user'))
+
+        self.cleaned_data = cleaned_data
+        return True
+
+    def vk_user_id(self):
+        return self.cleaned_data['viewer_id']
+
+    def profile_api_result(self):
+        api_result = self.cleaned_data['api_result']
+        if api_result:
+            return codec.loads(api_result)['response'][0]
+        return {}
+
+
 class VkontakteOpenAPIForm(forms.Form):
 
     # id залогиненного в контакте пользователя, аналог viewer_id из предыдущей формы
@@ -0,0 +1,28 @@
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from djangocanvas.deferred import refresh_expiring_oauth_tokens
+
+
+class Command(NoArgsCommand):
+    help = 'Extend Facebook OAuth tokens that are about to expire.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', type='float', default=7,
+                    help='Refresh tokens expiring within this many days.'),
+        make_option('--batch-size', type='int', default=100, dest='batch_size',
+                    help='Write refreshed tokens back in batches of this size.'),
+        make_option('--workers', type='int', default=8,
+                    help='Exchange this many tokens concurrently.'),
+    )
+
+    def handle_noargs(self, **options):
+        refreshed, failed = refresh_expiring_oauth_tokens(
+            within=timedelta(days=options['days']),
+            batch_size=options['batch_size'],
+            workers=options['workers'])
+
+        if int(options['verbosity']) > 0:
+            self.stdout.write('Refreshed %d OAuth tokens, %d failed\n' % (refreshed, failed))
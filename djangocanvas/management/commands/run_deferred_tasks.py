@@ -0,0 +1,31 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from djangocanvas.deferred import DatabaseBackend
+
+
+class Command(NoArgsCommand):
+    help = 'Run work queued by djangocanvas.deferred.DatabaseBackend.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--limit', type='int', default=None,
+                    help='Run at most this many tasks per pass.'),
+        make_option('--interval', type='float', default=None,
+                    help='Keep polling for tasks, sleeping this many seconds between passes.'),
+    )
+
+    def handle_noargs(self, **options):
+        backend = DatabaseBackend()
+
+        while True:
+            count = backend.run(limit=options['limit'])
+
+            if int(options['verbosity']) > 1:
+                self.stdout.write('Ran %d deferred tasks\n' % count)
+
+            if options['interval'] is None:
+                break
+
+            time.sleep(options['interval'])
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import copy
+import time
+
 import djangocanvas.settings
 
 from django.conf import settings
@@ -6,15 +9,16 @@ from django.http import QueryDict, HttpResponse
 from django.core.exceptions import ImproperlyConfigured
 
 from djangocanvas.views import authorize_application
-from djangocanvas.models import Facebook, OAuthToken, SocialUser
+from djangocanvas.models import Facebook, SocialUser, social_user_cache, save_changed_fields
+from djangocanvas.deferred import defer
 
 from djangocanvas.utils import (
-    is_disabled_path, is_enabled_path,
+    configure, disabled_paths, enabled_paths, get_signed_request,
     authorization_denied_view, get_post_authorization_redirect_url
 )
 from djangocanvas.api.facepy import SignedRequest, GraphAPI
 from djangocanvas.api import vkontakte
-from djangocanvas.forms import VkontakteIframeForm
+from djangocanvas.forms import VkontakteIframeForm, VkontakteLaunchParameters, to_boolean
 from logging import getLogger
 
 
@@ -23,18 +27,56 @@ P3P_POLICY = getattr(settings, 'VK_P3P_POLICY', DEFAULT_P3P_POLICY)
 
 logger = getLogger('djangocanvas')
 
+SESSION_KEY = '_social_auth_user_id'
+
+# The session key of the time VK startup vars were last verified and synced with the database.
+VK_SYNCED_AT_SESSION_KEY = '_vk_startup_vars_synced_at'
+
+# The session key of the primary key of the social user VK startup vars were last synced for.
+VK_SYNCED_USER_SESSION_KEY = '_vk_startup_vars_user_id'
+
+
 def social_login(request, user):
-    request.session['_social_auth_user_id'] = user.pk
+    request.session[SESSION_KEY] = user.pk
+    request._cached_social_user = user
 
 
-class SocialAuthenticationMiddleware(object):
-    def process_request(self, request):
-        social_user_id = request.session.get('_social_auth_user_id', None)
+def get_social_user(request):
+    """
+    Return the social user logged in with the request's session, or ``None``.
+
+    Users are looked up in ``social_user_cache`` before querying the database;
+    each request is handed its own copy of the cached instance.
+    """
+    if not hasattr(request, 'session'):
+        return None
+
+    social_user_id = request.session.get(SESSION_KEY, None)
+    if social_user_id is None:
+        return None
+
+    social_user = social_user_cache.get(social_user_id)
+    if social_user is None:
         try:
-            request.social_user = SocialUser.objects.get(id=social_user_id)
+            social_user = SocialUser.objects.get(id=social_user_id)
         except SocialUser.DoesNotExist:
             logger.warning(u'User with id "{0}" does not exist'.format(social_user_id))
-            request.social_user = None
+            return None
+        social_user_cache.set(social_user_id, social_user)
+
+    return copy.copy(social_user)
+
+
+class LazySocialUser(object):
+    def __get__(self, request, obj_type=None):
+        if not hasattr(request, '_cached_social_user'):
+            request._cached_social_user = get_social_user(request)
+        return request._cached_social_user
+
+
+class SocialAuthenticationMiddleware(object):
+    def process_request(self, request):
+        request.__class__.social_user = LazySocialUser()
 
 class SocialMiddleware(object):
     """
@@ -42,6 +84,28 @@ class SocialMiddleware(object):
     set user is new etc
     """
 
+    def __init__(self):
+        if djangocanvas.settings.ENABLED_PATHS and djangocanvas.settings.DISABLED_PATHS:
+            raise ImproperlyConfigured(
+                'You may configure either DJANGOCANVAS_ENABLED_PATHS '
+                'or DJANGOCANVAS_DISABLED_PATHS, but not both.'
+            )
+
+        configure()
+
+    def _is_ignored_path(self, path):
+        """
+        Determine whether the middleware should leave requests for the path alone
+        according to the DISABLED_PATHS or ENABLED_PATHS setting.
+        """
+        if disabled_paths and disabled_paths.matches(path):
+            return True
+
+        if enabled_paths and not enabled_paths.matches(path):
+            return True
+
+        return False
+
     def _set_user_is_new(self, request):
         request.social_user_is_new = True
 
@@ -51,16 +115,7 @@ class FacebookMiddleware(SocialMiddleware):
 
     def process_request(self, request):
         """Process the signed request."""
-        if djangocanvas.settings.ENABLED_PATHS and djangocanvas.settings.DISABLED_PATHS:
-            raise ImproperlyConfigured(
-                'You may configure either FANDJANGO_ENABLED_PATHS '
-                'or FANDJANGO_DISABLED_PATHS, but not both.'
-            )
-
-        if djangocanvas.settings.DISABLED_PATHS and is_disabled_path(request.path):
-            return
-
-        if djangocanvas.settings.ENABLED_PATHS and not is_enabled_path(request.path):
+        if self._is_ignored_path(request.path):
             return
 
         # An error occured during authorization...
@@ -90,7 +145,7 @@ class FacebookMiddleware(SocialMiddleware):
                 request.method = 'GET'
 
             try:
-                request.facebook.signed_request = SignedRequest(
+                request.facebook.signed_request = get_signed_request(
                     signed_request=request.REQUEST.get('signed_request') or request.COOKIES.get('signed_request'),
                     application_secret_key=djangocanvas.settings.FACEBOOK_APPLICATION_SECRET_KEY)
 
@@ -108,53 +163,30 @@ class FacebookMiddleware(SocialMiddleware):
 
                 # Initialize a User object and its corresponding OAuth token
                 social_id = request.facebook.signed_request.user.id
-                try:
-                    social_user = SocialUser.objects.get(social_id=social_id)
-                except SocialUser.DoesNotExist:
-                    logger.info(u'Creating a new user (facebook id = {0})'.format(social_id))
-                    oauth_token = OAuthToken.objects.create(
-                        token=request.facebook.signed_request.user.oauth_token.token,
-                        issued_at=request.facebook.signed_request.user.oauth_token.issued_at,
-                        expires_at=request.facebook.signed_request.user.oauth_token.expires_at)
-
-                    social_user = SocialUser.objects.create(
-                        social_id=request.facebook.signed_request.user.id,
-                        provider='facebook',
-                        oauth_token=oauth_token)
-
-                    graph = GraphAPI(social_user.oauth_token.token)
-                    profile = graph.get('me')
-
-                    social_user.first_name = profile.get('first_name')
-                    social_user.last_name = profile.get('last_name')
+                social_user, created = SocialUser.objects.sync_facebook_user(
+                    social_id=social_id,
+                    oauth_token=request.facebook.signed_request.user.oauth_token,
+                    update='signed_request' in request.REQUEST)
 
-                    social_user.save()
+                if created:
+                    logger.info(u'Creating a new user (facebook id = {0})'.format(social_id))
 
-                    request.social_data = graph
+                    # The user's name is fetched from the Graph API in the background;
+                    # until then the request makes do with what the signed request tells.
+                    request.facebook_profile = {
+                        'id': social_id,
+                        'first_name': None,
+                        'last_name': None,
+                        'locale': request.facebook.signed_request.user.locale,
+                        'country': request.facebook.signed_request.user.country
+                    }
+                    defer('fetch_facebook_profile', social_id)
+
+                    request.social_data = GraphAPI(social_user.oauth_token.token)
                     self._set_user_is_new(request)
 
-                # Update the user's details and OAuth token
-                else:
-                    if 'signed_request' in request.REQUEST:
-                        social_user.authorized = True
-
-                        if request.facebook.signed_request.user.oauth_token:
-                            social_user.oauth_token.token = request.facebook.signed_request.user.oauth_token.token
-                            social_user.oauth_token.issued_at = request.facebook.signed_request.user.oauth_token.issued_at
-                            social_user.oauth_token.expires_at = request.facebook.signed_request.user.oauth_token.expires_at
-                            social_user.oauth_token.save()
-
-                    social_user.save()
-
-                if not social_user.oauth_token.extended:
-                    # Attempt to extend the OAuth token, but ignore exceptions raised by
-                    # bug #102727766518358 in the Facebook Platform.
-                    #
-                    # http://developers.facebook.com/bugs/102727766518358/
-                    try:
-                        social_user.oauth_token.extend()
-                    except:
-                        pass
+                if social_user.oauth_token and not social_user.oauth_token.extended:
+                    defer('extend_oauth_token', social_id)
 
                 social_login(request, social_user)
 
@@ -184,11 +216,28 @@ class FacebookMiddleware(SocialMiddleware):
 
 class VkontakteMiddleware(SocialMiddleware):
     def process_request(self, request):
+        if self._is_ignored_path(request.path):
+            return
+
         if 'viewer_id' not in request.GET:
             self._patch_request_with_vkapi(request)
             return
 
-        vk_form = VkontakteIframeForm(request.GET)
+        if self._is_relaunch(request):
+            # The user may have reinstalled the application since the startup vars were synced.
+            if to_boolean(request.GET.get('is_app_user')):
+                social_user = get_social_user(request)
+                if social_user:
+                    save_changed_fields(social_user, authorized=True)
+                    request._cached_social_user = social_user
+
+            self._patch_request_with_vkapi(request)
+            return
+
+        if djangocanvas.settings.VK_LAUNCH_FORM:
+            vk_form = VkontakteIframeForm(request.GET)
+        else:
+            vk_form = VkontakteLaunchParameters(request.GET)
 
         if not vk_form:
             logger.warning(u'Vkontakte form getting promlem')
@@ -213,20 +262,51 @@ class VkontakteMiddleware(SocialMiddleware):
                 self._set_user_is_new(request)
 
         if social_user:
-            social_user.authorized = True
-            social_user.save()
+            save_changed_fields(social_user, authorized=True)
             social_login(request, social_user)
 
             if hasattr(request, 'session'):
                 startup_vars = vk_form.cleaned_data
                 del startup_vars['api_result']
                 request.session['vk_startup_vars'] = startup_vars
+                request.session[VK_SYNCED_AT_SESSION_KEY] = time.time()
+                request.session[VK_SYNCED_USER_SESSION_KEY] = social_user.pk
                 self._patch_request_with_vkapi(request)
 
         else:
             request.META['VKONTAKTE_LOGIN_ERRORS'] = vk_form.errors
             logger.warning(u'Vkontakte login errors' + ': ' + ', '.join(vk_form.errors))
 
+    def _is_relaunch(self, request):
+        """
+        Determine whether the request relaunches the application with the viewer_id, auth_key
+        and access_token of the startup vars the session holds, which were verified and synced
+        with the database less than VK_RELAUNCH_WINDOW seconds ago for the social user the
+        session is still logged in with. Such requests needn't be verified, nor written to
+        the database or the session, again.
+        """
+        window = djangocanvas.settings.VK_RELAUNCH_WINDOW
+
+        if not window or not hasattr(request, 'session'):
+            return False
+
+        startup_vars = request.session.get('vk_startup_vars')
+        synced_at = request.session.get(VK_SYNCED_AT_SESSION_KEY)
+
+        if not startup_vars or synced_at is None or SESSION_KEY not in request.session:
+            return False
+
+        # The session may have been logged in with another user since.
+        if request.session[SESSION_KEY] != request.session.get(VK_SYNCED_USER_SESSION_KEY):
+            return False
+
+        if time.time() - synced_at > window:
+            return False
+
+        return (request.GET.get('viewer_id') == str(startup_vars['viewer_id'])
+                and request.GET.get('auth_key') == startup_vars['auth_key']
+                and request.GET.get('access_token') == startup_vars['access_token'])
+
     def _patch_request_with_vkapi(self, request):
         """
         Помещает в request.vk_api экземпляр vkontakte.API с настроенной
@@ -1,12 +1,17 @@
 #coding: utf-8
 from datetime import datetime, timedelta
+from threading import Lock
 from urlparse import parse_qs
 
-from django.db import models
+from django.core.cache import cache
+from django.db import models, router, transaction, IntegrityError
+from django.db.models.signals import pre_save, post_save, post_delete
 
 from djangocanvas.settings import FACEBOOK_APPLICATION_ID, FACEBOOK_APPLICATION_SECRET_KEY
+from djangocanvas.settings import SOCIAL_USER_CACHE_SIZE, SOCIAL_USER_CACHE_TIMEOUT, SOCIAL_USER_CACHE_SHARED
 
 from djangocanvas.api.facepy import GraphAPI
+from djangocanvas.cache import LRUCache, TieredCache
 
 
 class Facebook:
@@ -22,7 +27,129 @@ class Facebook:
     """A ``SignedRequest`` instance."""
 
 
-class OAuthToken(models.Model):
+_save_counters = {}
+_save_counters_lock = Lock()
+
+
+def save_stats():
+    """
+    Return a dictionary describing, per model tracking changes to its fields, how many saves
+    inserted rows ('inserts'), wrote only changed columns ('updates') and were skipped because
+    nothing had changed ('skipped'), as well as how many column writes were avoided ('columns_skipped').
+    """
+    with _save_counters_lock:
+        return dict((model, dict(counters)) for model, counters in _save_counters.items())
+
+
+def _count_save(model, outcome, columns_skipped=0):
+    with _save_counters_lock:
+        counters = _save_counters.setdefault(model._meta.object_name, {
+            'inserts': 0, 'updates': 0, 'skipped': 0, 'columns_skipped': 0
+        })
+        counters[outcome] += 1
+        counters['columns_skipped'] += columns_skipped
+
+
+class DirtyFieldsMixin(object):
+    """
+    Track changes to the fields of model instances since they were loaded or last saved,
+    so that saving an instance writes only the columns that changed, or nothing at all
+    if none did. Saves that write nothing send no signals either.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DirtyFieldsMixin, self).__init__(*args, **kwargs)
+        self._reset_dirty_fields()
+
+    def get_dirty_fields(self):
+        """Return a dictionary of the names and new values of fields that changed since the instance was saved."""
+        original = self._original_values
+        values = self._field_values()
+
+        return dict(
+            (name, value) for name, value in values.items() if name not in original or original[name] != value
+        )
+
+    def save(self, force_insert=False, force_update=False, using=None):
+        using = using or self._state.db or router.db_for_write(self.__class__, instance=self)
+
+        if force_insert or force_update or self._state.adding or self.pk is None:
+            outcome = 'updates' if force_update else 'inserts'
+            super(DirtyFieldsMixin, self).save(force_insert=force_insert, force_update=force_update, using=using)
+            _count_save(self.__class__, outcome)
+            self._reset_dirty_fields()
+            return
+
+        dirty = self.get_dirty_fields()
+        fields = len(self._meta.fields)
+
+        if not dirty:
+            _count_save(self.__class__, 'skipped', fields - 1)
+            return
+
+        attnames = dict((field.attname, field.name) for field in self._meta.fields)
+
+        pre_save.send(sender=self.__class__, instance=self, raw=False, using=using)
+
+        # Receivers of pre_save may have changed fields, too.
+        dirty = self.get_dirty_fields()
+
+        if not dirty:
+            _count_save(self.__class__, 'skipped', fields - 1)
+            return
+
+        updated = self.__class__._default_manager.using(using).filter(pk=self.pk).update(
+            **dict((attnames[name], value) for name, value in dirty.items())
+        )
+
+        if not updated:
+            # The row is gone; let Django insert it anew.
+            super(DirtyFieldsMixin, self).save(using=using)
+            _count_save(self.__class__, 'inserts')
+            self._reset_dirty_fields()
+            return
+
+        self._state.db = using
+
+        post_save.send(sender=self.__class__, instance=self, created=False, raw=False, using=using)
+
+        _count_save(self.__class__, 'updates', fields - 1 - len(dirty))
+        self._reset_dirty_fields()
+
+    def _field_values(self):
+        # Deferred fields aren't loaded, and mustn't be by merely tracking them.
+        return dict(
+            (field.attname, self.__dict__[field.attname])
+            for field in self._meta.fields if field.attname in self.__dict__
+        )
+
+    def _reset_dirty_fields(self):
+        self._original_values = self._field_values()
+
+
+class OAuthTokenManager(models.Manager):
+    def expiring(self, within):
+        """
+        Query OAuth tokens that are still valid but expire within the given period.
+
+        :param within: A ``timedelta`` instance describing the period.
+        """
+        now = datetime.now()
+        return self.filter(expires_at__gt=now, expires_at__lte=now + within)
+
+    def bulk_update_tokens(self, tokens):
+        """
+        Write new tokens and expiration times for several OAuth tokens in a single transaction.
+
+        :param tokens: A list of tuples of a primary key, a string describing the token and
+                       a ``datetime`` object describing when it expires.
+        """
+        with transaction.commit_on_success(using=self.db):
+            for pk, token, expires_at in tokens:
+                self.using(self.db).filter(pk=pk).update(token=token, expires_at=expires_at)
+
+
+class OAuthToken(DirtyFieldsMixin, models.Model):
     """
     Instances of the OAuthToken class are credentials used to query
     the Facebook API on behalf of a user.
@@ -34,9 +161,11 @@ class OAuthToken(models.Model):
     issued_at = models.DateTimeField(verbose_name=u'Issued at')
     """A ``datetime`` object describing when the token was issued."""
 
-    expires_at = models.DateTimeField(verbose_name=u'Expires at', null=True, blank=True)
+    expires_at = models.DateTimeField(verbose_name=u'Expires at', null=True, blank=True, db_index=True)
     """A ``datetime`` object describing when the token expires (or ``None`` if it doesn't)"""
 
+    objects = OAuthTokenManager()
+
     @property
     def expired(self):
         """Determine whether the OAuth token has expired."""
@@ -73,7 +202,88 @@ class OAuthToken(models.Model):
         verbose_name_plural = 'OAuth tokens'
 
 
-class SocialUser(models.Model):
+def save_changed_fields(instance, **values):
+    """
+    Assign the given values to a saved model instance, writing only the columns
+    whose values differ from the instance's current ones.
+
+    Returns a boolean describing whether anything was written.
+    """
+    for name, value in values.items():
+        setattr(instance, name, value)
+
+    changed = bool(instance.get_dirty_fields())
+
+    instance.save()
+
+    return changed
+
+
+class SocialUserManager(models.Manager):
+    def get_with_oauth_token(self, **kwargs):
+        """Fetch a social user along with its OAuth token in a single query."""
+        return self.select_related('oauth_token').get(**kwargs)
+
+    def sync_facebook_user(self, social_id, oauth_token, update=True):
+        """
+        Fetch a Facebook user and bring it up to date with a signed request, creating
+        the user and its OAuth token if it doesn't exist yet.
+
+        Returns a tuple of the ``SocialUser`` instance and a boolean describing whether it was created.
+
+        :param social_id: An integer describing the user's Facebook ID.
+        :param oauth_token: A ``SignedRequest.User.OAuthToken`` instance.
+        :param update: A boolean describing whether to mark an existing user as authorized
+                       and update its OAuth token, unless the signed request carries the
+                       stored token.
+        """
+        try:
+            social_user = self.get_with_oauth_token(social_id=social_id)
+        except self.model.DoesNotExist:
+            try:
+                return self._create_facebook_user(social_id, oauth_token), True
+            except IntegrityError:
+                # The user has been created by a concurrent request.
+                social_user = self.get_with_oauth_token(social_id=social_id)
+
+        if update:
+            save_changed_fields(social_user, authorized=True)
+
+            if oauth_token:
+                if social_user.oauth_token:
+                    # Keep the token as it is while the signed request carries the same one, lest
+                    # its extended expiration time be overwritten. A different token replaces it
+                    # (e.g. once the user has reauthorized the application, revoking the stored
+                    # token) and is extended anew by the extend_oauth_token task.
+                    if oauth_token.token != social_user.oauth_token.token or social_user.oauth_token.expired:
+                        save_changed_fields(
+                            social_user.oauth_token,
+                            token=oauth_token.token,
+                            issued_at=oauth_token.issued_at,
+                            expires_at=oauth_token.expires_at)
+                else:
+                    with transaction.commit_on_success(using=self.db):
+                        social_user.oauth_token = OAuthToken.objects.using(self.db).create(
+                            token=oauth_token.token,
+                            issued_at=oauth_token.issued_at,
+                            expires_at=oauth_token.expires_at)
+                        save_changed_fields(social_user, oauth_token=social_user.oauth_token)
+
+        return social_user, False
+
+    def _create_facebook_user(self, social_id, oauth_token):
+        with transaction.commit_on_success(using=self.db):
+            return self.using(self.db).create(
+                social_id=social_id,
+                provider='facebook',
+                oauth_token=OAuthToken.objects.using(self.db).create(
+                    token=oauth_token.token,
+                    issued_at=oauth_token.issued_at,
+                    expires_at=oauth_token.expires_at
+                ) if oauth_token else None)
+
+
+class SocialUser(DirtyFieldsMixin, models.Model):
     social_id = models.BigIntegerField(verbose_name=u'Идентификатор в социальной сети', unique=True)
     provider = models.CharField(verbose_name=u'Социальная сеть', max_length=50)
     first_name = models.CharField(verbose_name=u'Имя', max_length=255, blank=True, null=True)
@@ -82,9 +292,59 @@ class SocialUser(models.Model):
     oauth_token = models.OneToOneField(u'OAuthtoken', blank=True, null=True,
                                        related_name='social_user')
 
+    objects = SocialUserManager()
+
     def __unicode__(self):
         return '%s, %s' % (self.social_id, self.provider)
 
     class Meta:
         verbose_name = u'Пользователь социальной сети'
         verbose_name_plural = u'Пользователи социальной сети'
+
+
+class DeferredTask(models.Model):
+    """
+    Instances of the DeferredTask class describe work queued by
+    ``djangocanvas.deferred.DatabaseBackend``.
+    """
+
+    name = models.CharField(verbose_name=u'Name', max_length=50)
+    """A string describing the task to run."""
+
+    social_id = models.BigIntegerField(verbose_name=u'Social ID')
+    """An integer describing the ID of the user the task is run for."""
+
+    created_at = models.DateTimeField(verbose_name=u'Created at', auto_now_add=True)
+    """A ``datetime`` object describing when the task was queued."""
+
+    claimed = models.BooleanField(verbose_name=u'Claimed', default=False)
+    """A boolean describing whether a worker has started running the task."""
+
+    claimed_at = models.DateTimeField(verbose_name=u'Claimed at', null=True, blank=True)
+    """A ``datetime`` object describing when a worker started running the task (or ``None`` if none has)."""
+
+    class Meta:
+        unique_together = ('name', 'social_id')
+        verbose_name = 'Deferred task'
+        verbose_name_plural = 'Deferred tasks'
+
+
+social_user_cache = TieredCache(
+    LRUCache(max_size=SOCIAL_USER_CACHE_SIZE, timeout=SOCIAL_USER_CACHE_TIMEOUT),
+    shared=cache if SOCIAL_USER_CACHE_SHARED else None,
+    prefix='djangocanvas.SocialUser.')
+"""Social users recently looked up by primary key."""
+
+
+def invalidate_cached_social_user(sender, instance, **kwargs):
+    """Drop a social user from ``social_user_cache`` once it is saved or deleted."""
+    social_user_cache.delete(instance.pk)
+
+post_save.connect(invalidate_cached_social_user, sender=SocialUser)
+post_delete.connect(invalidate_cached_social_user, sender=SocialUser)
+
+
+# Configure the API clients once the application is loaded rather than on whichever import comes first.
+from djangocanvas.utils import configure
+
+configure()
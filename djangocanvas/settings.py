@@ -37,3 +37,80 @@ FANDJANGO_CACHE_SIGNED_REQUEST = getattr(settings, 'FACEBOOK_SIGNED_REQUEST_COOK
 
 VK_APP_ID = getattr(settings, 'VK_APP_ID', None)
 VK_APP_SECRET = getattr(settings, 'VK_APP_SECRET', None)
+
+# An integer describing how many verified signed requests to hold in memory.
+SIGNED_REQUEST_CACHE_SIZE = getattr(settings, 'DJANGOCANVAS_SIGNED_REQUEST_CACHE_SIZE', 1000)
+
+# An integer describing how many seconds a verified signed request is held in memory.
+SIGNED_REQUEST_CACHE_TIMEOUT = getattr(settings, 'DJANGOCANVAS_SIGNED_REQUEST_CACHE_TIMEOUT', 300)
+
+# An integer describing how many social users to hold in memory.
+SOCIAL_USER_CACHE_SIZE = getattr(settings, 'DJANGOCANVAS_SOCIAL_USER_CACHE_SIZE', 1000)
+
+# An integer describing how many seconds a social user is held in memory.
+SOCIAL_USER_CACHE_TIMEOUT = getattr(settings, 'DJANGOCANVAS_SOCIAL_USER_CACHE_TIMEOUT', 60)
+
+# A boolean describing whether to back the in-memory social user cache with Django's cache.
+SOCIAL_USER_CACHE_SHARED = getattr(settings, 'DJANGOCANVAS_SOCIAL_USER_CACHE_SHARED', False)
+
+# A string describing the class of the backend running work deferred from the request path.
+DEFERRED_BACKEND = getattr(settings, 'DJANGOCANVAS_DEFERRED_BACKEND', 'djangocanvas.deferred.ThreadPoolBackend')
+
+# An integer describing how many threads ``djangocanvas.deferred.ThreadPoolBackend`` runs work on.
+DEFERRED_WORKERS = getattr(settings, 'DJANGOCANVAS_DEFERRED_WORKERS', 4)
+
+# An integer describing after how many seconds a task queued by ``djangocanvas.deferred.DatabaseBackend``
+# that a worker started running but didn't finish (e.g. because it died) is run again.
+DEFERRED_CLAIM_TIMEOUT = getattr(settings, 'DJANGOCANVAS_DEFERRED_CLAIM_TIMEOUT', 600)
+
+# An integer describing how many seconds Facebook application access tokens are cached.
+APPLICATION_ACCESS_TOKEN_CACHE_TIMEOUT = getattr(settings, 'DJANGOCANVAS_APPLICATION_ACCESS_TOKEN_CACHE_TIMEOUT', 3600)
+
+# A boolean describing whether to share Facebook application access tokens between processes via Django's cache.
+APPLICATION_ACCESS_TOKEN_CACHE_SHARED = getattr(settings, 'DJANGOCANVAS_APPLICATION_ACCESS_TOKEN_CACHE_SHARED', False)
+
+# An integer describing how many connections to the Graph API each process keeps alive.
+GRAPH_API_POOL_SIZE = getattr(settings, 'DJANGOCANVAS_GRAPH_API_POOL_SIZE', 10)
+
+# A number describing how many seconds requests to the Graph API may take (or ``None`` if they may take forever).
+GRAPH_API_TIMEOUT = getattr(settings, 'DJANGOCANVAS_GRAPH_API_TIMEOUT', 10)
+
+# A list of tuples of a regular expression matching Graph API paths and an integer describing how many
+# seconds responses to GET requests for matching paths are cached. Responses aren't cached if it's empty.
+GRAPH_API_CACHE_TIMEOUTS = getattr(settings, 'DJANGOCANVAS_GRAPH_API_CACHE_TIMEOUTS', [])
+
+# An integer describing how many Graph API responses to hold in memory.
+GRAPH_API_CACHE_SIZE = getattr(settings, 'DJANGOCANVAS_GRAPH_API_CACHE_SIZE', 1000)
+
+# A boolean describing whether to back the in-memory Graph API response cache with Django's cache.
+GRAPH_API_CACHE_SHARED = getattr(settings, 'DJANGOCANVAS_GRAPH_API_CACHE_SHARED', False)
+
+# An integer describing how many VK API calls may be made per second with an access token
+# (or ``None`` for no limit), such as 3, which VK allows. Calls exceeding the limit wait rather than fail.
+VK_RATE_LIMIT = getattr(settings, 'DJANGOCANVAS_VK_RATE_LIMIT', None)
+
+# An integer describing how many VK API calls the application may make per second (or ``None`` for no limit).
+VK_APP_RATE_LIMIT = getattr(settings, 'DJANGOCANVAS_VK_APP_RATE_LIMIT', None)
+
+# A boolean describing whether to share VK API rate limits between processes and hosts via Django's cache.
+VK_RATE_LIMIT_SHARED = getattr(settings, 'DJANGOCANVAS_VK_RATE_LIMIT_SHARED', False)
+
+# A string describing the path of a file to share VK API rate limits between the processes of a host in,
+# if they aren't shared via Django's cache.
+VK_RATE_LIMIT_FILE = getattr(settings, 'DJANGOCANVAS_VK_RATE_LIMIT_FILE', None)
+
+# A boolean describing whether to validate VK launch parameters with the complete ``VkontakteIframeForm``
+# rather than only checking ``api_id``, ``viewer_id`` and ``auth_key``.
+VK_LAUNCH_FORM = getattr(settings, 'DJANGOCANVAS_VK_LAUNCH_FORM', False)
+
+# An integer describing for how many seconds relaunches of a VK application with the startup vars a session holds
+# reuse them instead of verifying them and syncing the user with the database again (or 0 to always sync).
+VK_RELAUNCH_WINDOW = getattr(settings, 'DJANGOCANVAS_VK_RELAUNCH_WINDOW', 300)
+
+# A boolean describing whether to keep measurements of Graph API and VK API requests in memory,
+# rendered in Prometheus' text format by the ``api_metrics`` view.
+API_METRICS = getattr(settings, 'DJANGOCANVAS_API_METRICS', False)
+
+# A list of strings describing classes of sinks (see ``djangocanvas.api.metrics.Sink``)
+# to report measurements of Graph API and VK API requests to as well.
+API_METRICS_SINKS = getattr(settings, 'DJANGOCANVAS_API_METRICS_SINKS', [])
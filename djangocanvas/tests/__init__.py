@@ -1,2 +1,4 @@
 from test_vk import *
 from test_fb import *
+from test_auth import *
+from test_utils import *
@@ -1,9 +1,15 @@
 """Utility methods for tests."""
+import BaseHTTPServer
+import logging
 import re
+import socket
+import SocketServer
+import threading
+import time
 
 from django.utils.functional import wraps
 
-from djangocanvas.tests.test_fb import GraphAPI, SignedRequest
+from djangocanvas.api.facepy import GraphAPI, SignedRequest
 
 
 def assert_contains(expected, actual):
@@ -39,7 +45,7 @@ class set_tests_stubs(object):
 
     def disable(self):
         SignedRequest.User.OAuthToken.has_expired = self.old_has_expired
-        GraphAPI.get = self.old_graph_get_method = GraphAPI.get
+        GraphAPI.get = self.old_graph_get_method
 
 
 @property
@@ -53,3 +59,95 @@ def _stub_get_social_user_profile_dictionary(*args, **kwargs):
 
 def _stub_get_social_user_profile_url_parameters(*args, **kwargs):
         return 'access_token=15&expires=900'
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    An HTTP server on a free local port standing in for the Graph API or the VK API,
+    serving requests on threads of its own between ``start`` and ``stop``.
+    """
+    daemon_threads = True
+
+    def __init__(self, handler_class):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), handler_class)
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+
+        # The paths and bodies of the requests received.
+        self.paths = []
+        self.bodies = []
+
+        # How many requests are being handled, and the most that were at once.
+        self.in_flight = 0
+        self.peak = 0
+
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Base class for handlers of ``StubServer``, keeping connections alive."""
+    protocol_version = 'HTTP/1.1'
+
+    def handle(self):
+        # Clients of tests of timeouts hang up before the response is written.
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error:
+            self.close_connection = 1
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def read_body(self):
+        """Read the request's body, recording it and the path with the server."""
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        with self.server.lock:
+            self.server.paths.append(self.path)
+            self.server.bodies.append(body)
+
+        return body
+
+    def work(self, seconds):
+        """Take the given number of seconds to handle the request, counting it as in flight meanwhile."""
+        server = self.server
+
+        with server.lock:
+            server.in_flight += 1
+            server.peak = max(server.peak, server.in_flight)
+
+        time.sleep(seconds)
+
+        with server.lock:
+            server.in_flight -= 1
+
+    def respond(self, body, headers=None, status=200):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class NullHandler(logging.Handler):
+    """A logging handler discarding records; ``logging.NullHandler`` is missing from Python 2.6."""
+
+    def emit(self, record):
+        pass
+
+
+# Warnings logged by code under test would otherwise be reported as having no handler.
+logging.getLogger('djangocanvas').addHandler(NullHandler())
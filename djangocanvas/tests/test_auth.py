@@ -0,0 +1,146 @@
+from django.db.models.signals import pre_save, post_save
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from djangocanvas.middleware import SocialAuthenticationMiddleware, SESSION_KEY
+from djangocanvas.models import SocialUser, social_user_cache, save_stats
+
+
+request_factory = RequestFactory()
+
+
+class SocialAuthenticationTest(TestCase):
+    def setUp(self):
+        social_user_cache.clear()
+        self.social_user = SocialUser.objects.create(social_id=1, provider='vkontakte')
+
+    def tearDown(self):
+        SocialUser.objects.all().delete()
+
+    def _process_request(self, social_user_id=None):
+        request = request_factory.get('/')
+        request.session = {}
+
+        if social_user_id is not None:
+            request.session[SESSION_KEY] = social_user_id
+
+        SocialAuthenticationMiddleware().process_request(request)
+        return request
+
+    def test_anonymous_request(self):
+        """
+        Verify that anonymous requests don't query the database.
+        """
+        with self.assertNumQueries(0):
+            request = self._process_request()
+            assert request.social_user is None
+
+    def test_social_user_is_lazy(self):
+        """
+        Verify that the social user is only fetched once it is accessed.
+        """
+        with self.assertNumQueries(0):
+            request = self._process_request(self.social_user.pk)
+
+        with self.assertNumQueries(1):
+            assert request.social_user == self.social_user
+            assert request.social_user == self.social_user
+
+    def test_social_user_is_cached(self):
+        """
+        Verify that social users are cached across requests until they are saved.
+        """
+        self._process_request(self.social_user.pk).social_user
+
+        with self.assertNumQueries(0):
+            request = self._process_request(self.social_user.pk)
+            assert request.social_user.authorized is True
+
+        self.social_user.authorized = False
+        self.social_user.save()
+
+        with self.assertNumQueries(1):
+            request = self._process_request(self.social_user.pk)
+            assert request.social_user.authorized is False
+
+    def test_missing_social_user(self):
+        """
+        Verify that sessions referring to deleted users are treated as anonymous.
+        """
+        request = self._process_request(self.social_user.pk + 1)
+        assert request.social_user is None
+
+
+class DirtyFieldsTest(TestCase):
+    def setUp(self):
+        SocialUser.objects.create(social_id=1, provider='vkontakte', first_name='Pavel')
+        self.social_user = SocialUser.objects.get(social_id=1)
+
+    def test_unchanged_save_is_skipped(self):
+        """
+        Verify that saving an unchanged instance neither queries the database nor sends signals.
+        """
+        skipped = save_stats()['SocialUser']['skipped']
+        signals = []
+
+        def receiver(sender, instance, **kwargs):
+            signals.append(instance)
+
+        post_save.connect(receiver, sender=SocialUser)
+
+        try:
+            with self.assertNumQueries(0):
+                self.social_user.authorized = True
+                self.social_user.save()
+        finally:
+            post_save.disconnect(receiver, sender=SocialUser)
+
+        assert not signals
+        assert save_stats()['SocialUser']['skipped'] == skipped + 1
+
+    def test_only_changed_columns_are_written(self):
+        """
+        Verify that saving a changed instance writes only the changed columns.
+        """
+        self.social_user.last_name = 'Durov'
+
+        with self.assertNumQueries(1):
+            self.social_user.save()
+
+        assert not self.social_user.get_dirty_fields()
+        assert SocialUser.objects.get(social_id=1).last_name == 'Durov'
+
+        with self.assertNumQueries(0):
+            self.social_user.save()
+
+    def test_changes_are_written_once(self):
+        """
+        Verify that changes made to an instance concurrently with another one aren't overwritten.
+        """
+        other = SocialUser.objects.get(social_id=1)
+        other.first_name = 'Nikolai'
+        other.save()
+
+        self.social_user.last_name = 'Durov'
+        self.social_user.save()
+
+        social_user = SocialUser.objects.get(social_id=1)
+        assert (social_user.first_name, social_user.last_name) == ('Nikolai', 'Durov')
+
+    def test_changes_made_by_pre_save_are_written(self):
+        """
+        Verify that fields changed by receivers of pre_save are written, too.
+        """
+        def receiver(sender, instance, **kwargs):
+            instance.last_name = 'Durov'
+
+        pre_save.connect(receiver, sender=SocialUser)
+
+        try:
+            self.social_user.first_name = 'Nikolai'
+            self.social_user.save()
+        finally:
+            pre_save.disconnect(receiver, sender=SocialUser)
+
+        social_user = SocialUser.objects.get(social_id=1)
+        assert (social_user.first_name, social_user.last_name) == ('Nikolai', 'Durov')
@@ -1,15 +1,27 @@
 import djangocanvas.settings
+import json
+import mock
+import threading
+import time
 
 from datetime import datetime, timedelta
+from urlparse import parse_qs
 
 from django.test import TestCase
 from django.test.client import RequestFactory
 from django.core.urlresolvers import reverse
 
 from djangocanvas.middleware import FacebookMiddleware
-from djangocanvas.models import SocialUser
-from djangocanvas.api.facepy import GraphAPI, SignedRequest
-from djangocanvas.tests.helpers import set_tests_stubs
+from djangocanvas.models import OAuthToken, SocialUser, DeferredTask
+from djangocanvas.deferred import DatabaseBackend, ThreadPoolBackend, refresh_expiring_oauth_tokens
+from djangocanvas.api import metrics
+from djangocanvas.api.facepy import AsyncGraphAPI, GraphAPI, SignedRequest, RetryPolicy, ResponseCache
+from djangocanvas.api.facepy.async_graph_api import RequestPool
+from djangocanvas.api.facepy.graph_api import SessionPool
+from djangocanvas.api.facepy.utils import ApplicationAccessTokenCache, with_application_access_token
+from djangocanvas.tests.helpers import set_tests_stubs, StubServer, StubHandler
+from djangocanvas.cache import LRUCache
+from djangocanvas.utils import get_signed_request, signed_request_cache
 
 
 TEST_APPLICATION_ID = '508667665812571'
@@ -24,7 +36,13 @@ class FacebookBackendTest(TestCase):
         djangocanvas.settings.FACEBOOK_APPLICATION_SECRET_KEY = TEST_APPLICATION_SECRET
         djangocanvas.settings.FACEBOOK_APPLICATION_ID = TEST_APPLICATION_ID
 
+        # Run deferred tasks right away, so that users are complete once the request has been processed.
+        self.backend_patcher = mock.patch.object(
+            djangocanvas.settings, 'DEFERRED_BACKEND', 'djangocanvas.deferred.ImmediateBackend')
+        self.backend_patcher.start()
+
     def tearDown(self):
+        self.backend_patcher.stop()
         SocialUser.objects.all().delete()
 
     def test_method_override(self):
@@ -139,3 +157,722 @@ class FacebookBackendTest(TestCase):
         # Facebook doesn't extend access tokens for test users, so asserting
         # the expiration time will have to suffice.
         assert user.oauth_token.expires_at
+
+
+class RecordingBackend(object):
+    deferred = []
+
+    def defer(self, name, social_id):
+        self.deferred.append((name, social_id))
+        return True
+
+
+class FacebookLaunchQueriesTest(TestCase):
+    def setUp(self):
+        djangocanvas.settings.FACEBOOK_APPLICATION_SECRET_KEY = TEST_APPLICATION_SECRET
+        djangocanvas.settings.FACEBOOK_APPLICATION_ID = TEST_APPLICATION_ID
+        self.backend_patcher = mock.patch.object(
+            djangocanvas.settings, 'DEFERRED_BACKEND', 'djangocanvas.tests.test_fb.RecordingBackend')
+        self.backend_patcher.start()
+        RecordingBackend.deferred = []
+
+    def tearDown(self):
+        self.backend_patcher.stop()
+        SocialUser.objects.all().delete()
+
+    def _launch(self, signed_request=TEST_SIGNED_REQUEST):
+        request = request_factory.post(
+            path=reverse('home'),
+            data={
+                'signed_request': signed_request
+            }
+        )
+        request.session = {}
+
+        FacebookMiddleware().process_request(request)
+        return request
+
+    @set_tests_stubs()
+    def test_first_launch(self):
+        """
+        Verify that a new user and its OAuth token are created in a single pass,
+        leaving calls to the Graph API to deferred tasks.
+        """
+        with self.assertNumQueries(3):
+            request = self._launch()
+
+        social_id = request.facebook.signed_request.user.id
+
+        assert request.social_user_is_new
+        assert request.facebook_profile['first_name'] is None
+        assert RecordingBackend.deferred == [
+            ('fetch_facebook_profile', social_id),
+            ('extend_oauth_token', social_id)
+        ]
+
+    @set_tests_stubs()
+    def test_repeat_launch(self):
+        """
+        Verify that relaunching the application with the same signed request
+        costs a single query.
+        """
+        self._launch()
+
+        with self.assertNumQueries(1):
+            self._launch()
+
+    def _extend_oauth_token(self, social_id, token):
+        social_user = SocialUser.objects.get_with_oauth_token(social_id=social_id)
+        OAuthToken.objects.filter(pk=social_user.oauth_token.pk).update(
+            token=token,
+            issued_at=datetime.now(),
+            expires_at=datetime.now() + timedelta(days=60))
+        RecordingBackend.deferred = []
+
+    @set_tests_stubs()
+    def test_repeat_launch_keeps_extended_oauth_token(self):
+        """
+        Verify that relaunching the application with the extended OAuth token
+        keeps its expiration time.
+        """
+        request = self._launch()
+        signed_request = request.facebook.signed_request
+
+        self._extend_oauth_token(signed_request.user.id, signed_request.user.oauth_token.token)
+        self._launch()
+
+        social_user = SocialUser.objects.get_with_oauth_token(social_id=signed_request.user.id)
+        assert social_user.oauth_token.extended
+        assert RecordingBackend.deferred == []
+
+    @set_tests_stubs()
+    def test_repeat_launch_replaces_revoked_oauth_token(self):
+        """
+        Verify that an extended OAuth token is replaced by a different one in the signed request,
+        as it is revoked upon reauthorizing the application, and that the new one is extended.
+        """
+        request = self._launch()
+        signed_request = request.facebook.signed_request
+
+        self._extend_oauth_token(signed_request.user.id, 'revoked token')
+        self._launch()
+
+        social_user = SocialUser.objects.get_with_oauth_token(social_id=signed_request.user.id)
+        assert social_user.oauth_token.token == signed_request.user.oauth_token.token
+        assert not social_user.oauth_token.extended
+        assert RecordingBackend.deferred == [('extend_oauth_token', signed_request.user.id)]
+
+    @set_tests_stubs()
+    def test_launch_with_new_oauth_token(self):
+        """
+        Verify that only the OAuth token is written when it changes.
+        """
+        self._launch()
+
+        signed_request = SignedRequest(TEST_SIGNED_REQUEST, TEST_APPLICATION_SECRET)
+        signed_request.user.oauth_token.token = 'new token'
+
+        with self.assertNumQueries(2):
+            self._launch(signed_request.generate())
+
+        social_user = SocialUser.objects.get_with_oauth_token(social_id=signed_request.user.id)
+        assert social_user.oauth_token.token == 'new token'
+
+    def test_concurrent_registration(self):
+        """
+        Verify that a user created by a concurrent request is fetched rather than duplicated.
+        """
+        signed_request = SignedRequest(TEST_SIGNED_REQUEST, TEST_APPLICATION_SECRET)
+        SocialUser.objects.sync_facebook_user(signed_request.user.id, signed_request.user.oauth_token)
+
+        get_with_oauth_token = SocialUser.objects.get_with_oauth_token
+
+        with mock.patch.object(SocialUser.objects, 'get_with_oauth_token') as patched:
+            patched.side_effect = [SocialUser.DoesNotExist, get_with_oauth_token(social_id=signed_request.user.id)]
+
+            social_user, created = SocialUser.objects.sync_facebook_user(
+                signed_request.user.id, signed_request.user.oauth_token)
+
+        assert created is False
+        assert SocialUser.objects.filter(social_id=signed_request.user.id).count() == 1
+
+
+class DeferredTaskTest(TestCase):
+    def setUp(self):
+        djangocanvas.settings.FACEBOOK_APPLICATION_SECRET_KEY = TEST_APPLICATION_SECRET
+        djangocanvas.settings.FACEBOOK_APPLICATION_ID = TEST_APPLICATION_ID
+
+        signed_request = SignedRequest(TEST_SIGNED_REQUEST, TEST_APPLICATION_SECRET)
+        self.social_user, created = SocialUser.objects.sync_facebook_user(
+            signed_request.user.id, signed_request.user.oauth_token)
+
+    def tearDown(self):
+        SocialUser.objects.all().delete()
+        DeferredTask.objects.all().delete()
+
+    @set_tests_stubs()
+    def test_database_backend(self):
+        """
+        Verify that tasks queued in the database are deduplicated and run.
+        """
+        backend = DatabaseBackend()
+
+        assert backend.defer('fetch_facebook_profile', self.social_user.social_id) is True
+        assert backend.defer('fetch_facebook_profile', self.social_user.social_id) is False
+
+        assert backend.run() == 1
+        assert DeferredTask.objects.count() == 0
+        assert SocialUser.objects.get(pk=self.social_user.pk).first_name == 'Ivan'
+
+    @set_tests_stubs()
+    def test_interrupted_task_is_released(self):
+        """
+        Verify that a task whose worker is interrupted while running it can be run again.
+        """
+        backend = DatabaseBackend()
+        backend.defer('fetch_facebook_profile', self.social_user.social_id)
+
+        with mock.patch('djangocanvas.deferred.run_task', side_effect=KeyboardInterrupt):
+            self.assertRaises(KeyboardInterrupt, backend.run)
+
+        assert DeferredTask.objects.get().claimed is False
+        assert backend.run() == 1
+
+    @set_tests_stubs()
+    def test_expired_claims_are_reclaimed(self):
+        """
+        Verify that a task claimed by a worker that died is run again once its claim expires.
+        """
+        backend = DatabaseBackend()
+        backend.defer('fetch_facebook_profile', self.social_user.social_id)
+        DeferredTask.objects.update(claimed=True, claimed_at=datetime.now() - timedelta(seconds=60))
+
+        assert backend.run(claim_timeout=120) == 0
+        assert backend.run(claim_timeout=30) == 1
+        assert DeferredTask.objects.count() == 0
+        assert backend.defer('fetch_facebook_profile', self.social_user.social_id) is True
+
+    def test_thread_pool_backend(self):
+        """
+        Verify that a task pending for a user isn't deferred again.
+        """
+        backend = ThreadPoolBackend(workers=1)
+        started, finish = threading.Event(), threading.Event()
+
+        def run_task(name, social_id):
+            started.set()
+            finish.wait()
+
+        with mock.patch('djangocanvas.deferred.run_task', run_task):
+            assert backend.defer('fetch_facebook_profile', self.social_user.social_id) is True
+            started.wait()
+            assert backend.defer('fetch_facebook_profile', self.social_user.social_id) is False
+            finish.set()
+
+
+class OAuthTokenRefreshTest(TestCase):
+    def tearDown(self):
+        OAuthToken.objects.all().delete()
+
+    def _create_token(self, token, expires_in):
+        return OAuthToken.objects.create(
+            token=token,
+            issued_at=datetime.now(),
+            expires_at=datetime.now() + expires_in)
+
+    @mock.patch('djangocanvas.deferred.get_extended_access_token')
+    def test_refresh_expiring_tokens(self, get_extended_access_token):
+        """
+        Verify that only tokens expiring within the given period are exchanged.
+        """
+        expires_at = datetime.now() + timedelta(days=60)
+        get_extended_access_token.side_effect = lambda token, *args: (token + ' extended', expires_at)
+
+        expiring = [self._create_token('expiring %d' % i, timedelta(days=1)) for i in range(3)]
+        valid = self._create_token('valid', timedelta(days=30))
+        expired = self._create_token('expired', -timedelta(days=1))
+
+        assert refresh_expiring_oauth_tokens(timedelta(days=7), batch_size=2, workers=2) == (3, 0)
+
+        for token in expiring:
+            assert OAuthToken.objects.get(pk=token.pk).token == token.token + ' extended'
+
+        assert OAuthToken.objects.get(pk=valid.pk).token == 'valid'
+        assert OAuthToken.objects.get(pk=expired.pk).token == 'expired'
+
+
+class ApplicationAccessTokenCacheTest(TestCase):
+    def setUp(self):
+        self.cache = ApplicationAccessTokenCache(timeout=60)
+
+    @mock.patch('djangocanvas.api.facepy.utils._fetch_application_access_token')
+    def test_token_is_cached(self, fetch):
+        """
+        Verify that application access tokens are requested once per application.
+        """
+        fetch.return_value = 'token'
+
+        assert self.cache.get(TEST_APPLICATION_ID, TEST_APPLICATION_SECRET) == 'token'
+        assert self.cache.get(TEST_APPLICATION_ID, TEST_APPLICATION_SECRET) == 'token'
+        assert fetch.call_count == 1
+
+        self.cache.invalidate(TEST_APPLICATION_ID, TEST_APPLICATION_SECRET)
+        self.cache.get(TEST_APPLICATION_ID, TEST_APPLICATION_SECRET)
+        assert fetch.call_count == 2
+
+    @mock.patch('djangocanvas.api.facepy.utils._fetch_application_access_token')
+    def test_rejected_token_is_requested_again(self, fetch):
+        """
+        Verify that a cached token Facebook rejects as invalid is forgotten and requested anew,
+        while other OAuth errors are raised as they are.
+        """
+        fetch.side_effect = ['revoked', 'token']
+
+        def get(token):
+            if token == 'revoked':
+                raise GraphAPI.OAuthError('Error validating access token', 190)
+            return token
+
+        def forbidden(token):
+            raise GraphAPI.OAuthError('Requires extended permission', 200)
+
+        with mock.patch('djangocanvas.api.facepy.utils.application_access_token_cache', self.cache):
+            assert with_application_access_token(TEST_APPLICATION_ID, TEST_APPLICATION_SECRET, get) == 'token'
+            self.assertRaises(GraphAPI.OAuthError, with_application_access_token,
+                              TEST_APPLICATION_ID, TEST_APPLICATION_SECRET, forbidden)
+
+        assert fetch.call_count == 2
+
+    def test_concurrent_callers_share_a_request(self):
+        """
+        Verify that concurrent callers wait for a single request for the token.
+        """
+        calls = []
+        proceed = threading.Event()
+
+        def fetch(application_id, application_secret_key):
+            calls.append(application_id)
+            proceed.wait()
+            return 'token'
+
+        tokens = []
+
+        def get():
+            tokens.append(self.cache.get(TEST_APPLICATION_ID, TEST_APPLICATION_SECRET))
+
+        with mock.patch('djangocanvas.api.facepy.utils._fetch_application_access_token', fetch):
+            threads = [threading.Thread(target=get) for i in range(5)]
+
+            for thread in threads:
+                thread.start()
+
+            proceed.set()
+
+            for thread in threads:
+                thread.join()
+
+        assert len(calls) == 1
+        assert tokens == ['token'] * 5
+
+
+class SessionPoolTest(TestCase):
+    def setUp(self):
+        self.sessions = SessionPool(pool_size=1)
+
+    def tearDown(self):
+        self.sessions.clear()
+
+    def test_sessions_are_shared(self):
+        """
+        Verify that GraphAPI instances share a session per URL unless one is given.
+        """
+        session = mock.Mock()
+
+        assert GraphAPI('a').session is GraphAPI('b').session
+        assert GraphAPI('a', url='http://localhost').session is not GraphAPI('a').session
+        assert GraphAPI('a', session=session).session is session
+
+    def test_saturation(self):
+        """
+        Verify that requests sent while the pool is exhausted are counted.
+        """
+        session = mock.Mock()
+        session.request.side_effect = lambda *args, **kwargs: self.sessions.request(
+            'http://localhost', mock.Mock(), 'GET', 'http://localhost/me')
+
+        self.sessions.request('http://localhost', session, 'GET', 'http://localhost/me')
+
+        stats = self.sessions.stats()['http://localhost']
+        assert stats['requests'] == 2
+        assert stats['peak'] == 2
+        assert stats['saturated'] == 1
+        assert stats['in_flight'] == 0
+
+
+class GraphAPIBatchTest(TestCase):
+    def _post(self, batch):
+        """Respond to each request with its index, failing those whose body asks to."""
+        responses = []
+
+        for request in json.loads(batch):
+            body = parse_qs(request.get('body', ''))
+
+            if body.get('fail') and self.failures.get(request['relative_url'], 0):
+                self.failures[request['relative_url']] -= 1
+                responses.append({'code': 500, 'body': json.dumps({'error': {'message': 'Unknown', 'code': 2}})})
+            else:
+                responses.append({'code': 200, 'body': json.dumps({'url': request['relative_url']})})
+
+        return responses
+
+    def setUp(self):
+        self.failures = {}
+
+    def test_batch_is_chunked(self):
+        """
+        Verify that batches exceeding Facebook's limit are split and yielded in order.
+        """
+        requests = [{'method': 'GET', 'relative_url': str(i), 'body': {'a': 'b'}} for i in range(120)]
+
+        with mock.patch.object(GraphAPI, 'post') as post:
+            post.side_effect = lambda batch: self._post(batch)
+            responses = list(GraphAPI('token').batch(requests, workers=3))
+
+        assert post.call_count == 3
+        assert [response['url'] for response in responses] == [str(i) for i in range(120)]
+        assert requests[0]['body'] == {'a': 'b'}
+
+    def test_abandoned_batch_is_stopped(self):
+        """
+        Verify that chunks still queued when the caller stops iterating over responses aren't sent.
+        """
+        requests = [{'method': 'GET', 'relative_url': str(i)} for i in range(500)]
+
+        def post(batch):
+            time.sleep(0.05)
+            return self._post(batch)
+
+        with mock.patch.object(GraphAPI, 'post') as mock_post:
+            mock_post.side_effect = post
+            responses = GraphAPI('token').batch(requests, workers=2)
+            responses.next()
+            responses.close()
+
+        assert mock_post.call_count < 10
+
+    def test_transient_errors_are_retried(self):
+        """
+        Verify that only requests failing with a transient error are sent again.
+        """
+        requests = [
+            {'method': 'POST', 'relative_url': 'flaky', 'body': {'fail': '1'}},
+            {'method': 'POST', 'relative_url': 'broken', 'body': {'fail': '1'}},
+            {'method': 'GET', 'relative_url': 'fine'}
+        ]
+        self.failures = {'flaky': 1, 'broken': 3}
+
+        with mock.patch.object(GraphAPI, 'post') as post:
+            post.side_effect = lambda batch: self._post(batch)
+            responses = list(GraphAPI('token', retry_policy=RetryPolicy(backoff=0)).batch(requests, retry=2))
+
+        assert [len(json.loads(call[1]['batch'])) for call in post.call_args_list] == [3, 2, 1]
+        assert responses[0] == {'url': 'flaky'}
+        assert isinstance(responses[1], GraphAPI.FacebookError)
+        assert responses[1].request is requests[1]
+        assert responses[2] == {'url': 'fine'}
+
+
+class GraphAPIPaginationTest(TestCase):
+    def _request(self, url, session, method, request_url, **kwargs):
+        self.requested.append(request_url)
+        page = int(request_url.rsplit('/', 1)[1])
+
+        if page == self.broken_page:
+            body = {'error': {'message': 'Broken', 'code': 100}}
+        else:
+            body = {'data': [page]}
+            if page < 5:
+                body['paging'] = {'next': 'https://graph.facebook.com/page/%d' % (page + 1)}
+
+        return mock.Mock(content=json.dumps(body))
+
+    def setUp(self):
+        self.requested = []
+        self.broken_page = None
+
+    def test_prefetch(self):
+        """
+        Verify that prefetched pages are yielded in order.
+        """
+        with mock.patch('djangocanvas.api.facepy.graph_api.sessions.request', self._request):
+            pages = list(GraphAPI('token').get('page/1', page=True, prefetch=2))
+
+        assert [page['data'] for page in pages] == [[1], [2], [3], [4], [5]]
+
+    def test_prefetch_error(self):
+        """
+        Verify that errors fetching a page are raised to the caller.
+        """
+        self.broken_page = 3
+
+        with mock.patch('djangocanvas.api.facepy.graph_api.sessions.request', self._request):
+            pages = GraphAPI('token').get('page/1', page=True, prefetch=1)
+
+            assert pages.next()['data'] == [1]
+            assert pages.next()['data'] == [2]
+            self.assertRaises(GraphAPI.FacebookError, pages.next)
+
+
+class RetryPolicyTest(TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(backoff=1, throttled_backoff=10, jitter=0, budget=3)
+        self.policy.sleep = mock.Mock()
+        self.graph = GraphAPI('token', retry_policy=self.policy)
+
+    def _query(self, *errors):
+        with mock.patch.object(self.graph, '_parse') as parse:
+            parse.side_effect = list(errors) + [{'id': 1}]
+
+            with mock.patch('djangocanvas.api.facepy.graph_api.sessions.request'):
+                return self.graph.get('me', retry=3)
+
+    def test_permanent_errors_are_not_retried(self):
+        """
+        Verify that OAuth errors are raised right away.
+        """
+        self.assertRaises(GraphAPI.OAuthError, self._query, GraphAPI.OAuthError('Invalid token', 190))
+        assert not self.policy.sleep.called
+        assert self.policy.stats()['permanent_failures'] == 1
+
+    def test_backoff(self):
+        """
+        Verify that retries are delayed exponentially, and longer when throttled.
+        """
+        assert self._query(
+            GraphAPI.HTTPError('Connection reset'),
+            GraphAPI.FacebookError('Unknown error', 1),
+            GraphAPI.FacebookError('Too many calls', 4)
+        ) == {'id': 1}
+
+        assert [call[0][0] for call in self.policy.sleep.call_args_list] == [1, 2, 40]
+        assert self.policy.stats()['transient'] == 2
+        assert self.policy.stats()['throttled'] == 1
+
+    def test_budget(self):
+        """
+        Verify that retries stop once the budget is spent.
+        """
+        self._query(GraphAPI.HTTPError('Timeout'), GraphAPI.HTTPError('Timeout'))
+
+        self.assertRaises(
+            GraphAPI.HTTPError, self._query, GraphAPI.HTTPError('Timeout'), GraphAPI.HTTPError('Timeout'))
+        assert self.policy.stats()['budget_failures'] == 1
+
+
+class ResponseCacheTest(TestCase):
+    def _request(self, url, session, method, request_url, **kwargs):
+        self.requests.append(kwargs)
+
+        if kwargs.get('headers', {}).get('If-None-Match') == '"v1"':
+            return mock.Mock(status_code=304, content='', headers={'etag': '"v1"'})
+
+        return mock.Mock(status_code=200, content=json.dumps({'id': request_url}), headers={'etag': '"v1"'})
+
+    def setUp(self):
+        self.requests = []
+        self.cache = ResponseCache(LRUCache(), timeouts=[(r'^me$', 60)])
+
+    def _get(self, path, token='token'):
+        with mock.patch('djangocanvas.api.facepy.graph_api.sessions.request', self._request):
+            return GraphAPI(token, cache=self.cache).get(path)
+
+    def test_fresh_responses_are_reused(self):
+        """
+        Verify that fresh responses are served from the cache, separately per OAuth token and path.
+        """
+        assert self._get('me') == self._get('me')
+        self._get('me', token='other')
+        self._get('friends')
+        self._get('friends')
+
+        assert len(self.requests) == 4
+        assert self.cache.stats()['hits'] == 1
+
+    def test_cached_responses_are_copied(self):
+        """
+        Verify that modifying a response doesn't modify the cached one.
+        """
+        self._get('me')['id'] = 'modified'
+        self._get('me')['name'] = 'modified'
+
+        assert self._get('me') == {'id': 'https://graph.facebook.com/me'}
+        assert len(self.requests) == 1
+
+    def test_stale_responses_are_revalidated(self):
+        """
+        Verify that stale responses are revalidated with their ETag.
+        """
+        response = self._get('me')
+
+        key = self.cache.key('https://graph.facebook.com/me', {}, 'token')
+        self.cache.storage.get(key)['expires'] = 0
+
+        assert self._get('me') == response
+
+        assert self.requests[1]['headers'] == {'If-None-Match': '"v1"'}
+        assert self.cache.stats()['revalidations'] == 1
+
+
+class GraphStubHandler(StubHandler):
+
+    def do_GET(self):
+        path = self.path.split('?')[0].strip('/')
+        self.work(0.02)
+
+        if path.startswith('page/'):
+            page = int(path.split('/')[1])
+            body = {'data': [page]}
+            if page < 3:
+                body['paging'] = {'next': '%s/page/%d' % (self.server.url, page + 1)}
+        elif path == 'private':
+            body = {'error': {'message': 'Invalid token', 'type': 'OAuthException', 'code': 190}}
+        else:
+            body = {'id': path}
+
+        self.respond(json.dumps(body), {'Content-Type': 'application/json'})
+
+    def do_POST(self):
+        self.read_body()
+        self.do_GET()
+
+
+class AsyncGraphAPITest(TestCase):
+    def setUp(self):
+        self.server = StubServer(GraphStubHandler)
+        self.server.start()
+        self.pool = RequestPool(concurrency=3)
+        self.graph = AsyncGraphAPI('token', url=self.server.url, pool=self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_concurrency_is_limited(self):
+        """
+        Verify that requests are sent concurrently, but no more than the pool allows.
+        """
+        results = [self.graph.get(str(i)) for i in range(12)]
+
+        assert [result.get(5) for result in results] == [{'id': str(i)} for i in range(12)]
+        assert self.server.peak == 3
+        assert self.pool.stats()['pending'] == 0
+
+    def test_errors(self):
+        """
+        Verify that errors are raised when the result is retrieved.
+        """
+        result = self.graph.get('private')
+
+        self.assertRaises(AsyncGraphAPI.OAuthError, result.get, 5)
+
+    def test_pages(self):
+        """
+        Verify that pages of results are yielded in order.
+        """
+        assert [page['data'] for page in self.graph.pages('page/1')] == [[1], [2], [3]]
+
+
+class GraphAPIMetricsTest(TestCase):
+    def setUp(self):
+        self.server = StubServer(GraphStubHandler)
+        self.server.start()
+        self.graph = GraphAPI('token', url=self.server.url)
+        self.registry = metrics.Registry()
+        metrics.sinks.append(self.registry)
+
+    def tearDown(self):
+        metrics.sinks.remove(self.registry)
+        self.server.stop()
+
+    def test_requests_are_measured(self):
+        """
+        Verify that responses and errors are counted per endpoint, with IDs left out.
+        """
+        self.graph.get('1234/feed')
+        self.graph.get('5678/feed?locale=ru_RU')
+        self.assertRaises(GraphAPI.OAuthError, self.graph.get, 'private')
+
+        lines = self.registry.render().splitlines()
+
+        assert 'djangocanvas_api_responses_total{client="graph",endpoint="/:id/feed",status="200"} 2' in lines
+        assert 'djangocanvas_api_request_duration_seconds_count{client="graph",endpoint="/:id/feed"} 2' in lines
+        assert 'djangocanvas_api_errors_total{client="graph",endpoint="/private",code="190"} 1' in lines
+
+    def test_request_bytes_are_counted(self):
+        """
+        Verify that the bodies of requests are counted.
+        """
+        self.graph.get('me')
+        self.graph.post('me/feed', message='Hello')
+
+        lines = self.registry.render().splitlines()
+
+        assert 'message=Hello' in self.server.bodies[0]
+        assert 'djangocanvas_api_request_bytes_total{client="graph",endpoint="/me"} 0' in lines
+        assert 'djangocanvas_api_request_bytes_total{client="graph",endpoint="/me/feed"} %d' \
+            % len(self.server.bodies[0]) in lines
+
+    def test_retries_are_counted(self):
+        """
+        Verify that retries of failed requests are counted.
+        """
+        self.graph.retry_policy = RetryPolicy(backoff=0)
+        self.graph.url = 'http://127.0.0.1:1'
+
+        self.assertRaises(GraphAPI.HTTPError, self.graph.get, 'me', retry=2)
+
+        lines = self.registry.render().splitlines()
+
+        assert 'djangocanvas_api_errors_total{client="graph",endpoint="/me",code="connection"} 3' in lines
+        assert 'djangocanvas_api_retries_total{client="graph",endpoint="/me"} 2' in lines
+
+
+class SignedRequestCacheTest(TestCase):
+    def setUp(self):
+        signed_request_cache.clear()
+
+    def test_signed_request_is_cached(self):
+        """
+        Verify that a signed request is verified once and reused afterwards.
+        """
+        signed_request = SignedRequest(TEST_SIGNED_REQUEST, TEST_APPLICATION_SECRET)
+        signed_request.user.oauth_token.expires_at = datetime.now() + timedelta(hours=1)
+        raw = signed_request.generate()
+
+        first = get_signed_request(raw, TEST_APPLICATION_SECRET)
+        second = get_signed_request(raw, TEST_APPLICATION_SECRET)
+
+        assert first is second
+        assert signed_request_cache.stats()['hits'] == 1
+        assert signed_request_cache.stats()['misses'] == 1
+
+    def test_expired_signed_request_is_not_cached(self):
+        """
+        Verify that signed requests carrying an expired OAuth token are not cached.
+        """
+        signed_request = SignedRequest(TEST_SIGNED_REQUEST, TEST_APPLICATION_SECRET)
+        signed_request.user.oauth_token.expires_at = datetime.now() - timedelta(days=1)
+        raw = signed_request.generate()
+
+        get_signed_request(raw, TEST_APPLICATION_SECRET)
+
+        assert len(signed_request_cache) == 0
+
+    def test_invalid_signed_request_is_not_cached(self):
+        """
+        Verify that signed requests failing verification are rejected every time.
+        """
+        for i in range(2):
+            self.assertRaises(SignedRequest.Error, get_signed_request, TEST_SIGNED_REQUEST, 'wrong secret')
+
+        assert len(signed_request_cache) == 0
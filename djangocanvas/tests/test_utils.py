@@ -0,0 +1,267 @@
+import mock
+import time
+
+from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.http import Http404
+from django.test.client import RequestFactory
+
+from djangocanvas.api import metrics, vkontakte
+from djangocanvas.api.facepy import GraphAPI
+from djangocanvas.api.facepy.utils import application_access_token_cache
+from djangocanvas.models import SocialUser
+from djangocanvas.middleware import VkontakteMiddleware
+from djangocanvas.views import api_metrics
+from djangocanvas.utils import configure, send_notifications, PathMatcher, VK_NOTIFICATION_BATCH_SIZE
+
+
+class SendNotificationsTest(TestCase):
+    def _users(self, provider, count, offset=0):
+        return [SocialUser(social_id=offset + i, provider=provider) for i in range(count)]
+
+    @mock.patch('djangocanvas.api.facepy.utils.get_application_access_token', mock.Mock(return_value='token'))
+    @mock.patch.object(vkontakte.API, 'get')
+    @mock.patch.object(GraphAPI, 'post')
+    def test_send_notifications(self, post, get):
+        """
+        Verify that users are notified in batches per provider.
+        """
+        vk_users = self._users('vkontakte', VK_NOTIFICATION_BATCH_SIZE + 1)
+        facebook_users = self._users('facebook', 2, offset=1000)
+
+        # Every VK user but the first is notified.
+        get.side_effect = lambda method, **kwargs: ','.join(kwargs['uids'].split(',')[1:])
+        post.return_value = [
+            {'code': 200, 'body': '{"success": true}'},
+            {'code': 400, 'body': '{"error": {"message": "Unknown user", "code": 100}}'}
+        ]
+
+        results = dict((result.user.social_id, result) for result in send_notifications(vk_users + facebook_users, u'Hi'))
+
+        assert len(results) == len(vk_users) + len(facebook_users)
+        assert get.call_count == 2
+        assert post.call_count == 1
+
+        assert results[0].sent is False
+        assert results[1].sent is True
+        assert results[VK_NOTIFICATION_BATCH_SIZE].sent is False
+
+        assert results[1000].sent is True
+        assert results[1001].sent is False
+        assert isinstance(results[1001].error, GraphAPI.FacebookError)
+
+    @mock.patch('djangocanvas.api.facepy.utils._fetch_application_access_token')
+    def test_revoked_application_access_token(self, fetch):
+        """
+        Verify that a batch Facebook rejects the cached application access token for is sent
+        again with a token requested anew.
+        """
+        fetch.side_effect = ['revoked', 'token']
+
+        def post(graph, path='', retry=0, **data):
+            if graph.oauth_token == 'revoked':
+                raise GraphAPI.OAuthError('Error validating access token', 190)
+            return [{'code': 200, 'body': '{"success": true}'}]
+
+        with mock.patch.multiple(application_access_token_cache, _tokens={}, shared=None):
+            with mock.patch.object(GraphAPI, 'post', post):
+                results = list(send_notifications(self._users('facebook', 1), u'Hi'))
+
+        assert results[0].sent is True
+        assert fetch.call_count == 2
+
+    @mock.patch.object(vkontakte.API, 'get')
+    def test_failed_batch(self, get):
+        """
+        Verify that every user of a batch VK rejects is reported as failed.
+        """
+        get.side_effect = vkontakte.VKError({'error_code': 6, 'error_msg': 'Too many requests', 'request_params': []})
+
+        results = list(send_notifications(self._users('vkontakte', 3), u'Hi'))
+
+        assert [result.sent for result in results] == [False] * 3
+        assert all([isinstance(result.error, vkontakte.VKError) for result in results])
+
+
+    @mock.patch.object(vkontakte.API, 'get')
+    def test_transport_error(self, get):
+        """
+        Verify that a batch failing to reach VK is reported as failed without aborting the others.
+        """
+        users = self._users('vkontakte', VK_NOTIFICATION_BATCH_SIZE + 1)
+
+        def sendNotification(method, **kwargs):
+            if kwargs['uids'].startswith('0,'):
+                raise IOError('Connection reset by peer')
+            return kwargs['uids']
+
+        get.side_effect = sendNotification
+
+        results = dict((result.user.social_id, result) for result in send_notifications(users, u'Hi', workers=1))
+
+        assert len(results) == len(users)
+        assert isinstance(results[0].error, IOError)
+        assert results[VK_NOTIFICATION_BATCH_SIZE].sent is True
+
+    @mock.patch.object(vkontakte.API, 'get')
+    def test_closed_early(self, get):
+        """
+        Verify that batches queued when the caller stops reading results aren't sent.
+        """
+        def sendNotification(method, **kwargs):
+            time.sleep(0.05)
+            return kwargs['uids']
+
+        get.side_effect = sendNotification
+
+        results = send_notifications(self._users('vkontakte', VK_NOTIFICATION_BATCH_SIZE * 10), u'Hi', workers=1)
+        results.next()
+        results.close()
+
+        assert get.call_count < 10
+
+
+class ConfigureTest(TestCase):
+    def test_configured_once(self):
+        """
+        Verify that the API clients are configured once, however often ``configure`` is called.
+        """
+        with mock.patch.multiple('djangocanvas.utils', _configured=False, API_METRICS=True):
+            with mock.patch.object(metrics, 'sinks', []):
+                configure()
+                configure()
+
+                assert metrics.sinks == [metrics.registry]
+
+    def test_rate_limit_is_opt_in(self):
+        """
+        Verify that VK API calls aren't throttled unless a rate limit is configured.
+        """
+        assert vkontakte.api._API.rate_limiter is None
+
+
+class PathMatcherTest(TestCase):
+    def test_matches(self):
+        """
+        Verify that paths are matched without their leading slash, by prefix or by expression.
+        """
+        matcher = PathMatcher([r'^admin/', r'^static\.files/', r'^api/v\d+/', r'callback$'])
+
+        assert matcher.prefixes == ('admin/', 'static.files/')
+        assert len(matcher.expressions) == 1
+
+        assert matcher.matches('/admin/users/')
+        assert matcher.matches('/static.files/app.js')
+        assert matcher.matches('/api/v2/')
+        assert matcher.matches('/facebook/callback')
+        assert not matcher.matches('/staticXfiles/')
+        assert not matcher.matches('/api/vX/')
+        assert not matcher.matches('/')
+
+    def test_memoization(self):
+        """
+        Verify that the outcome is memoized per path, up to the cache size.
+        """
+        matcher = PathMatcher([r'^a'], cache_size=2)
+
+        with mock.patch.object(matcher, 'prefixes', ()):
+            assert matcher.matches('/a') is False
+
+        assert matcher.matches('/a') is False
+        matcher.matches('/b')
+        matcher.matches('/c')
+        assert matcher.matches('/a') is True
+
+    def test_uncombinable_expressions(self):
+        """
+        Verify that expressions naming groups alike are matched separately.
+        """
+        matcher = PathMatcher([r'(?P<id>\d+)/a', r'(?P<id>\d+)/b'])
+
+        assert len(matcher.expressions) == 2
+        assert matcher.matches('/1/b')
+
+    def test_expressions_with_flags_or_backreferences(self):
+        """
+        Verify that expressions with inline flags or backreferences are matched separately,
+        so that they affect no other expression.
+        """
+        matcher = PathMatcher([r'(?i)^Admin/', r'callback$', r'(\w+)/\1/', r'(?P<id>\d+)/(?P=id)/', r'a\\1'])
+
+        assert len(matcher.expressions) == 4
+
+        assert matcher.matches('/admin/')
+        assert matcher.matches('/news/news/')
+        assert matcher.matches('/1/1/')
+        assert matcher.matches('/a\\1')
+        assert not matcher.matches('/facebook/CALLBACK')
+        assert not matcher.matches('/news/events/')
+
+    def test_invalid_expression(self):
+        self.assertRaises(ImproperlyConfigured, PathMatcher, [r'^admin/('])
+
+    def test_vkontakte_middleware(self):
+        """
+        Verify that the VK middleware leaves disabled paths alone.
+        """
+        request = mock.Mock(path='/admin/', GET={})
+
+        with mock.patch('djangocanvas.middleware.disabled_paths', PathMatcher([r'^admin/'])):
+            with mock.patch.object(VkontakteMiddleware, '_patch_request_with_vkapi') as patch:
+                VkontakteMiddleware().process_request(request)
+                assert not patch.called
+
+                request.path = '/game/'
+                VkontakteMiddleware().process_request(request)
+                assert patch.called
+
+    def test_misconfiguration(self):
+        """
+        Verify that configuring both enabled and disabled paths is rejected when the middleware is loaded.
+        """
+        with mock.patch.multiple('djangocanvas.settings', ENABLED_PATHS=['^a'], DISABLED_PATHS=['^b']):
+            self.assertRaises(ImproperlyConfigured, VkontakteMiddleware)
+
+
+class ApiMetricsTest(TestCase):
+    def test_render(self):
+        """
+        Verify that measurements are rendered in Prometheus' text format, with cumulative buckets.
+        """
+        registry = metrics.Registry(buckets=[0.1, 1])
+        registry.request('graph', '/me', 0.05, 200, 100, 0)
+        registry.request('graph', '/me', 0.5, 200, 50, 20)
+        registry.request('graph', '/me', 5, 500, 0, 0)
+        registry.error('vkontakte', 'users.get', '6')
+        registry.retry('graph', '/"me"')
+
+        lines = registry.render().splitlines()
+
+        assert 'djangocanvas_api_request_duration_seconds_bucket{client="graph",endpoint="/me",le="0.1"} 1' in lines
+        assert 'djangocanvas_api_request_duration_seconds_bucket{client="graph",endpoint="/me",le="1.0"} 2' in lines
+        assert 'djangocanvas_api_request_duration_seconds_bucket{client="graph",endpoint="/me",le="+Inf"} 3' in lines
+        assert 'djangocanvas_api_request_duration_seconds_sum{client="graph",endpoint="/me"} 5.55' in lines
+        assert 'djangocanvas_api_request_duration_seconds_count{client="graph",endpoint="/me"} 3' in lines
+        assert 'djangocanvas_api_responses_total{client="graph",endpoint="/me",status="200"} 2' in lines
+        assert 'djangocanvas_api_response_bytes_total{client="graph",endpoint="/me"} 150' in lines
+        assert 'djangocanvas_api_request_bytes_total{client="graph",endpoint="/me"} 20' in lines
+        assert 'djangocanvas_api_errors_total{client="vkontakte",endpoint="users.get",code="6"} 1' in lines
+        assert 'djangocanvas_api_retries_total{client="graph",endpoint="/\\"me\\""} 1' in lines
+
+    def test_view(self):
+        """
+        Verify that the registry is rendered only if measurements are kept in memory.
+        """
+        self.assertRaises(Http404, api_metrics, RequestFactory().get(reverse('api_metrics')))
+
+        with mock.patch.object(metrics, 'sinks', [metrics.registry]):
+            metrics.request('vkontakte', 'getServerTime', 0.01, 200, 10, 10)
+            response = self.client.get(reverse('api_metrics'))
+
+        metrics.registry.clear()
+
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+        assert 'djangocanvas_api_responses_total{client="vkontakte",endpoint="getServerTime",status="200"} 1' \
+            in response.content
@@ -8,12 +8,33 @@ Requires mock >= 0.7.2.
 import os
 import sys
 import urllib
+import urlparse
+import warnings
 sys.path.insert(0, os.path.abspath('..'))
 
+import gzip
+import socket
+import tempfile
+import time
 import unittest
+from StringIO import StringIO
+
 import mock
-from djangocanvas.api import vkontakte
-from djangocanvas.api.vkontakte.api import _json_iterparse
+from hashlib import md5
+from django.conf import settings
+from django.contrib.sessions.backends.base import SessionBase
+from django.http import QueryDict
+from django.test import TestCase
+from django.test.client import RequestFactory
+from djangocanvas.api import codec, metrics, vkontakte
+from djangocanvas.forms import VkontakteIframeForm, VkontakteLaunchParameters
+from djangocanvas.middleware import VkontakteMiddleware, SESSION_KEY, VK_SYNCED_AT_SESSION_KEY
+from djangocanvas.models import SocialUser, social_user_cache
+from djangocanvas.api.vkontakte.api import _json_iterparse, _json_iterresponse
+from djangocanvas.api.vkontakte.async_api import RequestPool
+from djangocanvas.api.vkontakte.ratelimit import RateLimiter, LocalStorage, FileStorage, CacheStorage
+from djangocanvas.api.vkontakte.http import ConnectionPool
+from djangocanvas.tests.helpers import StubServer, StubHandler
 
 API_ID = 'api_id'
 API_SECRET = 'api_secret'
@@ -47,6 +68,58 @@ class IterparseTest(unittest.TestCase):
         self.assertEqual(parses[0]["error"]["}{"], "foo")
         self.assertEqual(parses[1]["foo"], "bar")
 
+    def test_iterparse_decodes_once(self):
+        """
+        Bodies consisting of several objects, or holding control characters, aren't decoded as a whole first.
+        """
+        with mock.patch.object(codec, 'loads', wraps=codec.loads) as loads:
+            self.assertEqual(list(_json_iterparse('{"error":1} {"response":2}')), [{"error": 1}, {"response": 2}])
+            self.assertEqual(list(_json_iterparse('{"response":"a\x01b"}')), [{"response": "a\x01b"}])
+            self.assertFalse(loads.called)
+
+            self.assertEqual(list(_json_iterparse('{"response":{"a":[{}]}}')), [{"response": {"a": [{}]}}])
+            self.assertEqual(loads.call_count, 1)
+
+    def test_iterparse_whitespace(self):
+        parses = list(_json_iterparse(' {"error": 1}\n {"response": 2}\n'))
+        self.assertEqual(parses, [{"error": 1}, {"response": 2}])
+
+    def test_iterresponse(self):
+        data = '{"error":{"error_code":8}} {"response": [ {"uid":1} , 2,[3] ]}{"response":4}'
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            items = list(_json_iterresponse(data))
+        self.assertEqual(items, [{"uid": 1}, 2, [3]])
+        self.assertEqual(len(caught), 1)
+
+    def test_iterresponse_is_lazy(self):
+        items = _json_iterresponse('{"response":[1,2,broken]}')
+        self.assertEqual(items.next(), 1)
+        self.assertEqual(items.next(), 2)
+        self.assertRaises(ValueError, items.next)
+
+    def test_iterresponse_edge(self):
+        self.assertEqual(list(_json_iterresponse('{"response":[]}')), [])
+        self.assertEqual(list(_json_iterresponse('{"count":1,"response":[1]}')), [1])
+        self.assertEqual(list(_json_iterresponse('{"response":{"count":0}}')), [{"count": 0}])
+        self.assertRaises(vkontakte.VKError, list, _json_iterresponse(
+            '{"error":{"error_code":5,"error_msg":"Failed","request_params":[]}}'))
+
+
+class CodecTest(unittest.TestCase):
+    def tearDown(self):
+        codec.use()
+
+    def test_stdlib_fallback(self):
+        codec.use('json')
+        self.assertEqual(codec.backend.__name__, 'json')
+        self.assertEqual(codec.dumps({'a': [1, u'клен']}, ensure_ascii=False), u'{"a":[1,"клен"]}')
+        self.assertEqual(codec.raw_decode(' {"a":1}{"b":2}', 1), ({'a': 1}, 8))
+        self.assertRaises(ValueError, codec.loads, '{"a":')
+
+    def test_missing_backend(self):
+        self.assertRaises(ImportError, codec.use, 'nonexistentjson')
+
 
 class VkontakteMagicTest(unittest.TestCase):
 
@@ -98,6 +171,12 @@ class VkontakteMagicTest(unittest.TestCase):
         self.assertEqual(res, 'foo')
         _get.assert_called_once_with('friends.get', uid=642177)
 
+    @mock.patch('djangocanvas.api.vkontakte.http.post')
+    def test_iterate(self, post):
+        post.return_value = 200, '{"response":[{"uid":1},{"uid":2}]}'
+        res = self.api.iterate('friends.get', uid=1)
+        self.assertEqual([item['uid'] for item in res], [1, 2])
+
     @mock.patch('djangocanvas.api.vkontakte.http.post')
     def test_urlencode_bug(self, post):
         post.return_value = 200, '{"response":123}'
@@ -109,7 +188,513 @@ class VkontakteMagicTest(unittest.TestCase):
         post.return_value = 200, '{"response": 123}'
         self.api.ads.getStat(data={'type': '1', 'id': 1})
         posted_data = urllib.unquote(post.call_args[0][1])
-        self.assertTrue('data={"type":+"1",+"id":+1}' in posted_data, posted_data)
+        self.assertTrue('data={"type":"1","id":1}' in posted_data, posted_data)
+
+class KeepAliveStubHandler(StubHandler):
+
+    def do_POST(self):
+        self.read_body()
+        body = '{"response":123}'
+
+        if self.path.endswith('/slow'):
+            time.sleep(0.5)
+        headers = {}
+
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(body)
+            f.close()
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+
+        self.respond(body, headers)
+
+        # Drop the connection without telling the client, like servers
+        # timing out idle keep-alive connections do.
+        if self.path.endswith('/drop'):
+            self.close_connection = 1
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(KeepAliveStubHandler)
+        self.server.start()
+        self.url = self.server.url + '/method/'
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.stop()
+
+    def test_keep_alive(self):
+        for i in range(3):
+            status, body = self.pool.request(self.url + 'getServerTime', '', {}, 5)
+            self.assertEqual((status, body), (200, '{"response":123}'))
+
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_stale_connection(self):
+        self.pool.request(self.url + 'drop', '', {}, 5)
+        status, body = self.pool.request(self.url + 'getServerTime', '', {}, 5)
+
+        self.assertEqual(body, '{"response":123}')
+        self.assertEqual(self.pool.stats()['retried'], 1)
+
+    def test_timeout_is_not_retried(self):
+        """
+        Verify that a request timing out on a reused connection isn't sent again,
+        since it may have been processed by the server.
+        """
+        self.pool.request(self.url + 'getServerTime', '', {}, 5)
+
+        self.assertRaises(socket.timeout, self.pool.request, self.url + 'slow', '', {}, 0.2)
+        self.assertEqual(self.server.paths, [self.url + 'getServerTime', self.url + 'slow'])
+        self.assertEqual(self.pool.stats()['retried'], 0)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        self.pool.request(self.url + 'getServerTime', '', {}, 5)
+        self.pool.request(self.url + 'getServerTime', '', {}, 5)
+
+        self.assertEqual(self.pool.stats()['created'], 2)
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.api = vkontakte.API(token='token')
+        self.registry = metrics.Registry()
+        metrics.sinks.append(self.registry)
+
+    def tearDown(self):
+        metrics.sinks.remove(self.registry)
+
+    @mock.patch('djangocanvas.api.vkontakte.http.post')
+    def test_requests_are_measured(self, post):
+        post.return_value = 200, '{"response":123}'
+        self.api.getServerTime()
+        self.api.getServerTime()
+
+        post.return_value = 200, ('{"error":{"error_code":6,"error_msg":"Too many requests per second",'
+                                  '"request_params":[]}}')
+        self.assertRaises(vkontakte.VKError, self.api.friends.get)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('djangocanvas_api_responses_total{client="vkontakte",endpoint="getServerTime",status="200"} 2',
+                      lines)
+        self.assertIn('djangocanvas_api_response_bytes_total{client="vkontakte",endpoint="getServerTime"} 32', lines)
+        self.assertIn('djangocanvas_api_request_bytes_total{client="vkontakte",endpoint="getServerTime"} %d'
+                      % (2 * len(post.call_args_list[0][0][1])), lines)
+        self.assertIn('djangocanvas_api_errors_total{client="vkontakte",endpoint="friends.get",code="6"} 1', lines)
+
+    @mock.patch('djangocanvas.api.vkontakte.http.post')
+    def test_connection_errors(self, post):
+        post.side_effect = IOError('Connection refused')
+        self.assertRaises(IOError, self.api.getServerTime)
+
+        self.assertIn('djangocanvas_api_errors_total{client="vkontakte",endpoint="getServerTime",code="connection"} 1',
+                      self.registry.render().splitlines())
+
+
+    def test_stale_connection_retries_are_counted(self):
+        """
+        Verify that requests sent again because a reused connection had gone stale are counted as retries.
+        """
+        server = StubServer(KeepAliveStubHandler)
+        server.start()
+
+        try:
+            with mock.patch('djangocanvas.api.vkontakte.api.API_URL', server.url + '/drop'):
+                api = vkontakte.API(API_ID, API_SECRET)
+                api.getServerTime()
+                api.getServerTime()
+        finally:
+            vkontakte.http.pool.clear()
+            server.stop()
+
+        self.assertIn('djangocanvas_api_retries_total{client="vkontakte",endpoint="getServerTime"} 1',
+                      self.registry.render().splitlines())
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = vkontakte.API(API_ID, API_SECRET)
+
+    @mock.patch('djangocanvas.api.vkontakte.http.post')
+    def test_calls_are_combined(self, post):
+        post.return_value = 200, '{"response":[%s]}' % ','.join(['%d' % i for i in range(25)])
+
+        with self.api.batch() as batch:
+            results = [batch.users.get(uids=i) for i in range(30)]
+            self.assertRaises(ValueError, results[0].get)
+
+        self.assertEqual(post.call_count, 2)
+        code = urlparse.parse_qs(post.call_args_list[0][0][1])['code'][0]
+        self.assertEqual(code.count('API.users.get('), 25)
+        self.assertTrue(code.startswith('return [API.users.get({"uids":0}),'), code)
+        self.assertEqual([result.get() for result in results[:25]], range(25))
+
+    @mock.patch('djangocanvas.api.vkontakte.http.post')
+    def test_execute_errors(self, post):
+        post.return_value = 200, ('{"response":[1,false,3],"execute_errors":'
+                                  '[{"method":"wall.get","error_code":15,"error_msg":"Access denied"}]}')
+
+        with self.api.batch() as batch:
+            first = batch.getServerTime()
+            second = batch.wall.get(owner_id=1)
+            third = batch.get('users.get', uids=1)
+
+        self.assertEqual(first.get(), 1)
+        self.assertEqual(third.get(), 3)
+        try:
+            second.get()
+        except vkontakte.VKError as error:
+            self.assertEqual(error.code, 15)
+            self.assertEqual(error.params, {'owner_id': 1})
+        else:
+            self.fail('VKError not raised')
+
+    @mock.patch('djangocanvas.api.vkontakte.http.post')
+    def test_request_errors(self, post):
+        post.return_value = 500, ''
+
+        with self.api.batch() as batch:
+            result = batch.getServerTime()
+
+        self.assertRaises(vkontakte.VKError, result.get)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def _limiter(self, storage, **kwargs):
+        limiter = RateLimiter(storage, **kwargs)
+        limiter.sleep = mock.Mock()
+        return limiter
+
+    def _delays(self, limiter, calls, **kwargs):
+        with mock.patch('time.time', lambda: 1000.0):
+            return [limiter.acquire(**kwargs) for i in range(calls)]
+
+    def test_token_bucket(self):
+        limiter = self._limiter(LocalStorage(), token_rate=2)
+
+        self.assertEqual(self._delays(limiter, 4, token='a'), [0, 0, 0.5, 1.0])
+        self.assertEqual(self._delays(limiter, 1, token='b'), [0])
+        self.assertEqual(limiter.stats(), {'calls': 5, 'waits': 2, 'wait_time': 1.5, 'max_wait_time': 1.0})
+        self.assertEqual([call[0][0] for call in limiter.sleep.call_args_list], [0.5, 1.0])
+
+    def test_app_bucket(self):
+        limiter = self._limiter(LocalStorage(), token_rate=10, app_rate=1)
+
+        self.assertEqual(self._delays(limiter, 2, api_id='1', token='a'), [0, 1.0])
+
+    def test_file_storage(self):
+        path = tempfile.mktemp()
+
+        try:
+            self._delays(self._limiter(FileStorage(path), token_rate=1), 1, token='a')
+            self.assertEqual(self._delays(self._limiter(FileStorage(path), token_rate=1), 1, token='a'), [1.0])
+        finally:
+            os.remove(path)
+
+    def test_cache_storage(self):
+        from django.core.cache import get_cache
+        storage = CacheStorage(get_cache('django.core.cache.backends.locmem.LocMemCache'))
+
+        self.assertEqual(self._delays(self._limiter(storage, token_rate=1), 2, token='a'), [0, 1.0])
+
+    def test_cache_storage_locked(self):
+        """
+        Verify that buckets are kept locally after a few attempts to acquire a lock held by
+        another process, and that the lock is left alone.
+        """
+        cache = mock.Mock()
+        cache.add.return_value = False
+        storage = CacheStorage(cache)
+
+        self.assertEqual(self._delays(self._limiter(storage, token_rate=1), 2, token='a'), [0, 1.0])
+        self.assertEqual(cache.add.call_count, 2 * CacheStorage.LOCK_ATTEMPTS)
+        self.assertFalse(cache.set.called)
+        self.assertFalse(cache.delete.called)
+
+    def test_cache_storage_unavailable(self):
+        """
+        Verify that buckets are kept locally right away if the cache fails.
+        """
+        cache = mock.Mock()
+        cache.add.side_effect = IOError('Connection refused')
+        storage = CacheStorage(cache)
+
+        self.assertEqual(self._delays(self._limiter(storage, token_rate=1), 2, token='a'), [0, 1.0])
+        self.assertEqual(cache.add.call_count, 2)
+
+    def test_cache_storage_lock_expired(self):
+        """
+        Verify that a lock that expired and was acquired by another process isn't released.
+        """
+        from django.core.cache import get_cache
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        storage = CacheStorage(cache, prefix='')
+
+        def update(value):
+            cache.set('a.lock', 'other', 1)
+            return 1, 1, None
+
+        storage.update('a', update)
+        self.assertEqual(cache.get('a.lock'), 'other')
+
+        cache.delete('a.lock')
+        storage.update('a', lambda value: (2, 1, None))
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(cache.get('a.lock'), None)
+
+    @mock.patch('djangocanvas.api.vkontakte.http.post')
+    def test_api_calls_wait(self, post):
+        post.return_value = 200, '{"response":123}'
+        api = vkontakte.API(token='token')
+        api.rate_limiter = limiter = self._limiter(LocalStorage(), token_rate=1)
+
+        with mock.patch('time.time', lambda: 1000.0):
+            api.getServerTime()
+            api.friends.get()
+
+        self.assertEqual(limiter.stats()['waits'], 1)
+
+
+class VkontakteLaunchParametersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.patchers = [
+            mock.patch.object(settings, 'VK_APP_ID', '123', create=True),
+            mock.patch.object(settings, 'VK_APP_SECRET', 'secret', create=True),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        self.data = QueryDict('', mutable=True)
+        self.data.update({
+            'api_url': 'http://api.vk.com/api.php', 'api_id': '123', 'user_id': '0', 'sid': 'sid',
+            'secret': 'abc', 'group_id': '0', 'viewer_id': '42', 'is_app_user': '1', 'viewer_type': '2',
+            'auth_key': md5('123_42_secret').hexdigest(), 'access_token': 'token', 'api_settings': '0',
+            'api_result': '{"response":[{"uid":42,"first_name":"Pavel","last_name":"Durov"}]}',
+            'referrer': 'menu'
+        })
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_compatible_with_form(self):
+        form = VkontakteIframeForm(self.data)
+        parameters = VkontakteLaunchParameters(self.data)
+
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertTrue(parameters.is_valid())
+        self.assertEqual(parameters.cleaned_data, form.cleaned_data)
+        self.assertEqual(parameters.vk_user_id(), 42)
+        self.assertEqual(parameters.profile_api_result(), form.profile_api_result())
+
+    def test_coerced_like_form(self):
+        """
+        is_app_user and optional integers are coerced, or rejected, as the form does.
+        """
+        cases = [('is_app_user', value) for value in ('', '0', 'False', 'false', 'FALSE', 'yes')]
+        cases += [('poster_id', value) for value in ('', '15', 'abc')]
+
+        for name, value in cases:
+            data = self.data.copy()
+            data[name] = value
+            form = VkontakteIframeForm(data)
+            parameters = VkontakteLaunchParameters(data)
+
+            self.assertEqual(parameters.is_valid(), form.is_valid(), (name, value))
+            if form.is_valid():
+                self.assertEqual(parameters.cleaned_data, form.cleaned_data, (name, value))
+
+    def test_invalid_auth_key(self):
+        self.data['auth_key'] = md5('123_43_secret').hexdigest()
+        parameters = VkontakteLaunchParameters(self.data)
+
+        self.assertFalse(parameters.is_valid())
+        self.assertTrue('auth_key' in parameters.errors)
+
+    def test_other_application(self):
+        self.data['api_id'] = '124'
+        self.data['auth_key'] = md5('124_42_secret').hexdigest()
+
+        self.assertFalse(VkontakteLaunchParameters(self.data).is_valid())
+
+    def test_missing_viewer_id(self):
+        del self.data['viewer_id']
+
+        self.assertFalse(VkontakteLaunchParameters(self.data).is_valid())
+
+    def test_missing_required_parameters(self):
+        """
+        Launches lacking parameters the form requires, such as access_token, are rejected like by the form.
+        """
+        for name in ('access_token', 'sid', 'group_id'):
+            data = self.data.copy()
+            del data[name]
+            parameters = VkontakteLaunchParameters(data)
+
+            self.assertFalse(VkontakteIframeForm(data).is_valid())
+            self.assertFalse(parameters.is_valid())
+            self.assertTrue(name in parameters.errors)
+
+        self.data['group_id'] = 'abc'
+        self.assertFalse(VkontakteLaunchParameters(self.data).is_valid())
+
+
+class VkontakteRelaunchTest(TestCase):
+
+    def setUp(self):
+        self.patchers = [
+            mock.patch.object(settings, 'VK_APP_ID', '123', create=True),
+            mock.patch.object(settings, 'VK_APP_SECRET', 'secret', create=True),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+        self.session = SessionBase()
+        self.parameters = {
+            'api_url': 'http://api.vk.com/api.php', 'api_id': '123', 'user_id': '0', 'sid': 'sid',
+            'secret': 'abc', 'group_id': '0', 'viewer_id': '42', 'viewer_type': '2',
+            'auth_key': md5('123_42_secret').hexdigest(), 'access_token': 'token', 'api_settings': '0'
+        }
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _launch(self, **parameters):
+        request = RequestFactory().get('/', dict(self.parameters, **parameters))
+        request.session = self.session
+        self.session.modified = False
+
+        VkontakteMiddleware().process_request(request)
+
+        return request
+
+    def test_relaunch(self):
+        request = self._launch()
+        self.assertTrue(self.session.modified)
+        self.assertEqual(SocialUser.objects.get(social_id=42).provider, 'vkontakte')
+
+        with self.assertNumQueries(0):
+            request = self._launch()
+
+        self.assertFalse(self.session.modified)
+        self.assertEqual(request.social_data.token, 'token')
+
+    def test_new_access_token(self):
+        self._launch()
+
+        with self.assertNumQueries(1):
+            request = self._launch(access_token='other')
+
+        self.assertTrue(self.session.modified)
+        self.assertEqual(request.social_data.token, 'other')
+
+    def test_freshness_window(self):
+        self._launch()
+        self.session[VK_SYNCED_AT_SESSION_KEY] -= 301
+
+        self._launch()
+
+        self.assertTrue(self.session.modified)
+
+    def test_session_of_other_user(self):
+        """
+        A relaunch is verified and synced again if the session has been logged in with another user meanwhile.
+        """
+        self._launch()
+        other = SocialUser.objects.create(social_id=43, provider='vkontakte')
+        self.session[SESSION_KEY] = other.pk
+
+        request = self._launch()
+
+        self.assertTrue(self.session.modified)
+        self.assertEqual(self.session[SESSION_KEY], SocialUser.objects.get(social_id=42).pk)
+        self.assertEqual(request._cached_social_user.social_id, 42)
+
+    def test_reinstalled_application(self):
+        """
+        A relaunch marks the user as authorized again if is_app_user says the application was reinstalled.
+        """
+        self._launch()
+        SocialUser.objects.filter(social_id=42).update(authorized=False)
+        social_user_cache.clear()
+
+        self._launch(is_app_user='1')
+
+        self.assertFalse(self.session.modified)
+        self.assertTrue(SocialUser.objects.get(social_id=42).authorized)
+
+    def test_forged_relaunch(self):
+        self._launch()
+
+        request = self._launch(viewer_id='43')
+
+        self.assertFalse(self.session.modified)
+        self.assertFalse(SocialUser.objects.filter(social_id=43).exists())
+
+
+class SlowStubHandler(StubHandler):
+
+    def do_POST(self):
+        params = urlparse.parse_qs(self.read_body())
+        self.work(0.02)
+
+        if params['method'][0] == 'secure.fail':
+            body = '{"error":{"error_code":5,"error_msg":"User authorization failed","request_params":[]}}'
+        else:
+            body = '{"response":"%s"}' % params['method'][0]
+
+        self.respond(body)
+
+
+class AsyncAPITest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(SlowStubHandler)
+        self.server.start()
+
+        self.pool = RequestPool(concurrency=3)
+        self.api = vkontakte.AsyncAPI(API_ID, API_SECRET, pool=self.pool)
+
+        self.patcher = mock.patch('djangocanvas.api.vkontakte.api.API_URL',
+                                  self.server.url + '/api.php')
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.pool.close()
+        vkontakte.http.pool.clear()
+        self.server.stop()
+
+    def test_default_pool_is_shared(self):
+        """
+        Verify that the VK API and Graph API clients send requests on the same pool by default.
+        """
+        from djangocanvas.api.facepy import AsyncGraphAPI
+
+        self.assertTrue(vkontakte.AsyncAPI(API_ID, API_SECRET).friends.pool is AsyncGraphAPI().pool)
+
+    def test_concurrency_is_limited(self):
+        results = [self.api.friends.get(uid=i) for i in range(9)] + [self.api.get('getServerTime')]
+
+        self.assertEqual([result.get(5) for result in results], ['friends.get'] * 9 + ['getServerTime'])
+        self.assertEqual(self.server.peak, 3)
+        self.assertEqual(self.pool.stats()['pending'], 0)
+
+    def test_errors(self):
+        result = self.api.secure.fail()
+        self.assertRaises(vkontakte.VKError, result.get, 5)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,17 @@
 import re
-from datetime import timedelta
+import hashlib
+import httplib
+from collections import namedtuple
+from datetime import datetime, timedelta
 from urlparse import urlparse
-from functools import wraps
+from functools import wraps, partial
 from urllib import quote_plus
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import smart_str
 from django.utils.importlib import import_module
 
 from djangocanvas.settings import FACEBOOK_APPLICATION_CANVAS_URL
@@ -15,8 +22,189 @@ from djangocanvas.settings import ENABLED_PATHS
 from djangocanvas.settings import AUTHORIZATION_DENIED_VIEW
 from djangocanvas.settings import VK_APP_ID, VK_APP_SECRET, FACEBOOK_APPLICATION_ID, \
     FACEBOOK_APPLICATION_SECRET_KEY
-from djangocanvas.api import vkontakte
-from djangocanvas.api.facepy import GraphAPI, get_application_access_token
+from djangocanvas.settings import SIGNED_REQUEST_CACHE_SIZE, SIGNED_REQUEST_CACHE_TIMEOUT
+from djangocanvas.settings import APPLICATION_ACCESS_TOKEN_CACHE_TIMEOUT, APPLICATION_ACCESS_TOKEN_CACHE_SHARED
+from djangocanvas.settings import GRAPH_API_POOL_SIZE, GRAPH_API_TIMEOUT
+from djangocanvas.settings import GRAPH_API_CACHE_TIMEOUTS, GRAPH_API_CACHE_SIZE, GRAPH_API_CACHE_SHARED
+from djangocanvas.settings import VK_RATE_LIMIT, VK_APP_RATE_LIMIT, VK_RATE_LIMIT_SHARED, VK_RATE_LIMIT_FILE
+from djangocanvas.settings import API_METRICS, API_METRICS_SINKS
+from djangocanvas.api import metrics, vkontakte
+from djangocanvas.api.vkontakte.ratelimit import RateLimiter, LocalStorage, FileStorage, CacheStorage
+from djangocanvas.api.facepy import GraphAPI, SignedRequest, FacepyError, ResponseCache, \
+    with_application_access_token
+from djangocanvas.api.facepy.graph_api import sessions
+from djangocanvas.api.facepy.utils import application_access_token_cache
+from djangocanvas.cache import LRUCache, TieredCache
+
+
+signed_request_cache = LRUCache(max_size=SIGNED_REQUEST_CACHE_SIZE, timeout=SIGNED_REQUEST_CACHE_TIMEOUT)
+
+_configured = False
+_configure_lock = Lock()
+
+
+def configure():
+    """
+    Configure the Graph API and VK API clients according to djangocanvas' settings: connection
+    pooling, caching of application access tokens and responses, VK API rate limits and sinks
+    for measurements of requests.
+
+    It's called once djangocanvas' models are loaded and when its middleware is initialized;
+    calling it again has no effect.
+    """
+    global _configured
+
+    with _configure_lock:
+        if _configured:
+            return
+
+        _configured = True
+
+        application_access_token_cache.timeout = APPLICATION_ACCESS_TOKEN_CACHE_TIMEOUT
+        if APPLICATION_ACCESS_TOKEN_CACHE_SHARED:
+            application_access_token_cache.shared = cache
+
+        sessions.pool_size = GRAPH_API_POOL_SIZE
+        sessions.timeout = GRAPH_API_TIMEOUT
+
+        if GRAPH_API_CACHE_TIMEOUTS:
+            GraphAPI.default_cache = ResponseCache(
+                storage=TieredCache(
+                    LRUCache(max_size=GRAPH_API_CACHE_SIZE,
+                             timeout=max([timeout for path, timeout in GRAPH_API_CACHE_TIMEOUTS])),
+                    shared=cache if GRAPH_API_CACHE_SHARED else None
+                ),
+                timeouts=GRAPH_API_CACHE_TIMEOUTS
+            )
+
+        if VK_RATE_LIMIT or VK_APP_RATE_LIMIT:
+            if VK_RATE_LIMIT_SHARED:
+                storage = CacheStorage(cache)
+            elif VK_RATE_LIMIT_FILE:
+                storage = FileStorage(VK_RATE_LIMIT_FILE)
+            else:
+                storage = LocalStorage()
+
+            vkontakte.api._API.rate_limiter = RateLimiter(storage, token_rate=VK_RATE_LIMIT,
+                                                          app_rate=VK_APP_RATE_LIMIT)
+
+        if API_METRICS:
+            metrics.sinks.append(metrics.registry)
+
+        for path in API_METRICS_SINKS:
+            module_name, class_name = path.rsplit('.', 1)
+            metrics.sinks.append(getattr(import_module(module_name), class_name)())
+
+
+class PathMatcher(object):
+    """
+    Match paths against a list of regular expressions, such as those of the
+    DISABLED_PATHS and ENABLED_PATHS settings, without their leading slash.
+
+    Expressions are compiled once. Those that merely anchor a literal prefix (e.g. ``^admin/``)
+    are checked with a single ``str.startswith`` call; the rest are combined into a single
+    alternation, save for those with inline flags or backreferences, which are compiled
+    separately. The outcome is memoized per path.
+    """
+
+    # Characters with a special meaning in regular expressions.
+    METACHARACTERS = frozenset('.^$*+?{}[]|()')
+
+    # Inline flags (e.g. ``(?i)``) would apply to every expression of an alternation, and
+    # backreferences (e.g. ``\1`` or ``(?P=name)``) would refer to the groups of other expressions.
+    UNCOMBINABLE = re.compile(r'\(\?[iLmsux]+\)|(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=')
+
+    def __init__(self, patterns, cache_size=1000):
+        """
+        Initialize the matcher.
+
+        :param patterns: A list of strings describing regular expressions.
+        :param cache_size: An integer describing how many paths to memoize the outcome for.
+
+        Raises ``ImproperlyConfigured`` if an expression is invalid.
+        """
+        self.patterns = list(patterns)
+        self.cache_size = cache_size
+
+        prefixes, expressions, separate = [], [], []
+
+        for pattern in self.patterns:
+            try:
+                re.compile(pattern)
+            except re.error as exception:
+                raise ImproperlyConfigured('Invalid path expression "%s": %s' % (pattern, exception))
+
+            prefix = self._literal_prefix(pattern)
+
+            if prefix is not None:
+                prefixes.append(prefix)
+            elif self.UNCOMBINABLE.search(pattern):
+                separate.append(pattern)
+            else:
+                expressions.append(pattern)
+
+        self.prefixes = tuple(prefixes)
+        self.expressions = []
+
+        if expressions:
+            try:
+                self.expressions = [re.compile('|'.join(['(?:%s)' % expression for expression in expressions]))]
+            except re.error:
+                # Expressions may not combine, e.g. if they name groups alike.
+                self.expressions = [re.compile(expression) for expression in expressions]
+
+        self.expressions.extend([re.compile(expression) for expression in separate])
+
+        self._cache = {}
+
+    def matches(self, path):
+        """
+        Determine whether the path matches one or more of the expressions.
+
+        :param path: A string describing the path to be matched.
+        """
+        try:
+            return self._cache[path]
+        except KeyError:
+            pass
+
+        match = bool(self.prefixes) and path.startswith(self.prefixes, 1)
+
+        if not match and self.expressions:
+            match = any([expression.search(path[1:]) for expression in self.expressions])
+
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+
+        self._cache[path] = match
+
+        return match
+
+    def __nonzero__(self):
+        return bool(self.patterns)
+
+    def _literal_prefix(self, pattern):
+        """Return the literal a pattern like ``^admin/`` anchors, or ``None`` if it's no such pattern."""
+        if not pattern.startswith('^'):
+            return None
+
+        literal = []
+        characters = iter(pattern[1:])
+
+        for character in characters:
+            if character == '\\':
+                character = next(characters, '')
+                if not character or character.isalnum():
+                    return None
+            elif character in self.METACHARACTERS:
+                return None
+            literal.append(character)
+
+        return ''.join(literal)
+
+
+disabled_paths = PathMatcher(DISABLED_PATHS)
+enabled_paths = PathMatcher(ENABLED_PATHS)
 
 
 def is_disabled_path(path):
@@ -26,11 +214,7 @@ def is_disabled_path(path):
 
     :param path: A string describing the path to be matched.
     """
-    for disabled_path in DISABLED_PATHS:
-        match = re.search(disabled_path, path[1:])
-        if match:
-            return True
-    return False
+    return disabled_paths.matches(path)
 
 
 def is_enabled_path(path):
@@ -40,11 +224,7 @@ def is_enabled_path(path):
 
     :param path: A string describing the path to be matched.
     """
-    for enabled_path in ENABLED_PATHS:
-        match = re.search(enabled_path, path[1:])
-        if match:
-            return True
-    return False
+    return enabled_paths.matches(path)
 
 
 def cached_property(**kwargs):
@@ -73,6 +253,42 @@ def cached_property(**kwargs):
     return decorator
 
 
+def get_signed_request(signed_request, application_secret_key):
+    """
+    Parse and verify a signed request, reusing the ``SignedRequest`` instance of
+    a previous verification of the same signed request while it is cached.
+
+    Signed requests are held no longer than their OAuth token is valid.
+
+    :param signed_request: A string describing a signed request.
+    :param application_secret_key: A string describing the Facebook application's secret key.
+    """
+    key = hashlib.sha1(
+        smart_str(application_secret_key) + '.' + smart_str(signed_request)
+    ).hexdigest()
+
+    cached_signed_request = signed_request_cache.get(key)
+
+    if cached_signed_request is not None:
+        return cached_signed_request
+
+    signed_request = SignedRequest(
+        signed_request=signed_request,
+        application_secret_key=application_secret_key)
+
+    timeout = SIGNED_REQUEST_CACHE_TIMEOUT
+    oauth_token = signed_request.user.oauth_token
+
+    if oauth_token and oauth_token.expires_at:
+        delta = oauth_token.expires_at - datetime.now()
+        timeout = min(timeout, delta.days * 86400 + delta.seconds)
+
+    if timeout > 0:
+        signed_request_cache.set(key, signed_request, timeout)
+
+    return signed_request
+
+
 def authorization_denied_view(request):
     """Proxy for the view referenced in ``FANDJANGO_AUTHORIZATION_DENIED_VIEW``."""
     authorization_denied_module_name = AUTHORIZATION_DENIED_VIEW.rsplit('.', 1)[0]
@@ -106,8 +322,130 @@ def send_notification(user, message):
                               api_secret=VK_APP_SECRET)
         vkapi.get('secure.sendNotification', client_secret=VK_APP_SECRET, uid=user.social_id, message=message)
     else:
-        token = get_application_access_token(FACEBOOK_APPLICATION_ID, FACEBOOK_APPLICATION_SECRET_KEY)
-        graph = GraphAPI(token)
-        graph.post('/{social_id}/notifications?access_token={token}&template={message}'.format(social_id=user.social_id,
-                                                                                               token=token,
-                                                                                               message=quote_plus(message.encode('utf-8'))))
+        def post(token):
+            graph = GraphAPI(token)
+            graph.post('/{social_id}/notifications?access_token={token}&template={message}'.format(social_id=user.social_id,
+                                                                                                   token=token,
+                                                                                                   message=quote_plus(message.encode('utf-8'))))
+
+        with_application_access_token(FACEBOOK_APPLICATION_ID, FACEBOOK_APPLICATION_SECRET_KEY, post)
+
+
+# The number of users VK's ``secure.sendNotification`` method accepts at once.
+VK_NOTIFICATION_BATCH_SIZE = 100
+
+# The number of requests the Graph API accepts in a single batch request.
+FACEBOOK_NOTIFICATION_BATCH_SIZE = 50
+
+# Exceptions transport failures of VK API and Graph API requests surface as, besides
+# ``VKError`` and ``FacepyError``; ``socket.error`` is an ``IOError``.
+TRANSPORT_ERRORS = (IOError, httplib.HTTPException)
+
+NotificationResult = namedtuple('NotificationResult', ['user', 'sent', 'error'])
+"""
+The outcome of notifying a user; ``sent`` is a boolean describing whether the notification
+was delivered and ``error`` is the exception it failed with, if any.
+"""
+
+
+def send_notifications(users, message, workers=4):
+    """
+    Send a notification to several users, yielding a ``NotificationResult`` for each user
+    as soon as the batch of users it belongs to has been notified.
+
+    VK users are notified in batches of ``VK_NOTIFICATION_BATCH_SIZE`` with ``secure.sendNotification``
+    and Facebook users in batches of ``FACEBOOK_NOTIFICATION_BATCH_SIZE`` with Graph API batch requests.
+
+    :param users: An iterable of ``SocialUser`` instances.
+    :param message: A string describing the notification.
+    :param workers: An integer describing how many batches to send concurrently.
+    """
+    vk_users, facebook_users = [], []
+
+    for user in users:
+        if user.provider == 'vkontakte':
+            vk_users.append(user)
+        else:
+            facebook_users.append(user)
+
+    jobs = []
+
+    if vk_users:
+        vkapi = vkontakte.API(api_id=VK_APP_ID, api_secret=VK_APP_SECRET)
+        jobs += [
+            partial(_send_vkontakte_notifications, vkapi, batch, message)
+            for batch in _batches(vk_users, VK_NOTIFICATION_BATCH_SIZE)
+        ]
+
+    if facebook_users:
+        jobs += [
+            partial(_send_facebook_notifications, batch, message)
+            for batch in _batches(facebook_users, FACEBOOK_NOTIFICATION_BATCH_SIZE)
+        ]
+
+    if not jobs:
+        return
+
+    pool = ThreadPool(min(workers, len(jobs)))
+    finished = False
+
+    try:
+        for results in pool.imap_unordered(_run_job, jobs):
+            for result in results:
+                yield result
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            # The caller has stopped reading results; don't send the batches still queued.
+            pool.terminate()
+
+
+def _run_job(job):
+    return job()
+
+
+def _batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _send_vkontakte_notifications(vkapi, users, message):
+    try:
+        response = vkapi.get(
+            'secure.sendNotification',
+            client_secret=VK_APP_SECRET,
+            uids=','.join([str(user.social_id) for user in users]),
+            message=message)
+    except (vkontakte.VKError,) + TRANSPORT_ERRORS as exception:
+        return [NotificationResult(user, False, exception) for user in users]
+
+    # VK responds with a comma-separated list of the users that were notified.
+    recipients = set(str(response or '').split(','))
+
+    return [NotificationResult(user, str(user.social_id) in recipients, None) for user in users]
+
+
+def _send_facebook_notifications(users, message):
+    requests = [{
+        'method': 'POST',
+        'relative_url': '%s/notifications' % user.social_id,
+        'body': {'template': message.encode('utf-8')}
+    } for user in users]
+
+    try:
+        responses = with_application_access_token(
+            FACEBOOK_APPLICATION_ID, FACEBOOK_APPLICATION_SECRET_KEY,
+            lambda token: list(GraphAPI(token).batch(requests)))
+    except (FacepyError,) + TRANSPORT_ERRORS as exception:
+        return [NotificationResult(user, False, exception) for user in users]
+
+    results = []
+
+    for user, response in zip(users, responses):
+        if isinstance(response, Exception):
+            results.append(NotificationResult(user, False, response))
+        else:
+            results.append(NotificationResult(user, bool(response and response.get('success')), None))
+
+    return results
@@ -1,8 +1,9 @@
 from urllib import urlencode
 
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.shortcuts import render
 
+from djangocanvas.api import metrics
 from djangocanvas.models import SocialUser
 from djangocanvas.settings import (
     FACEBOOK_APPLICATION_ID, FACEBOOK_APPLICATION_DOMAIN,
@@ -73,3 +74,14 @@ def deauthorize_application(request):
     else:
         logger.info(u'Vkontakte application deauthorization')
         return HttpResponse(status=400)
+
+
+def api_metrics(request):
+    """
+    Render measurements of Graph API and VK API requests in Prometheus' text exposition format,
+    if they're kept in memory (see DJANGOCANVAS_API_METRICS).
+    """
+    if metrics.registry not in metrics.sinks:
+        raise Http404
+
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -13,6 +13,8 @@ setup(
     packages=[
         'djangocanvas',
         'djangocanvas.templatetags',
+        'djangocanvas.management',
+        'djangocanvas.management.commands',
         'djangocanvas.api',
         'djangocanvas.api.facepy',
         'djangocanvas.api.vkontakte',